@@ -0,0 +1,274 @@
+"""
+Concurrency admission control for upstream calls.
+
+Each identity (workspace) may hold at most per_identity upstream calls at
+once, and the gateway as a whole at most max_concurrent. Requests over
+either cap wait in bounded per-class queues. Free slots are handed out by
+weighted fair queuing across classes (interactive ahead of agent ahead of
+ci), skipping waiters whose identity is already at its cap. A request that
+waits longer than queue_timeout is rejected.
+
+Each latency class (interactive IDE, agent, CI) owns `reserved` slots that
+no other class may use, so a CI burst cannot take the capacity a developer's
+next completion needs. The rest of max_concurrent is a shared pool that any
+class borrows while it is idle, up to the class's `limit`. A class below its
+reservation is served before the shared pool is shared out.
+"""
+
+import time
+import asyncio
+import fnmatch
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Deque
+
+logger = logging.getLogger(__name__)
+
+CLASSES = ("interactive", "agent", "ci")
+DEFAULT_WEIGHTS = {"interactive": 8, "agent": 2, "ci": 1}
+
+
+class AdmissionRejected(Exception):
+    """The request could not get an upstream slot (queue full or timed out)"""
+
+    def __init__(self, reason: str, traffic_class: str, retry_after: int = 5):
+        super().__init__(f"{reason} ({traffic_class})")
+        self.reason = reason
+        self.traffic_class = traffic_class
+        self.retry_after = retry_after
+
+
+def classify_scope(scope: Optional[str]) -> str:
+    """Traffic class for a key scope (ci, agent:*, workspace:*, user:*)"""
+    if not scope:
+        return "interactive"
+    if scope == "ci" or scope.startswith("ci:"):
+        return "ci"
+    if scope.startswith("agent:") or scope == "agent":
+        return "agent"
+    return "interactive"
+
+
+def classify(scope: Optional[str], template_name: Optional[str], templates: Dict[str, str]) -> str:
+    """Traffic class from the key scope, else the first matching template pattern"""
+    if scope:
+        return classify_scope(scope)
+    if template_name:
+        for pattern, traffic_class in templates.items():
+            if fnmatch.fnmatchcase(template_name, pattern) and traffic_class in CLASSES:
+                return traffic_class
+    return "interactive"
+
+
+class Waiter:
+    __slots__ = ("future", "identity", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, identity: str):
+        self.future = future
+        self.identity = identity
+        self.enqueued_at = time.monotonic()
+
+
+class SlotLease:
+    """An admitted upstream slot, handed back exactly once by whichever path ends it first"""
+
+    __slots__ = ("controller", "identity", "traffic_class", "released")
+
+    def __init__(self, controller: "AdmissionController", identity: str, traffic_class: str):
+        self.controller = controller
+        self.identity = identity
+        self.traffic_class = traffic_class
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.identity, self.traffic_class)
+
+
+class AdmissionController:
+    """Global and per-identity concurrency caps with weighted-fair queues"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_concurrent: int = 64,
+        per_identity: int = 4,
+        max_queue: int = 256,
+        queue_timeout: float = 30.0,
+        weights: Optional[Dict[str, int]] = None,
+        reserved: Optional[Dict[str, int]] = None,
+        limits: Optional[Dict[str, int]] = None,
+        templates: Optional[Dict[str, str]] = None
+    ):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.per_identity = per_identity
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.reserved = {c: int((reserved or {}).get(c, 0)) for c in CLASSES}
+        if sum(self.reserved.values()) > max_concurrent:
+            logger.warning(f"Admission reservations {self.reserved} exceed max_concurrent={max_concurrent}; "
+                           "classes may wait for their reserved slots")
+        self.shared = max(0, max_concurrent - sum(self.reserved.values()))
+        self.limits = {c: int((limits or {}).get(c, max_concurrent)) for c in CLASSES}
+        # X-Template-Name glob -> traffic class, for requests without a key scope
+        self.templates = dict(templates or {})
+        self.in_flight = 0
+        self.by_class: Dict[str, int] = {c: 0 for c in CLASSES}
+        self.by_identity: Dict[str, int] = {}
+        self.queues: Dict[str, Deque[Waiter]] = {c: deque() for c in CLASSES}
+        # Virtual finish time per class for weighted fair queuing
+        self._vtime: Dict[str, float] = {c: 0.0 for c in CLASSES}
+        self.stats = {"admitted": 0, "queued": 0, "borrowed": 0, "rejected_full": 0, "rejected_timeout": 0}
+        self.on_wait = None  # Optional callback(traffic_class, seconds)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "AdmissionController":
+        admission_config = config.get("admission", {}) or {}
+        return cls(
+            enabled=admission_config.get("enabled", True),
+            max_concurrent=int(admission_config.get("max_concurrent", 64)),
+            per_identity=int(admission_config.get("per_identity", 4)),
+            max_queue=int(admission_config.get("max_queue", 256)),
+            queue_timeout=float(admission_config.get("queue_timeout_seconds", 30)),
+            weights=admission_config.get("class_weights"),
+            reserved=admission_config.get("reserved"),
+            limits=admission_config.get("limits"),
+            templates=admission_config.get("templates"),
+        )
+
+    def classify(self, scope: Optional[str], template_name: Optional[str] = None) -> str:
+        return classify(scope, template_name, self.templates)
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {c: len(q) for c, q in self.queues.items()}
+
+    def class_in_flight(self) -> Dict[str, int]:
+        return dict(self.by_class)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "reserved": self.reserved,
+            "shared": self.shared,
+            "limits": self.limits,
+            "in_flight": self.class_in_flight(),
+        }
+
+    def _shared_in_use(self) -> int:
+        return sum(max(0, self.by_class[c] - self.reserved[c]) for c in CLASSES)
+
+    def _class_has_room(self, traffic_class: str) -> bool:
+        """A slot of the class's own reservation, or one borrowed from the shared pool"""
+        held = self.by_class[traffic_class]
+        if self.in_flight >= self.max_concurrent or held >= self.limits[traffic_class]:
+            return False
+        return held < self.reserved[traffic_class] or self._shared_in_use() < self.shared
+
+    def _can_admit(self, identity: str, traffic_class: str) -> bool:
+        return self._class_has_room(traffic_class) and self.by_identity.get(identity, 0) < self.per_identity
+
+    def _take(self, identity: str, traffic_class: str):
+        if self.by_class[traffic_class] >= self.reserved[traffic_class]:
+            self.stats["borrowed"] += 1
+        self.in_flight += 1
+        self.by_class[traffic_class] += 1
+        self.by_identity[identity] = self.by_identity.get(identity, 0) + 1
+        self.stats["admitted"] += 1
+
+    def release(self, identity: str, traffic_class: str = "interactive"):
+        if not self.enabled:
+            return
+        if traffic_class not in self.by_class:
+            traffic_class = "interactive"
+        self.in_flight -= 1
+        self.by_class[traffic_class] -= 1
+        remaining = self.by_identity.get(identity, 1) - 1
+        if remaining:
+            self.by_identity[identity] = remaining
+        else:
+            self.by_identity.pop(identity, None)
+        self._dispatch()
+
+    def _next_waiter(self, traffic_class: str) -> Optional[Waiter]:
+        """First waiter in a class whose identity is under its cap"""
+        for waiter in self.queues[traffic_class]:
+            if self.by_identity.get(waiter.identity, 0) < self.per_identity:
+                return waiter
+        return None
+
+    def _dispatch(self):
+        while self.in_flight < self.max_concurrent:
+            best, best_class, best_rank = None, None, None
+            for traffic_class in CLASSES:
+                if not self.queues[traffic_class] or not self._class_has_room(traffic_class):
+                    continue
+                # Classes below their reservation first, then weighted-fair over the shared pool
+                rank = (self.by_class[traffic_class] >= self.reserved[traffic_class], self._vtime[traffic_class])
+                if best_rank is not None and rank >= best_rank:
+                    continue
+                waiter = self._next_waiter(traffic_class)
+                if waiter is not None:
+                    best, best_class, best_rank = waiter, traffic_class, rank
+            if best is None:
+                return
+
+            self.queues[best_class].remove(best)
+            # Classes that were idle do not bank credit while idle
+            floor = min(self._vtime[c] for c in CLASSES if self.queues[c] or c == best_class)
+            self._vtime[best_class] = max(self._vtime[best_class], floor) + 1.0 / self.weights[best_class]
+            self._take(best.identity, best_class)
+            best.future.set_result(True)
+            if self.on_wait:
+                self.on_wait(best_class, time.monotonic() - best.enqueued_at)
+
+    async def acquire(self, identity: str, traffic_class: str = "interactive"):
+        """Wait for an upstream slot or raise AdmissionRejected"""
+        if not self.enabled:
+            return
+        if traffic_class not in self.queues:
+            traffic_class = "interactive"
+
+        # Waiters of other classes are only left queued when they cannot use a free slot
+        if self._can_admit(identity, traffic_class) and not self.queues[traffic_class]:
+            self._take(identity, traffic_class)
+            return
+
+        queue = self.queues[traffic_class]
+        if len(queue) >= self.max_queue:
+            self.stats["rejected_full"] += 1
+            raise AdmissionRejected("queue_full", traffic_class)
+
+        waiter = Waiter(asyncio.get_running_loop().create_future(), identity)
+        queue.append(waiter)
+        self.stats["queued"] += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Admitted at the same moment we gave up: hand the slot back
+                self.release(identity, traffic_class)
+            else:
+                queue.remove(waiter)
+                waiter.future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["rejected_timeout"] += 1
+                raise AdmissionRejected("queue_timeout", traffic_class, retry_after=max(1, int(self.queue_timeout)))
+            raise
+
+    async def lease(self, identity: str, traffic_class: str = "interactive") -> SlotLease:
+        """acquire() for a slot whose release cannot be scoped to a block, e.g. one held by a streamed response"""
+        await self.acquire(identity, traffic_class)
+        return SlotLease(self, identity, traffic_class)
+
+    @asynccontextmanager
+    async def slot(self, identity: str, traffic_class: str = "interactive"):
+        await self.acquire(identity, traffic_class)
+        try:
+            yield
+        finally:
+            self.release(identity, traffic_class)
@@ -0,0 +1,144 @@
+"""
+Prompt-prefix affinity across upstream keys and regions (config: affinity).
+
+With several Anthropic API keys (ANTHROPIC_API_KEYS) or Bedrock regions
+(providers.bedrock.regions), provider-side prompt caches only help if the
+turns of one conversation keep landing on the same key or region. Each
+request's stable prefix -- model, system prompt and the first
+prefix_messages messages, which later turns repeat verbatim -- is hashed
+onto a consistent-hash ring of that provider's targets.
+
+The ring uses bounded loads (Mirrokni et al., "Consistent Hashing with
+Bounded Loads"): a target never carries more than load_factor times the
+average in-flight load. When a conversation's home target is full the
+request walks on to the next target on the ring, so a hot conversation
+spills over instead of overloading one key, and returns home once the
+load drops. Adding or removing a target only moves the conversations
+that hashed to it.
+"""
+
+import bisect
+import hashlib
+import logging
+import math
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+
+from encoding import canonical_dumps
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def prefix_key(model: str, system: Any, messages: List[Any], depth: int = 1) -> Optional[str]:
+    """Hash of the part of a prompt that stays the same across a conversation's turns"""
+    if not messages and not system:
+        return None
+    return hashlib.blake2b(canonical_dumps([model, system, messages[:depth]]), digest_size=16).hexdigest()
+
+
+class BoundedLoadRing:
+    """Consistent-hash ring whose targets are capped at load_factor x the mean load"""
+
+    def __init__(self, targets: List[str], virtual_nodes: int = 100, load_factor: float = 1.25):
+        self.targets = list(targets)
+        self.load_factor = load_factor
+        points = sorted(
+            (_hash(f"{target}#{i}".encode()), target)
+            for target in self.targets for i in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [t for _, t in points]
+        self.in_flight: Dict[str, int] = {t: 0 for t in self.targets}
+
+    def capacity(self) -> int:
+        """Per-target in-flight cap, counting the request being placed"""
+        total = sum(self.in_flight.values()) + 1
+        return math.ceil(self.load_factor * total / len(self.targets))
+
+    def place(self, key: str) -> Iterator[str]:
+        """Distinct targets in ring order from the key's position (home first)"""
+        start = bisect.bisect(self._hashes, _hash(key.encode()))
+        seen = set()
+        for i in range(len(self._owners)):
+            target = self._owners[(start + i) % len(self._owners)]
+            if target not in seen:
+                seen.add(target)
+                yield target
+                if len(seen) == len(self.targets):
+                    return
+
+    def pick(self, key: Optional[str]) -> Tuple[str, bool]:
+        """(target, is_home): the first target on the key's walk that is under capacity"""
+        if key is None:
+            return min(self.targets, key=lambda t: self.in_flight[t]), False
+        cap = self.capacity()
+        home = None
+        for target in self.place(key):
+            home = home or target
+            if self.in_flight[target] < cap:
+                return target, target == home
+        return home, True
+
+
+class AffinityRouter:
+    """Picks an upstream key or region per request and tracks in-flight load"""
+
+    def __init__(
+        self,
+        targets: Dict[str, List[str]],
+        enabled: bool = True,
+        prefix_messages: int = 1,
+        virtual_nodes: int = 100,
+        load_factor: float = 1.25
+    ):
+        self.enabled = enabled
+        self.prefix_messages = prefix_messages
+        self.rings = {
+            provider: BoundedLoadRing(names, virtual_nodes, load_factor)
+            for provider, names in targets.items() if names
+        }
+        self.stats = {"home": 0, "spilled": 0, "unkeyed": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], targets: Dict[str, List[str]]) -> "AffinityRouter":
+        affinity_config = config.get("affinity", {}) or {}
+        return cls(
+            targets=targets,
+            enabled=affinity_config.get("enabled", True),
+            prefix_messages=int(affinity_config.get("prefix_messages", 1)),
+            virtual_nodes=int(affinity_config.get("virtual_nodes", 100)),
+            load_factor=float(affinity_config.get("load_factor", 1.25)),
+        )
+
+    def key_for(self, model: str, system: Any, messages: List[Any]) -> Optional[str]:
+        if not self.enabled:
+            return None
+        return prefix_key(model, system, messages, self.prefix_messages)
+
+    @contextmanager
+    def lease(self, provider: str, key: Optional[str]):
+        """Hold a target for the duration of one upstream call; yields its name (None if unconfigured)"""
+        ring = self.rings.get(provider)
+        if ring is None:
+            yield None
+            return
+        if len(ring.targets) == 1:
+            target = ring.targets[0]
+        else:
+            target, home = ring.pick(key)
+            self.stats["unkeyed" if key is None else "home" if home else "spilled"] += 1
+        ring.in_flight[target] += 1
+        try:
+            yield target
+        finally:
+            ring.in_flight[target] -= 1
+
+    def in_flight(self) -> Dict[str, int]:
+        return {f"{provider}:{t}": n for provider, ring in self.rings.items() for t, n in ring.in_flight.items()}
+
+    def status(self) -> Dict[str, Any]:
+        return {provider: ring.targets for provider, ring in self.rings.items()}
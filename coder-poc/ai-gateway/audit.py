@@ -0,0 +1,243 @@
+"""
+Asynchronous audit log (config: audit).
+
+Request handlers only enqueue a dict; a writer thread serializes records
+(orjson when installed), appends them to a JSONL file in batches and rotates
+it by size and age, optionally gzipping rotated files. The queue is bounded:
+when the writer falls behind, new records are dropped and counted rather
+than blocking the event loop.
+
+Without a log_file (or if it cannot be opened) records go to the console
+logger, still from the writer thread. log_file may contain {pid} so that
+each gateway worker writes and rotates its own file; with more than one
+worker it is added when missing, since workers sharing a file would each
+rotate it. Rotated files still being gzipped are left alone by pruning.
+"""
+
+import os
+import gzip
+import json
+import time
+import queue
+import shutil
+import logging
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, default=str, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class AuditLog:
+    """Bounded queue plus a batching, rotating JSONL writer thread"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        log_file: Optional[str] = None,
+        max_bytes: int = 100 * 1024 * 1024,
+        rotate_interval: int = 86400,
+        backup_count: int = 7,
+        compress: bool = True,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0
+    ):
+        self.enabled = enabled
+        self.path = log_file.format(pid=os.getpid()) if log_file else None
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        # Rotated files being gzipped, by path
+        self._compressing: Dict[str, threading.Thread] = {}
+        self._compress_lock = threading.Lock()
+        self.stats = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0, "write_errors": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "AuditLog":
+        audit_config = config.get("audit", {}) or {}
+        log_file = os.getenv("AI_GATEWAY_AUDIT_LOG", audit_config.get("log_file"))
+        workers = int(os.getenv("AI_GATEWAY_WORKERS") or (config.get("server", {}) or {}).get("workers", 1))
+        if log_file and workers > 1 and "{pid}" not in log_file:
+            # Workers appending to and rotating one file would rename it under each other
+            root, ext = os.path.splitext(log_file)
+            log_file = f"{root}.{{pid}}{ext}"
+            logger.info(f"Audit log: one file per worker ({log_file})")
+        return cls(
+            enabled=audit_config.get("enabled", True),
+            log_file=log_file,
+            max_bytes=int(audit_config.get("max_size_mb", 100)) * 1024 * 1024,
+            rotate_interval=int(audit_config.get("rotate_interval", 86400)),
+            backup_count=int(audit_config.get("backup_count", 7)),
+            compress=audit_config.get("compress", True),
+            queue_size=int(audit_config.get("queue_size", 10000)),
+            batch_size=int(audit_config.get("batch_size", 500)),
+            flush_interval=float(audit_config.get("flush_interval", 1.0)),
+        )
+
+    def emit(self, record: Dict[str, Any]):
+        """Queue a record; never blocks (drops when the writer is behind)"""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # -------------------------------------------------------------------------
+    # Writer thread
+    # -------------------------------------------------------------------------
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        if self.path:
+            try:
+                self._open()
+                logger.info(f"Audit log: {self.path}")
+            except OSError as e:
+                logger.warning(f"Audit log {self.path} unavailable ({e}); writing to console")
+                self.path = None
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued records and stop the writer"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        if self._file:
+            self._file.close()
+            self._file = None
+        with self._compress_lock:
+            compressing = list(self._compressing.values())
+        for thread in compressing:
+            thread.join(timeout)
+
+    def _next_batch(self) -> Optional[List[Dict[str, Any]]]:
+        """Up to batch_size records, waiting at most flush_interval; None on shutdown"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        if first is None:
+            return None
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is None:
+                self._write(batch)
+                return None
+            batch.append(record)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            data = b"".join(_dumps(record) for record in batch)
+            if self._file is None:
+                for line in data.decode("utf-8").splitlines():
+                    logger.info(line)
+            else:
+                if self._size + len(data) > self.max_bytes or time.time() - self._opened_at > self.rotate_interval:
+                    self._rotate()
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["write_errors"] += 1
+            self.stats["dropped"] += len(batch)
+            logger.warning(f"Audit log write failed: {e}")
+
+    # -------------------------------------------------------------------------
+    # Rotation
+    # -------------------------------------------------------------------------
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        rotated = f"{self.path}.{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}"
+        if self._size:
+            os.replace(self.path, rotated)
+        self._open()
+        self.stats["rotations"] += 1
+        if self.compress and os.path.exists(rotated):
+            # Compress off the writer thread so appends are not held up
+            thread = threading.Thread(target=self._compress, args=(rotated,), daemon=True)
+            with self._compress_lock:
+                self._compressing[rotated] = thread
+            thread.start()
+        else:
+            self._prune()
+
+    def _compress(self, path: str):
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Audit log compression failed for {path}: {e}")
+        with self._compress_lock:
+            self._compressing.pop(path, None)
+        self._prune()
+
+    def _prune(self):
+        """Keep the newest backup_count rotated files, skipping those still being compressed"""
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        with self._compress_lock:
+            busy = {os.path.basename(path) for path in self._compressing}
+        backups = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith(prefix) and name not in busy and name.removesuffix(".gz") not in busy
+        )
+        for name in backups[:-self.backup_count] if self.backup_count else backups:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
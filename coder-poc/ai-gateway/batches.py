@@ -0,0 +1,460 @@
+"""
+Message batches for bulk, non-interactive workloads (config: batches).
+
+CI and review agents submit JSONL prompt sets to /v1/batches instead of
+sending thousands of individual completions. A batch is created with the
+provider batch API (Anthropic Message Batches: asynchronous, half price,
+outside the per-minute limits) or, for tests and offline runs, with a local
+stand-in that works through the items against the Messages API.
+
+Batches are polled in the background. When one ends, its results are
+streamed from the provider into a JSONL spool file, which is what clients
+download; once that file is complete, usage is recorded per item through
+the on_item callback. Batch metadata is spooled too, so batches survive
+restarts and are visible to every worker on the host. Collection is claimed
+with an exclusive spool file (released again if it fails, so the next poll
+retries), and usage recording with a per-batch marker file, so each batch's
+usage is recorded once however many workers poll it or retry collecting.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+from typing import Optional, Dict, Any, List, Callable, Awaitable, AsyncIterator
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+ENDED = "ended"
+# A collection claim older than this is assumed to belong to a dead worker
+STALE_CLAIM_SECONDS = 600
+RESULT_TYPES = ("succeeded", "errored", "canceled", "expired")
+
+
+class BatchJob:
+    """Gateway-side record of one provider batch"""
+
+    FIELDS = ("id", "owner", "context", "status", "request_counts", "created_at", "ended_at", "results_ready")
+
+    def __init__(self, id: str, owner: str, context: Dict[str, Any], status: str = "in_progress",
+                 request_counts: Optional[Dict[str, int]] = None, created_at: Optional[float] = None,
+                 ended_at: Optional[float] = None, results_ready: bool = False):
+        self.id = id
+        self.owner = owner
+        self.context = context
+        self.status = status
+        self.request_counts = request_counts or {}
+        self.created_at = created_at or time.time()
+        self.ended_at = ended_at
+        self.results_ready = results_ready
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def public(self) -> Dict[str, Any]:
+        """Client view (no owner or request context)"""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "request_counts": self.request_counts,
+            "created_at": self.created_at,
+            "ended_at": self.ended_at,
+            "results_url": f"/v1/batches/{self.id}/results" if self.results_ready else None,
+        }
+
+
+def parse_items(body: bytes, max_items: int) -> List[Dict[str, Any]]:
+    """
+    Batch items from a JSONL body (or a JSON {"requests": [...]} document),
+    normalized to {"custom_id", "params"}. Lines may be Anthropic batch
+    requests or bare Messages API payloads with an optional custom_id.
+    Raises ValueError naming the offending line.
+    """
+    text = body.decode("utf-8").strip()
+    lines = None
+    if text.startswith("{"):
+        try:
+            document = json.loads(text)
+        except ValueError:
+            document = None  # More than one line: JSONL
+        if isinstance(document, dict) and isinstance(document.get("requests"), list):
+            lines = list(enumerate(document["requests"], 1))
+    if lines is None:
+        lines = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                lines.append((number, json.loads(line)))
+            except ValueError as e:
+                raise ValueError(f"line {number}: invalid JSON ({e})")
+
+    if not lines:
+        raise ValueError("batch is empty")
+    if len(lines) > max_items:
+        raise ValueError(f"batch has {len(lines)} requests; the limit is {max_items}")
+
+    items, seen = [], set()
+    for number, row in lines:
+        if not isinstance(row, dict):
+            raise ValueError(f"line {number}: expected a JSON object")
+        params = row.get("params") if "params" in row else {k: v for k, v in row.items() if k != "custom_id"}
+        custom_id = str(row.get("custom_id") or f"request-{number}")
+        if not isinstance(params, dict) or not params.get("model") or not isinstance(params.get("messages"), list):
+            raise ValueError(f"line {number}: model and messages are required")
+        if params.get("stream"):
+            raise ValueError(f"line {number}: streaming is not supported in batches")
+        if custom_id in seen:
+            raise ValueError(f"line {number}: duplicate custom_id {custom_id!r}")
+        seen.add(custom_id)
+        items.append({"custom_id": custom_id, "params": params})
+    return items
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+class AnthropicBatchBackend:
+    """Anthropic Message Batches API"""
+
+    def __init__(self, base_url: str, api_key: Callable[[], Optional[str]], timeout: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _headers(self) -> Dict[str, str]:
+        return {"x-api-key": self.api_key() or "", "anthropic-version": "2023-06-01"}
+
+    async def _call(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.request(method, f"{self.base_url}{path}", headers=self._headers(), **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def knows(self, batch_id: str) -> bool:
+        return True
+
+    def forget(self, batch_id: str):
+        """Results stay available from the provider until the batch expires there"""
+
+    async def create(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return await self._call("POST", "/v1/messages/batches", json={"requests": items})
+
+    async def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        return await self._call("GET", f"/v1/messages/batches/{batch_id}")
+
+    async def cancel(self, batch_id: str) -> Dict[str, Any]:
+        return await self._call("POST", f"/v1/messages/batches/{batch_id}/cancel")
+
+    async def results(self, batch: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        url = batch.get("results_url") or f"{self.base_url}/v1/messages/batches/{batch['id']}/results"
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            async with client.stream("GET", url, headers=self._headers()) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class LocalBatchBackend:
+    """In-process stand-in: runs items one by one through invoke(params)"""
+
+    def __init__(self, invoke: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]], concurrency: int = 4):
+        self.invoke = invoke
+        self.concurrency = concurrency
+        self._batches: Dict[str, Dict[str, Any]] = {}
+
+    def _view(self, batch_id: str) -> Dict[str, Any]:
+        batch = self._batches[batch_id]
+        counts = {"processing": len(batch["items"]) - len(batch["results"])}
+        counts.update({kind: 0 for kind in RESULT_TYPES})
+        for result in batch["results"]:
+            counts[result["result"]["type"]] += 1
+        return {"id": batch_id, "processing_status": batch["status"], "request_counts": counts}
+
+    def knows(self, batch_id: str) -> bool:
+        """Local batches exist only in the worker that created them"""
+        return batch_id in self._batches
+
+    async def create(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        batch_id = f"lbatch_{uuid.uuid4().hex[:24]}"
+        batch = self._batches[batch_id] = {"items": items, "results": [], "status": "in_progress"}
+        batch["task"] = asyncio.create_task(self._process(batch))
+        return self._view(batch_id)
+
+    async def _process(self, batch: Dict[str, Any]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(item: Dict[str, Any]):
+            async with semaphore:
+                if batch["status"] != "in_progress":
+                    result = {"type": "canceled"}
+                else:
+                    try:
+                        result = {"type": "succeeded", "message": await self.invoke(item["params"])}
+                    except Exception as e:
+                        result = {"type": "errored", "error": {"type": "api_error", "message": str(e)}}
+                batch["results"].append({"custom_id": item["custom_id"], "result": result})
+
+        await asyncio.gather(*(run(item) for item in batch["items"]))
+        batch["status"] = ENDED
+
+    async def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        return self._view(batch_id)
+
+    async def cancel(self, batch_id: str) -> Dict[str, Any]:
+        batch = self._batches[batch_id]
+        if batch["status"] == "in_progress":
+            batch["status"] = "canceling"
+        return self._view(batch_id)
+
+    async def results(self, batch: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        for result in list(self._batches[batch["id"]]["results"]):
+            yield result
+
+    def forget(self, batch_id: str):
+        """Drop a batch once its results are spooled"""
+        self._batches.pop(batch_id, None)
+
+
+# ============================================================================
+# Manager
+# ============================================================================
+
+class BatchManager:
+    """Submits batches, polls them and spools their results"""
+
+    def __init__(
+        self,
+        backend,
+        spool_dir: str = "/var/lib/ai-gateway/batches",
+        enabled: bool = True,
+        poll_interval: int = 30,
+        max_items: int = 10000,
+        retention_hours: int = 72,
+        on_item: Optional[Callable[[BatchJob, Dict[str, Any]], Awaitable[None]]] = None
+    ):
+        self.backend = backend
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.max_items = max_items
+        self.retention = retention_hours * 3600
+        self.on_item = on_item
+        self.spool_dir = self._spool(spool_dir) if enabled else spool_dir
+        self.jobs: Dict[str, BatchJob] = {}
+        self.stats = {"submitted": 0, "items": 0, "ended": 0, "poll_errors": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], backends: Dict[str, Any], on_item=None) -> "BatchManager":
+        batch_config = config.get("batches", {}) or {}
+        backend = batch_config.get("backend", "anthropic")
+        if backend not in backends:
+            raise ValueError(f"batches.backend must be one of {tuple(backends)}, not {backend!r}")
+        return cls(
+            backend=backends[backend](),
+            spool_dir=batch_config.get("spool_dir", "/var/lib/ai-gateway/batches"),
+            enabled=batch_config.get("enabled", True),
+            poll_interval=int(batch_config.get("poll_interval", 30)),
+            max_items=int(batch_config.get("max_items", 10000)),
+            retention_hours=int(batch_config.get("retention_hours", 72)),
+            on_item=on_item,
+        )
+
+    @staticmethod
+    def _spool(path: str) -> str:
+        try:
+            os.makedirs(path, exist_ok=True)
+            return path
+        except OSError as e:
+            fallback = os.path.join(tempfile.gettempdir(), "ai-gateway-batches")
+            logger.warning(f"Batch spool {path} unavailable ({e}), using {fallback}")
+            os.makedirs(fallback, exist_ok=True)
+            return fallback
+
+    def _path(self, batch_id: str, suffix: str) -> str:
+        # IDs come from the provider or the URL; keep them inside the spool directory
+        return os.path.join(self.spool_dir, os.path.basename(batch_id) + suffix)
+
+    def _save(self, job: BatchJob):
+        tmp = self._path(job.id, ".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp, self._path(job.id, ".json"))
+
+    def _apply(self, job: BatchJob, batch: Dict[str, Any]):
+        job.request_counts = batch.get("request_counts", job.request_counts)
+        job.status = batch.get("processing_status", job.status)
+
+    # -------------------------------------------------------------------------
+    # Client operations
+    # -------------------------------------------------------------------------
+
+    async def submit(self, items: List[Dict[str, Any]], owner: str, context: Dict[str, Any]) -> BatchJob:
+        batch = await self.backend.create(items)
+        job = BatchJob(batch["id"], owner, context)
+        self._apply(job, batch)
+        self.jobs[job.id] = job
+        self._save(job)
+        self.stats["submitted"] += 1
+        self.stats["items"] += len(items)
+        logger.info(f"Batch {job.id} submitted by {owner}: {len(items)} requests")
+        return job
+
+    def load(self):
+        """Pick up spooled batches (after a restart, or created by other workers)"""
+        for name in os.listdir(self.spool_dir):
+            if name.endswith(".json") and name[:-5] not in self.jobs:
+                try:
+                    with open(os.path.join(self.spool_dir, name)) as f:
+                        job = BatchJob(**json.load(f))
+                    self.jobs[job.id] = job
+                except (OSError, ValueError, TypeError) as e:
+                    logger.warning(f"Skipping unreadable batch spool {name}: {e}")
+
+    def _read(self, batch_id: str) -> Optional[BatchJob]:
+        try:
+            with open(self._path(batch_id, ".json")) as f:
+                return BatchJob(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def get(self, batch_id: str, owner: str) -> Optional[BatchJob]:
+        """A batch visible to owner (from memory or another worker's spool)"""
+        job = self.jobs.get(batch_id) or self._read(batch_id)
+        return job if job is not None and job.owner == owner else None
+
+    def list(self, owner: str) -> List[BatchJob]:
+        """Owner's batches from every worker on the host, newest first"""
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return []
+        jobs = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            batch_id = name[:-5]
+            # Batches this worker polls are current in memory; others as last spooled
+            job = self.jobs.get(batch_id) if self.backend.knows(batch_id) else None
+            job = job or self._read(batch_id)
+            if job is not None and job.owner == owner:
+                jobs.append(job)
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    async def cancel(self, job: BatchJob) -> BatchJob:
+        if job.status != ENDED and self.backend.knows(job.id):
+            self._apply(job, await self.backend.cancel(job.id))
+            self._save(job)
+        return job
+
+    async def results(self, job: BatchJob) -> AsyncIterator[bytes]:
+        """Spooled result lines"""
+        with open(self._path(job.id, ".jsonl"), "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+
+    # -------------------------------------------------------------------------
+    # Background polling
+    # -------------------------------------------------------------------------
+
+    def _claim(self, job: BatchJob) -> Optional[int]:
+        """File descriptor for the results spool if this worker should collect, else None"""
+        tmp = self._path(job.id, ".jsonl.tmp")
+        try:
+            return os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(tmp) < STALE_CLAIM_SECONDS:
+                return None
+            return os.open(tmp, os.O_WRONLY | os.O_TRUNC)
+
+    async def _collect(self, job: BatchJob, batch: Dict[str, Any]):
+        """Stream results into the spool, then record usage per item"""
+        if not os.path.exists(self._path(job.id, ".jsonl")):
+            fd = self._claim(job)
+            if fd is None:
+                return  # Another worker is collecting
+            await self._stream_results(job, batch, fd)
+        await self._record_usage(job)
+        job.results_ready = True
+        job.ended_at = job.ended_at or time.time()
+
+    async def _stream_results(self, job: BatchJob, batch: Dict[str, Any], fd: int):
+        tmp = self._path(job.id, ".jsonl.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for result in self.backend.results(batch):
+                    f.write(json.dumps(result, separators=(",", ":")).encode("utf-8") + b"\n")
+            os.replace(tmp, self._path(job.id, ".jsonl"))
+        except BaseException:
+            # Release the claim so the next poll collects again from the start
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.backend.forget(job.id)
+        self.stats["ended"] += 1
+        logger.info(f"Batch {job.id} ended: {job.request_counts}")
+
+    async def _record_usage(self, job: BatchJob):
+        """Usage for every spooled result, once per batch across workers and retries"""
+        if not self.on_item:
+            return
+        try:
+            os.close(os.open(self._path(job.id, ".usage"), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except FileExistsError:
+            return  # Already recorded (or being recorded) by this or another worker
+        with open(self._path(job.id, ".jsonl"), "rb") as f:
+            for line in f:
+                result = json.loads(line)
+                try:
+                    await self.on_item(job, result)
+                except Exception as e:
+                    logger.warning(f"Batch {job.id} usage for {result.get('custom_id')} not recorded: {e}")
+
+    async def poll_once(self):
+        for job in list(self.jobs.values()):
+            if job.results_ready:
+                if time.time() - job.ended_at > self.retention:
+                    self._expire(job)
+                continue
+            if not self.backend.knows(job.id):
+                continue
+            try:
+                batch = await self.backend.retrieve(job.id)
+                self._apply(job, batch)
+                if job.status == ENDED:
+                    await self._collect(job, batch)
+                self._save(job)
+            except Exception as e:
+                self.stats["poll_errors"] += 1
+                logger.warning(f"Batch {job.id} poll failed: {e}")
+
+    def _expire(self, job: BatchJob):
+        self.jobs.pop(job.id, None)
+        for suffix in (".json", ".jsonl", ".usage"):
+            try:
+                os.remove(self._path(job.id, suffix))
+            except OSError:
+                pass
+
+    async def run_polling(self):
+        """Background task: poll open batches every poll_interval seconds"""
+        if not self.enabled:
+            return
+        self.load()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll_once()
+
+    def in_progress(self) -> int:
+        return sum(1 for job in self.jobs.values() if not job.results_ready)
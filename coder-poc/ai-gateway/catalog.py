@@ -0,0 +1,241 @@
+"""
+Provider and model catalog (config: catalog).
+
+The catalog is seeded from the provider model lists in config.yaml and
+refreshed in the background from the provider APIs (Anthropic /v1/models,
+Bedrock ListFoundationModels and ListInferenceProfiles) every
+refresh_interval seconds. Each refresh builds a new immutable snapshot and
+swaps it in, so readers never lock: model validation is a set lookup and
+the listing endpoints serve pre-serialized JSON with a strong ETag.
+
+Every model is also indexed by its provider-neutral name and its family
+(date suffix dropped), and a requested ID is resolved the same way, so
+"claude-3-opus", "anthropic.claude-3-opus" and "us.anthropic.claude-3-opus-
+20240229-v1:0" validate the same way the configured ID does.
+"""
+
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Optional, Dict, Any, List, Callable, FrozenSet
+
+import httpx
+
+from routing import canonical_model
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("anthropic", "bedrock", "gemini")
+
+_DATE_SUFFIX = re.compile(r"-\d{8}$")
+
+
+def model_aliases(model: str) -> List[str]:
+    """Lookup keys for a model ID: itself, provider-neutral name and family"""
+    base = canonical_model(model)
+    return [model, base, _DATE_SUFFIX.sub("", base)]
+
+
+class CatalogSnapshot:
+    """One immutable view of the catalog with its serialized forms"""
+
+    __slots__ = ("providers", "allowed", "body", "etag", "bedrock_body", "bedrock_etag", "built_at")
+
+    def __init__(self, providers: List[Dict[str, Any]], allowed: FrozenSet[str], bedrock_models: List[Dict[str, Any]]):
+        self.providers = providers
+        self.allowed = allowed
+        self.body = json.dumps({"providers": providers}).encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.bedrock_body = json.dumps({"models": bedrock_models}).encode("utf-8")
+        self.bedrock_etag = '"' + hashlib.sha256(self.bedrock_body).hexdigest()[:32] + '"'
+        self.built_at = time.time()
+
+
+class ModelCatalog:
+    """Config-seeded model catalog refreshed from provider APIs"""
+
+    def __init__(
+        self,
+        providers_config: Dict[str, Any],
+        available: Callable[[str], bool],
+        discover: bool = True,
+        refresh_interval: int = 3600,
+        anthropic_fetch: Optional[Callable[[], Any]] = None,
+        bedrock_fetch: Optional[Callable[[], Any]] = None
+    ):
+        self.providers_config = providers_config or {}
+        self.available = available
+        self.discover = discover
+        self.refresh_interval = refresh_interval
+        self.anthropic_fetch = anthropic_fetch
+        self.bedrock_fetch = bedrock_fetch
+        # Discovered models per provider; Bedrock also keeps names/vendors for /v1/bedrock/models
+        self._discovered: Dict[str, List[str]] = {}
+        self._bedrock_details: List[Dict[str, Any]] = []
+        self.refreshed_at: Optional[float] = None
+        self.stats = {"refreshes": 0, "refresh_errors": 0, "not_modified": 0}
+        self.snapshot = self._build()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], available: Callable[[str], bool], **fetchers) -> "ModelCatalog":
+        catalog_config = config.get("catalog", {}) or {}
+        return cls(
+            providers_config=config.get("providers", {}) or {},
+            available=available,
+            discover=catalog_config.get("discover", True),
+            refresh_interval=int(catalog_config.get("refresh_interval", 3600)),
+            **fetchers
+        )
+
+    # -------------------------------------------------------------------------
+    # Snapshot
+    # -------------------------------------------------------------------------
+
+    def _build(self, providers_config: Optional[Dict[str, Any]] = None) -> CatalogSnapshot:
+        if providers_config is None:
+            providers_config = self.providers_config
+        providers, allowed = [], set()
+        for name in PROVIDERS:
+            provider_config = providers_config.get(name) or {}
+            configured = list(provider_config.get("models", []) or [])
+            discovered = [m for m in self._discovered.get(name, []) if m not in configured]
+            listed = bool(provider_config.get("enabled", name != "gemini"))
+            # Validation follows config; "enabled" additionally reflects credentials
+            if listed:
+                allowed.update(alias for m in configured + discovered for alias in model_aliases(m))
+            providers.append({
+                "name": name,
+                "enabled": listed and self.available(name),
+                "default_model": provider_config.get("default_model"),
+                "models": configured + discovered,
+                "discovered": len(discovered),
+            })
+
+        bedrock_models = self._bedrock_details or [
+            {"id": m, "name": m, "provider": m.split(".")[-2] if "." in m else "unknown"}
+            for m in (providers_config.get("bedrock") or {}).get("models", []) or []
+        ]
+        return CatalogSnapshot(providers, frozenset(allowed), bedrock_models)
+
+    def prepare_reload(self, config: Dict[str, Any]):
+        """Rebuild the snapshot from new provider lists, keeping discovered models"""
+        providers_config = config.get("providers", {}) or {}
+        snapshot = self._build(providers_config)
+
+        def commit():
+            self.providers_config = providers_config
+            self.snapshot = snapshot
+        return commit
+
+    def allows(self, model: str) -> bool:
+        """Whether a model ID (or its family alias) belongs to a provider enabled in config"""
+        allowed = self.snapshot.allowed
+        # Bedrock and region-prefixed forms resolve to the configured family
+        return any(alias in allowed for alias in model_aliases(model))
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "models": sum(len(p["models"]) for p in self.snapshot.providers),
+            "refreshed_at": self.refreshed_at,
+            "etag": self.snapshot.etag,
+        }
+
+    # -------------------------------------------------------------------------
+    # Refresh
+    # -------------------------------------------------------------------------
+
+    async def refresh(self):
+        """Fetch model lists from provider APIs and swap in a new snapshot"""
+        discovered = dict(self._discovered)
+        bedrock_details = self._bedrock_details
+
+        if self.anthropic_fetch and self.available("anthropic"):
+            try:
+                discovered["anthropic"] = await self.anthropic_fetch()
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.warning(f"Anthropic model discovery failed: {e}")
+
+        if self.bedrock_fetch and self.available("bedrock"):
+            try:
+                bedrock_details = await self.bedrock_fetch()
+                discovered["bedrock"] = [m["id"] for m in bedrock_details]
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.warning(f"Bedrock model discovery failed: {e}")
+
+        self._discovered = discovered
+        self._bedrock_details = bedrock_details
+        snapshot = self._build()
+        self.refreshed_at = time.time()
+        self.stats["refreshes"] += 1
+        if snapshot.etag == self.snapshot.etag and snapshot.bedrock_etag == self.snapshot.bedrock_etag:
+            self.stats["not_modified"] += 1
+            return
+        self.snapshot = snapshot
+        logger.info(f"Model catalog refreshed: {self.status()['models']} models")
+
+    async def run_refresh(self):
+        """Background task: refresh now, then every refresh_interval seconds"""
+        if not self.discover:
+            return
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+
+# ============================================================================
+# Provider fetchers
+# ============================================================================
+
+def anthropic_fetcher(base_url: str, api_key: Callable[[], Optional[str]], timeout: float = 10.0):
+    """Anthropic /v1/models lister (paginated)"""
+
+    async def fetch() -> List[str]:
+        models, after = [], None
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            while True:
+                params = {"limit": 1000}
+                if after:
+                    params["after_id"] = after
+                response = await client.get(
+                    f"{base_url}/v1/models",
+                    params=params,
+                    headers={"x-api-key": api_key() or "", "anthropic-version": "2023-06-01"}
+                )
+                response.raise_for_status()
+                page = response.json()
+                models += [m["id"] for m in page.get("data", [])]
+                if not page.get("has_more"):
+                    return models
+                after = page.get("last_id")
+
+    return fetch
+
+
+def bedrock_fetcher(client_factory: Callable[[], Any]):
+    """Bedrock foundation model and inference profile lister (boto3, run in a thread)"""
+
+    def list_models() -> List[Dict[str, Any]]:
+        client = client_factory()
+        models = [
+            {"id": m["modelId"], "name": m.get("modelName", m["modelId"]), "provider": m.get("providerName", "unknown")}
+            for m in client.list_foundation_models(byOutputModality="TEXT").get("modelSummaries", [])
+        ]
+        # Cross-region profiles (us.anthropic.*) are what on-demand Claude 4.x calls need
+        try:
+            for page in client.get_paginator("list_inference_profiles").paginate():
+                for p in page.get("inferenceProfileSummaries", []):
+                    models.append({"id": p["inferenceProfileId"], "name": p.get("inferenceProfileName", ""),
+                                   "provider": "inference-profile"})
+        except Exception as e:
+            logger.debug(f"Bedrock inference profiles unavailable: {e}")
+        return models
+
+    async def fetch() -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(list_models)
+
+    return fetch
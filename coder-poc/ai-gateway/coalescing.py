@@ -0,0 +1,152 @@
+"""
+Single-flight request coalescing for identical in-flight completions.
+
+When an eligible request is already in flight upstream, later callers with
+the same key await the same task instead of making their own upstream call.
+Streaming responses are fanned out: every waiter receives the full stream,
+replayed from the start if it joined late. When every waiter has gone (all
+clients disconnected or hit their deadline) the shared upstream call is
+cancelled rather than left running for nobody.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Callable, Awaitable, AsyncIterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBroadcast:
+    """Pumps one upstream byte stream and replays it to any number of subscribers"""
+
+    def __init__(self, source: AsyncIterator[bytes]):
+        self._chunks: List[bytes] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._cond = asyncio.Condition()
+        self.subscribers = 0
+        self.abandoned = False
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[bytes]):
+        try:
+            async for chunk in source:
+                async with self._cond:
+                    self._chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            logger.warning(f"Coalesced stream failed: {e}")
+            self._error = e
+        finally:
+            async with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        position = 0
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._cond:
+                    while position >= len(self._chunks) and not self._done:
+                        await self._cond.wait()
+                    pending = self._chunks[position:]
+                    finished = self._done
+                for chunk in pending:
+                    yield chunk
+                position += len(pending)
+                if finished and position >= len(self._chunks):
+                    if self._error is not None:
+                        raise self._error
+                    return
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self._done:
+                self.abandoned = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Deduplicates concurrent identical upstream calls"""
+
+    def __init__(self, enabled: bool = True, deterministic_only: bool = True):
+        self.enabled = enabled
+        self.deterministic_only = deterministic_only
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "stream_leaders": 0, "stream_coalesced": 0, "abandoned": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SingleFlight":
+        coalescing_config = config.get("coalescing", {}) or {}
+        return cls(
+            enabled=coalescing_config.get("enabled", True),
+            deterministic_only=coalescing_config.get("deterministic_only", True),
+        )
+
+    def eligible(self, request) -> bool:
+        """Sharing one answer is only safe when the request is deterministic"""
+        if not self.enabled:
+            return False
+        return not self.deterministic_only or request.temperature == 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run fn once per key at a time. Returns (result, leader) where leader is
+        True for the caller that actually made the upstream call.
+        """
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            # The upstream call runs as its own task so a leader that disconnects
+            # does not cancel the call for everyone waiting on it
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(self._calls, key, task))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), leader
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                # Last waiter cancelled (disconnect or deadline): nobody wants the answer
+                if not task.done():
+                    self.stats["abandoned"] += 1
+                    self._forget(self._calls, key, task)
+                    task.cancel()
+
+    @staticmethod
+    def _forget(flights: Dict[str, Any], key: str, flight: Any):
+        # A cancelled flight may already have been replaced under the same key
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def stream(self, key: str, fn: Callable[[], AsyncIterator[bytes]],
+               on_done: Optional[Callable[[], None]] = None) -> Tuple[AsyncIterator[bytes], bool]:
+        """
+        Join (or start) the in-flight stream for key. Returns (iterator, leader).
+        A leader's on_done runs when the upstream stream ends, fails or is
+        cancelled, even if the stream never got to start.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is not None and not broadcast.abandoned:
+            self.stats["stream_coalesced"] += 1
+            return broadcast.subscribe(), False
+
+        broadcast = StreamBroadcast(fn())
+        self._streams[key] = broadcast
+        broadcast.task.add_done_callback(lambda _: self._forget(self._streams, key, broadcast))
+        if on_done is not None:
+            broadcast.task.add_done_callback(lambda _: on_done())
+        self.stats["stream_leaders"] += 1
+        return broadcast.subscribe(), True
@@ -0,0 +1,183 @@
+"""
+Hot-reloadable configuration (config: config_reload).
+
+CONFIG_PATH is parsed into an immutable ConfigSnapshot (nested mappings
+frozen, allowed CORS origins precompiled). A background task watches the
+file's mtime and size; when they change the new file is parsed and every
+subscriber prepares its replacement state from it. Only if all of them
+succeed are the prepared states committed and the snapshot swapped, so an
+invalid edit leaves the running configuration untouched.
+
+Subscribers build their own precompiled structures (model lookup sets,
+per-user limit tables) in prepare and swap them in with a single
+assignment on commit, so request handlers read the current state without
+locks. Sections without a subscriber still require a restart; changes to
+them are logged.
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Callable, Mapping, Tuple
+
+import yaml
+from starlette.middleware.cors import CORSMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Used when neither AI_GATEWAY_ALLOWED_ORIGINS nor security.allowed_origins is set
+DEFAULT_ORIGINS = (
+    "http://localhost:7080",
+    "http://host.docker.internal:7080",
+    "http://coder-server:7080",
+)
+
+
+def freeze(value: Any) -> Any:
+    """Read-only deep copy: dicts become mapping proxies, lists tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class OriginPolicy:
+    """
+    Compiled CORS origin allowlist; '*' in an entry matches a host name part
+    or port. A bare '*' is rejected: responses allow credentials, so it would
+    let any site make authenticated requests.
+    """
+
+    __slots__ = ("exact", "pattern")
+
+    def __init__(self, origins: List[str]):
+        if "*" in origins:
+            raise ValueError("allowed_origins: '*' is not allowed with credentials; list the origins instead")
+        self.exact = frozenset(o for o in origins if "*" not in o)
+        wildcards = [re.escape(o).replace(r"\*", "[A-Za-z0-9.-]+") for o in origins if "*" in o]
+        self.pattern = re.compile("|".join(wildcards)) if wildcards else None
+
+    def allows(self, origin: str) -> bool:
+        if origin in self.exact:
+            return True
+        return bool(self.pattern and self.pattern.fullmatch(origin))
+
+
+class ConfigSnapshot:
+    """One parsed, frozen configuration file"""
+
+    __slots__ = ("config", "version", "loaded_at", "origins")
+
+    def __init__(self, config: Dict[str, Any], version: str):
+        self.config: Mapping[str, Any] = freeze(config)
+        self.version = version
+        self.loaded_at = time.time()
+        env_origins = [o for o in os.getenv("AI_GATEWAY_ALLOWED_ORIGINS", "").split(",") if o]
+        security = config.get("security", {}) or {}
+        self.origins = OriginPolicy(env_origins or list(security.get("allowed_origins") or DEFAULT_ORIGINS))
+
+
+# prepare(config) -> commit(); prepare raises on invalid config and must not touch live state
+Preparer = Callable[[Mapping[str, Any]], Callable[[], None]]
+
+
+class ConfigManager:
+    """Loads CONFIG_PATH and swaps in validated snapshots when it changes"""
+
+    def __init__(self, path: str, interval: float = 5.0):
+        self.path = path
+        self._stamp: Optional[Tuple[float, int]] = None
+        self._subscribers: List[Tuple[str, Preparer]] = []
+        self.stats = {"reloads": 0, "unchanged": 0, "reload_errors": 0}
+        self.current = self._load()
+        reload_config = self.current.config.get("config_reload", {}) or {}
+        self.enabled = reload_config.get("enabled", True)
+        self.interval = float(reload_config.get("interval", interval))
+
+    @classmethod
+    def from_env(cls) -> "ConfigManager":
+        return cls(os.getenv("CONFIG_PATH", "/app/config.yaml"))
+
+    @property
+    def config(self) -> Mapping[str, Any]:
+        return self.current.config
+
+    def subscribe(self, section: str, prepare: Preparer):
+        """Register a reload hook for a top-level section"""
+        self._subscribers.append((section, prepare))
+
+    def _stat(self) -> Optional[Tuple[float, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def _load(self) -> ConfigSnapshot:
+        self._stamp = self._stat()
+        if self._stamp is None:
+            return ConfigSnapshot({}, "none")
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        config = yaml.safe_load(raw) or {}
+        if not isinstance(config, dict):
+            raise ValueError(f"{self.path}: top level must be a mapping")
+        return ConfigSnapshot(config, hashlib.sha256(raw).hexdigest()[:12])
+
+    def reload(self) -> bool:
+        """Re-read the file if it changed; True when a new snapshot was committed"""
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return False
+        previous = self.current
+        try:
+            snapshot = self._load()
+            if snapshot.version == previous.version:
+                self.stats["unchanged"] += 1
+                return False
+            commits = [prepare(snapshot.config) for _, prepare in self._subscribers]
+        except Exception as e:
+            self.stats["reload_errors"] += 1
+            logger.error(f"Config reload rejected, keeping version {previous.version}: {e}")
+            return False
+
+        for commit in commits:
+            commit()
+        self.current = snapshot
+        self.stats["reloads"] += 1
+
+        reloadable = {section for section, _ in self._subscribers} | {"security"}
+        changed = {k for k in set(previous.config) | set(snapshot.config)
+                   if previous.config.get(k) != snapshot.config.get(k)}
+        logger.info(f"Config reloaded: version {previous.version} -> {snapshot.version}, "
+                    f"sections {sorted(changed & reloadable)}")
+        if changed - reloadable:
+            logger.warning(f"Config sections {sorted(changed - reloadable)} changed; they apply after a restart")
+        return True
+
+    async def run_watch(self):
+        """Background task: check the file every interval seconds"""
+        if not self.enabled:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            self.reload()
+
+    def status(self) -> Dict[str, Any]:
+        return {"version": self.current.version, "loaded_at": self.current.loaded_at}
+
+
+class ReloadableCORSMiddleware(CORSMiddleware):
+    """CORS middleware whose origin allowlist follows the current config snapshot"""
+
+    def __init__(self, app, config_manager: ConfigManager, **kwargs):
+        super().__init__(app, allow_origins=(), **kwargs)
+        self.config_manager = config_manager
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        return self.config_manager.current.origins.allows(origin)
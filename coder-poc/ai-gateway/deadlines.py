@@ -0,0 +1,243 @@
+"""
+Per-request deadlines and adaptive upstream timeouts (config: deadlines).
+
+Every completion request gets a deadline: the client's own timeout when it
+sends one (X-Request-Timeout, or the X-Stainless-Timeout header the
+Anthropic SDKs send), else a default for its traffic class, capped at max.
+Waiting for an admission slot, the upstream call and any failover all run
+under that deadline and are cancelled when it passes or when the client
+disconnects, so an abandoned request gives its upstream slot back at once
+instead of holding it for a fixed 120 seconds.
+
+Within the deadline, httpx connect, read and pool timeouts follow observed
+provider behaviour: connect from TCP/TLS handshake times, read from the
+provider's successful-call latency percentile, each times a multiplier and
+clamped to configured bounds, so a stalled connection is detected in
+seconds rather than minutes. Until enough samples exist the upper bounds
+apply.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Awaitable, Sequence
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """Point in (monotonic) time by which a request must be answered"""
+
+    __slots__ = ("budget", "expires_at", "source")
+
+    def __init__(self, budget: float, source: str = "default"):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.source = source
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before the upstream answered"""
+
+    def __init__(self, deadline: Deadline):
+        super().__init__(f"Request deadline of {deadline.budget:g}s exceeded")
+        self.deadline = deadline
+
+
+class ClientDisconnected(Exception):
+    """The client went away while its request was in flight"""
+
+
+class DeadlinePolicy:
+    """Derives each request's deadline from its headers and traffic class"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        header: str = "X-Request-Timeout",
+        default: float = 120.0,
+        maximum: float = 600.0,
+        by_class: Optional[Dict[str, float]] = None
+    ):
+        self.enabled = enabled
+        self.headers = (header.lower(), "x-stainless-timeout")
+        self.default = default
+        self.maximum = maximum
+        self.by_class = by_class or {}
+        self.stats = {"exceeded": 0, "disconnected": 0, "client_supplied": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "DeadlinePolicy":
+        deadline_config = config.get("deadlines", {}) or {}
+        return cls(
+            enabled=deadline_config.get("enabled", True),
+            header=deadline_config.get("header", "X-Request-Timeout"),
+            default=float(deadline_config.get("default", 120)),
+            maximum=float(deadline_config.get("max", 600)),
+            by_class={k: float(v) for k, v in (deadline_config.get("by_class") or {}).items()},
+        )
+
+    def for_request(self, headers, traffic_class: str = "interactive") -> Optional[Deadline]:
+        """Client timeout header if valid, else the class default; None when disabled"""
+        if not self.enabled:
+            return None
+        for name in self.headers:
+            value = headers.get(name)
+            if not value:
+                continue
+            try:
+                budget = float(value)
+            except ValueError:
+                continue
+            if budget > 0:
+                self.stats["client_supplied"] += 1
+                return Deadline(min(budget, self.maximum), source="client")
+        return Deadline(min(self.by_class.get(traffic_class, self.default), self.maximum))
+
+
+async def _disconnected(request) -> None:
+    """Returns once the client has closed the connection (request body already read)"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until(
+    awaitable: Awaitable[Any],
+    deadline: Optional[Deadline],
+    request=None,
+    policy: Optional[DeadlinePolicy] = None
+) -> Any:
+    """
+    Await under a deadline. The work is cancelled (and its finally blocks run,
+    releasing admission slots) when the deadline passes or the client
+    disconnects; raises DeadlineExceeded or ClientDisconnected respectively.
+    """
+    task = asyncio.ensure_future(awaitable)
+    watch = asyncio.ensure_future(_disconnected(request)) if request is not None else None
+    try:
+        done, _ = await asyncio.wait(
+            [t for t in (task, watch) if t is not None],
+            timeout=deadline.remaining() if deadline is not None else None,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        if watch is not None:
+            watch.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    if task in done:
+        return task.result()
+    if watch is not None and watch in done:
+        if policy is not None:
+            policy.stats["disconnected"] += 1
+        raise ClientDisconnected()
+    # The work may have finished while it was being cancelled
+    if not task.cancelled() and task.exception() is None:
+        return task.result()
+    if policy is not None:
+        policy.stats["exceeded"] += 1
+    raise DeadlineExceeded(deadline)
+
+
+def _percentile(samples: Sequence[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdaptiveTimeouts:
+    """httpx timeouts per provider, tuned from observed handshake and call latencies"""
+
+    def __init__(
+        self,
+        latencies: Callable[[str], Sequence[float]],
+        percentile: float = 0.99,
+        multiplier: float = 3.0,
+        min_samples: int = 20,
+        connect_min: float = 1.0,
+        connect_max: float = 10.0,
+        read_min: float = 30.0,
+        read_max: float = 600.0,
+        window: int = 200
+    ):
+        # Successful-call latencies per provider (the router's rolling window)
+        self.latencies = latencies
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.connect_min = connect_min
+        self.connect_max = connect_max
+        self.read_min = read_min
+        self.read_max = read_max
+        self._connects: Dict[str, deque] = {}
+        self._window = window
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], latencies: Callable[[str], Sequence[float]]) -> "AdaptiveTimeouts":
+        timeout_config = (config.get("deadlines", {}) or {}).get("timeouts", {}) or {}
+        return cls(
+            latencies=latencies,
+            percentile=float(timeout_config.get("percentile", 0.99)),
+            multiplier=float(timeout_config.get("multiplier", 3.0)),
+            min_samples=int(timeout_config.get("min_samples", 20)),
+            connect_min=float(timeout_config.get("connect_min", 1.0)),
+            connect_max=float(timeout_config.get("connect_max", 10.0)),
+            read_min=float(timeout_config.get("read_min", 30.0)),
+            read_max=float(timeout_config.get("read_max", 600.0)),
+        )
+
+    def tracer(self, provider: str) -> Callable[[str, Dict[str, Any]], Awaitable[None]]:
+        """httpx "trace" extension callback recording new-connection handshake time"""
+        started = []
+
+        async def trace(event: str, info: Dict[str, Any]):
+            if event == "connection.connect_tcp.started":
+                started.append(time.monotonic())
+            elif started and event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                # Plain HTTP ends at TCP; HTTPS replaces that sample once TLS completes
+                samples = self._connects.setdefault(provider, deque(maxlen=self._window))
+                if event == "connection.start_tls.complete" and samples:
+                    samples.pop()
+                samples.append(time.monotonic() - started[0])
+
+        return trace
+
+    def _tuned(self, samples: Sequence[float], low: float, high: float) -> float:
+        if len(samples) < self.min_samples:
+            return high
+        return min(high, max(low, _percentile(samples, self.percentile) * self.multiplier))
+
+    def connect_timeout(self, provider: str) -> float:
+        return self._tuned(self._connects.get(provider, ()), self.connect_min, self.connect_max)
+
+    def read_timeout(self, provider: str) -> float:
+        return self._tuned(self.latencies(provider), self.read_min, self.read_max)
+
+    def for_call(self, provider: str) -> httpx.Timeout:
+        """
+        Connect/read/write/pool timeouts for one call. The request deadline is
+        not folded in: run_until cancels the call when it passes, which the
+        router does not count against the provider the way a timeout is.
+        """
+        connect = self.connect_timeout(provider)
+        # Waiting for a pooled connection gets the same budget as opening one
+        return httpx.Timeout(connect=connect, read=self.read_timeout(provider), write=connect, pool=connect)
+
+    def status(self) -> Dict[str, float]:
+        return {
+            "anthropic_connect": round(self.connect_timeout("anthropic"), 3),
+            "anthropic_read": round(self.read_timeout("anthropic"), 3),
+        }
@@ -0,0 +1,219 @@
+"""
+Response encoding: fast JSON and negotiated compression (config: compression).
+
+FastJSONResponse serializes with orjson when it is installed (stdlib json
+otherwise) and is the app's default response class; hot paths serialize
+once with dumps() and reuse the bytes for the cache and the response.
+
+CompressionMiddleware gzip- or brotli-encodes complete responses (those
+with a Content-Length) above minimum_size when the client's Accept-Encoding
+allows it. Streamed bodies (SSE, NDJSON batch results) pass through
+untouched so events are not held back by the compressor, as do bodies
+that already carry a Content-Encoding (the Claude passthrough forwards
+upstream bytes still encoded; decode() gives it a plain copy to read
+usage from). Brotli needs the optional brotli package; without it only
+gzip is offered.
+"""
+
+import gzip
+import json
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def canonical_dumps(content: Any) -> bytes:
+    """Compact JSON with sorted keys, for hashing"""
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    return json.dumps(content, default=str, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode(body: bytes, coding: str) -> bytes:
+    """A content-coded body as plain bytes (gzip, br or identity); ValueError if it cannot be decoded"""
+    coding = coding.strip().lower()
+    try:
+        if coding == "gzip":
+            return gzip.decompress(body)
+        if coding == "br" and brotli is not None:
+            return brotli.decompress(body)
+    except Exception as e:  # gzip: OSError, EOFError, zlib.error; brotli.error
+        raise ValueError(f"invalid {coding} body: {e}")
+    if coding in ("", "identity"):
+        return body
+    raise ValueError(f"unsupported content coding {coding!r}")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# Content types worth compressing; anything else (images, already-compressed) is skipped
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/plain", "text/html", "application/xml")
+
+
+def negotiate(accept_encoding: str, offered: Tuple[str, ...]) -> Optional[str]:
+    """Best of the offered codings by the client's q-values (ties go to offer order)"""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip()] = q
+    best, best_q = None, 0.0
+    for coding in offered:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class ResponseCompressor:
+    """Compression settings, codings on offer and counters"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        thread_size: int = 65536
+    ):
+        self.enabled = enabled
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.thread_size = thread_size
+        self.offered = ("br", "gzip") if brotli is not None else ("gzip",)
+        self.stats = {"gzip": 0, "br": 0, "too_small": 0, "streamed": 0}
+        self.bytes = {"before": 0, "after": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ResponseCompressor":
+        compression_config = config.get("compression", {}) or {}
+        return cls(
+            enabled=compression_config.get("enabled", True),
+            minimum_size=int(compression_config.get("minimum_size", 1024)),
+            gzip_level=int(compression_config.get("gzip_level", 6)),
+            brotli_quality=int(compression_config.get("brotli_quality", 4)),
+            thread_size=int(compression_config.get("thread_size", 65536)),
+        )
+
+    def compress(self, body: bytes, coding: str) -> bytes:
+        if coding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    async def compress_async(self, body: bytes, coding: str) -> bytes:
+        # Large bodies take milliseconds; keep them off the event loop
+        if len(body) >= self.thread_size:
+            return await asyncio.to_thread(self.compress, body, coding)
+        return self.compress(body, coding)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete responses the client accepts encoded"""
+
+    def __init__(self, app, compressor: ResponseCompressor):
+        self.app = app
+        self.compressor = compressor
+
+    async def __call__(self, scope, receive, send):
+        compressor = self.compressor
+        if scope["type"] != "http" or not compressor.enabled:
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        coding = negotiate(accept, compressor.offered) if accept else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Dict[str, Any]] = None
+        chunks: List[bytes] = []
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                names = {k.lower(): v for k, v in message.get("headers", [])}
+                length = names.get(b"content-length")
+                content_type = names.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in names or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    await send(message)
+                elif length is None:
+                    # No length: a streamed body, forwarded as it is produced
+                    compressor.stats["streamed"] += 1
+                    await send(message)
+                elif int(length) < compressor.minimum_size:
+                    compressor.stats["too_small"] += 1
+                    await send(message)
+                else:
+                    # Complete body of known size: hold the headers until it has all arrived
+                    start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            compressed = await compressor.compress_async(body, coding)
+            compressor.stats[coding] += 1
+            compressor.bytes["before"] += len(body)
+            compressor.bytes["after"] += len(compressed)
+
+            names = {k.lower(): v for k, v in start.get("headers", [])}
+            headers = [(k, v) for k, v in start.get("headers", [])
+                       if k.lower() not in (b"content-length", b"etag", b"vary")]
+            headers.append((b"content-encoding", coding.encode()))
+            headers.append((b"content-length", str(len(compressed)).encode()))
+            vary = names.get(b"vary")
+            headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+            etag = names.get(b"etag")
+            if etag is not None:
+                # The encoded bytes differ, so a strong validator becomes weak
+                headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
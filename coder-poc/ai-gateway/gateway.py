@@ -6,31 +6,45 @@ Features: Usage tracking persisted to DevDB, JWT authentication
 """
 
 import os
+import sys
 import json
 import time
+import asyncio
 import logging
 import uuid
 import hmac
 import hashlib
 from datetime import datetime
-from typing import Optional, Dict, Any
-from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Union
 from functools import wraps
 
 import httpx
 import boto3
-import yaml
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import BotoCoreError, ClientError
 import uvicorn
-import psycopg2
-import psycopg2.pool
 from fastapi import FastAPI, Request, HTTPException, Header, Depends
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, validator
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+
+from response_cache import ResponseCache
+from coalescing import SingleFlight
+from rate_limiting import RateLimiter, RateLimited
+from usage_store import UsageStore
+from metrics import GatewayMetrics, MetricsMiddleware, prepare_multiprocess
+from routing import ProviderRouter, UpstreamError, provider_for_model
+from admission import AdmissionController, AdmissionRejected, SlotLease
+from usage_db import UsageDB
+from tokens import TokenEstimator, ContextWindowExceeded
+from audit import AuditLog
+from batches import BatchManager, AnthropicBatchBackend, LocalBatchBackend, parse_items
+from config_manager import ConfigManager, ReloadableCORSMiddleware
+from shared_state import SharedState
+from catalog import ModelCatalog, anthropic_fetcher, bedrock_fetcher
+from encoding import FastJSONResponse, ResponseCompressor, CompressionMiddleware, decode, dumps, loads, negotiate
+from affinity import AffinityRouter
+from deadlines import DeadlinePolicy, AdaptiveTimeouts, DeadlineExceeded, ClientDisconnected, run_until
 
 # Configure logging
 logging.basicConfig(
@@ -39,15 +53,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load configuration
-def load_config():
-    config_path = os.getenv("CONFIG_PATH", "/app/config.yaml")
-    if os.path.exists(config_path):
-        with open(config_path) as f:
-            return yaml.safe_load(f)
-    return {}
-
-config = load_config()
+# Load configuration; reloadable sections are re-applied when CONFIG_PATH changes (config: config_reload)
+config_manager = ConfigManager.from_env()
+config = config_manager.config
 
 # =============================================================================
 # Authentication Configuration
@@ -57,7 +65,6 @@ config = load_config()
 AUTH_ENABLED = os.getenv("AI_GATEWAY_AUTH_ENABLED", "true").lower() == "true"
 AUTH_SECRET_KEY = os.getenv("AI_GATEWAY_AUTH_SECRET", "")
 CODER_URL = os.getenv("CODER_URL", "http://coder-server:7080")
-ALLOWED_ORIGINS = os.getenv("AI_GATEWAY_ALLOWED_ORIGINS", "").split(",") if os.getenv("AI_GATEWAY_ALLOWED_ORIGINS") else []
 
 # Security bearer token scheme
 security = HTTPBearer(auto_error=False)
@@ -89,20 +96,20 @@ async def verify_workspace_token(
         token = credentials.credentials
         try:
             # Validate token against Coder API
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(
-                    f"{CODER_URL}/api/v2/users/me",
-                    headers={"Coder-Session-Token": token}
-                )
-                if response.status_code == 200:
-                    user_data = response.json()
-                    return {
-                        "workspace_id": x_workspace_id or "authenticated",
-                        "user_id": user_data.get("id"),
-                        "username": user_data.get("username"),
-                        "authenticated": True,
-                        "method": "coder_token"
-                    }
+            response = await upstream_client().get(
+                f"{CODER_URL}/api/v2/users/me",
+                headers={"Coder-Session-Token": token},
+                timeout=5.0
+            )
+            if response.status_code == 200:
+                user_data = response.json()
+                return {
+                    "workspace_id": x_workspace_id or "authenticated",
+                    "user_id": user_data.get("id"),
+                    "username": user_data.get("username"),
+                    "authenticated": True,
+                    "method": "coder_token"
+                }
         except Exception as e:
             logger.warning(f"Token validation failed: {e}")
 
@@ -121,142 +128,94 @@ async def verify_workspace_token(
     )
 
 # =============================================================================
-# Database Connection Pool for Usage Tracking
+# Usage Persistence (async PostgreSQL, config: database)
 # =============================================================================
-DB_HOST = os.getenv("DEVDB_HOST", "devdb")
-DB_PORT = os.getenv("DEVDB_PORT", "5432")
-DB_USER = os.getenv("DEVDB_USER", "ai_gateway")
-DB_PASSWORD = os.getenv("DEVDB_PASSWORD", "aigateway123")
-DB_NAME = os.getenv("DEVDB_NAME", "devdb")
-
-# Connection pool (lazy initialized)
-db_pool = None
-
-def get_db_pool():
-    """Get or create database connection pool"""
-    global db_pool
-    if db_pool is None:
-        try:
-            db_pool = psycopg2.pool.ThreadedConnectionPool(
-                minconn=1,
-                maxconn=5,
-                host=DB_HOST,
-                port=DB_PORT,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME
-            )
-            logger.info(f"Database pool created: {DB_HOST}:{DB_PORT}/{DB_NAME}")
-        except Exception as e:
-            logger.warning(f"Failed to create database pool: {e}")
-            return None
-    return db_pool
-
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections"""
-    pool = get_db_pool()
-    if pool is None:
-        yield None
-        return
-
-    conn = None
-    try:
-        conn = pool.getconn()
-        yield conn
-    finally:
-        if conn:
-            pool.putconn(conn)
+# Records are queued by log_request() and written in batches by background
+# tasks; without a database (local dev) they are skipped.
+usage_db = UsageDB.from_config(config)
 
-def persist_usage(
-    workspace_id: Optional[str],
-    user_id: Optional[str],
-    template_name: Optional[str],
-    provider: str,
-    model: str,
-    tokens_in: int,
-    tokens_out: int,
-    latency_ms: int,
-    status_code: int,
-    endpoint: Optional[str] = None
-):
-    """Persist usage record to database (non-blocking best-effort)"""
-    request_id = str(uuid.uuid4())[:8]
-
-    try:
-        with get_db_connection() as conn:
-            if conn is None:
-                logger.debug("Database not available, skipping persistence")
-                return
-
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO provisioning.ai_usage
-                    (workspace_id, user_id, template_name, provider, model,
-                     tokens_in, tokens_out, latency_ms, status_code, endpoint, request_id)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    workspace_id, user_id, template_name, provider, model,
-                    tokens_in, tokens_out, latency_ms, status_code, endpoint, request_id
-                ))
-                conn.commit()
-                logger.debug(f"Usage persisted: {request_id}")
-    except Exception as e:
-        logger.warning(f"Failed to persist usage: {e}")
+# Structured audit records, written off the request path (config: audit)
+audit_log = AuditLog.from_config(config)
 
 # Initialize FastAPI
 app = FastAPI(
     title="AI Gateway",
     description="Multi-provider AI API proxy for secure development environments",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
-# Rate limiter
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-
-# CORS middleware - SECURITY: Restrict origins in production
-cors_origins = ALLOWED_ORIGINS if ALLOWED_ORIGINS and ALLOWED_ORIGINS[0] else [
-    "http://localhost:7080",
-    "http://host.docker.internal:7080",
-    "http://coder-server:7080"
-]
+# Rate-limit buckets, usage windows and the cache tier seen by every worker (config: shared_state)
+shared_state = SharedState.from_config(config)
+
+# Rate limiter: token buckets per user/workspace (config: rate_limits)
+rate_limiter = RateLimiter.from_config(config, shared_store=shared_state.bucket_store())
+
+def rate_limit_identity(auth: Dict[str, Any]) -> str:
+    """Rate limits apply to the authenticated user, falling back to the workspace"""
+    return auth.get("username") or auth.get("workspace_id") or "anonymous"
+
+# Upstream concurrency caps with per-class reservations and weighted-fair queues (config: admission)
+admission = AdmissionController.from_config(config)
+
+def admission_identity(auth: Dict[str, Any]) -> str:
+    """Concurrency caps apply per workspace, falling back to the user"""
+    return auth.get("workspace_id") or auth.get("username") or "anonymous"
+
+@app.middleware("http")
+async def add_response_headers(request: Request, call_next):
+    """Attach X-RateLimit-* headers and upstream Server-Timing recorded by the handler"""
+    response = await call_next(request)
+    headers = getattr(request.state, "rate_limit_headers", None)
+    if headers:
+        response.headers.update(headers)
+    upstream_seconds = getattr(request.state, "upstream_seconds", None)
+    if upstream_seconds is not None:
+        response.headers["Server-Timing"] = f"upstream;dur={upstream_seconds * 1000:.1f}"
+    return response
+
+# Prometheus metrics (config: metrics)
+metrics = GatewayMetrics.from_config(config)
+metrics.track_queue_depth(usage_db.queue_depth)
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+# gzip / brotli for complete JSON responses above a size threshold (config: compression)
+compressor = ResponseCompressor.from_config(config)
+app.add_middleware(CompressionMiddleware, compressor=compressor)
+
+# CORS middleware - SECURITY: Restrict origins in production. Origins come from
+# AI_GATEWAY_ALLOWED_ORIGINS, else security.allowed_origins, and follow config reloads.
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=cors_origins,
+    ReloadableCORSMiddleware,
+    config_manager=config_manager,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
-    allow_headers=["Authorization", "Content-Type", "X-Workspace-ID", "X-User-ID", "X-Template-Name", "X-API-Key", "X-Provider"],
+    allow_headers=["Authorization", "Content-Type", "X-Workspace-ID", "X-User-ID", "X-Template-Name", "X-API-Key", "X-Provider", "X-Scope", "X-Request-Timeout"],
 )
 
-# Models with validation
-ALLOWED_MODELS = [
-    "claude-3-opus", "claude-3-sonnet", "claude-3-haiku",
-    "claude-sonnet-4-5-20250929", "claude-haiku-4-5-20251001", "claude-opus-4-20250514",
-    "anthropic.claude-3-sonnet", "anthropic.claude-3-haiku",
-    "us.anthropic.claude-sonnet-4-5-20250929-v1:0",
-    "us.anthropic.claude-haiku-4-5-20251001-v1:0",
-    "us.anthropic.claude-opus-4-20250514-v1:0"
-]
+# Completion size bounds for a single request (interactive and batch items)
+MAX_OUTPUT_TOKENS = 4096
 
+# Models with validation (allowed models come from the catalog, see below)
 class MessageRequest(BaseModel):
     model: str
     messages: list
+    system: Optional[Union[str, list]] = None
     max_tokens: Optional[int] = 1024
     temperature: Optional[float] = 0.7
     stream: Optional[bool] = False
 
     @validator('model')
     def validate_model(cls, v):
-        # Allow any model that starts with known prefixes or is in allowed list
-        if v in ALLOWED_MODELS or any(v.startswith(prefix) for prefix in ['claude', 'anthropic', 'us.anthropic']):
+        # Configured or discovered model IDs, plus their provider-neutral and family aliases
+        if catalog.allows(v):
             return v
-        raise ValueError(f"Model '{v}' not allowed. Use a Claude model.")
+        raise ValueError(f"Model '{v}' not allowed. See /v1/providers for available models.")
 
     @validator('max_tokens')
     def validate_max_tokens(cls, v):
-        if v is not None and (v < 1 or v > 4096):
-            raise ValueError("max_tokens must be between 1 and 4096")
+        if v is not None and (v < 1 or v > MAX_OUTPUT_TOKENS):
+            raise ValueError(f"max_tokens must be between 1 and {MAX_OUTPUT_TOKENS}")
         return v
 
     @validator('temperature')
@@ -271,28 +230,143 @@ class MessageRequest(BaseModel):
             raise ValueError("messages cannot be empty")
         if len(v) > 100:
             raise ValueError("too many messages (max 100)")
-        # Check total content length
+        # Hard size cap only; token limits are checked against the model's context window
         total_length = sum(len(str(m.get('content', ''))) for m in v if isinstance(m, dict))
-        if total_length > 100000:
-            raise ValueError("total message content too long (max 100000 chars)")
+        if total_length > 1000000:
+            raise ValueError("total message content too long (max 1000000 chars)")
         return v
 
 class UsageResponse(BaseModel):
     today: Dict[str, int]
+    windows: Dict[str, Dict[str, int]]
     limit: Dict[str, int]
 
-# In-memory usage tracking (use Redis in production)
-usage_tracker: Dict[str, Dict[str, int]] = {}
+# Bounded rolling-window usage counters, snapshotted for warm restarts (config: usage)
+usage_store = UsageStore.from_config(config, backend=shared_state.usage_backend())
 
 def track_usage(user: str, tokens_in: int, tokens_out: int):
     """Track API usage per user"""
-    today = datetime.now().strftime("%Y-%m-%d")
-    key = f"{user}:{today}"
-    if key not in usage_tracker:
-        usage_tracker[key] = {"requests": 0, "tokens_in": 0, "tokens_out": 0}
-    usage_tracker[key]["requests"] += 1
-    usage_tracker[key]["tokens_in"] += tokens_in
-    usage_tracker[key]["tokens_out"] += tokens_out
+    usage_store.record(user, tokens_in, tokens_out)
+
+# Pre-flight prompt sizing and context-window checks (config: tokens)
+token_estimator = TokenEstimator.from_config(config)
+
+# Exact-match response cache for /v1/chat/completions (config: cache)
+response_cache = ResponseCache.from_config(config, shared_store=shared_state.kv_store())
+
+# Single-flight layer for identical in-flight completions (config: coalescing)
+coalescer = SingleFlight.from_config(config)
+
+def provider_configured(provider: str) -> bool:
+    """Whether credentials for a provider are present"""
+    if provider == "anthropic":
+        return bool(os.getenv("ANTHROPIC_API_KEY"))
+    if provider == "bedrock":
+        return bool(os.getenv("AWS_ACCESS_KEY_ID"))
+    if provider == "gemini":
+        return bool(os.getenv("GOOGLE_API_KEY"))
+    return False
+
+# Failover / hedging between equivalent Anthropic and Bedrock models (config: routing)
+router = ProviderRouter.from_config(config, available=provider_configured)
+
+# Upstream endpoints; overridable to point at a mock upstream (see loadtest/)
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+BEDROCK_ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL") or None
+
+# Per-request deadlines from X-Request-Timeout or the traffic class (config: deadlines)
+deadline_policy = DeadlinePolicy.from_config(config)
+
+# Connect/read/pool timeouts tuned from observed provider latencies
+upstream_timeouts = AdaptiveTimeouts.from_config(config, latencies=lambda p: router.stats[p].latencies)
+
+# Pooled HTTP client for Anthropic and Coder calls (keep-alive, one TLS context).
+# Created on first use so it binds to the serving event loop; closed on shutdown.
+_upstream_client: Optional[httpx.AsyncClient] = None
+
+def upstream_client() -> httpx.AsyncClient:
+    global _upstream_client
+    if _upstream_client is None:
+        _upstream_client = httpx.AsyncClient(
+            timeout=upstream_timeouts.for_call("anthropic"),
+            limits=httpx.Limits(
+                max_connections=admission.max_concurrent * 2,
+                max_keepalive_connections=admission.max_concurrent
+            )
+        )
+    return _upstream_client
+
+def anthropic_call_options() -> Dict[str, Any]:
+    """httpx request options for an Anthropic call: tuned timeouts plus handshake tracing"""
+    return {
+        "timeout": upstream_timeouts.for_call("anthropic"),
+        "extensions": {"trace": upstream_timeouts.tracer("anthropic")},
+    }
+
+def anthropic_keys() -> Dict[str, str]:
+    """ANTHROPIC_API_KEY plus extra keys from ANTHROPIC_API_KEYS (comma-separated), by label"""
+    keys = [os.getenv("ANTHROPIC_API_KEY", "")] + os.getenv("ANTHROPIC_API_KEYS", "").split(",")
+    unique = dict.fromkeys(k.strip() for k in keys if k.strip())
+    return {f"key{i}": key for i, key in enumerate(unique)}
+
+def bedrock_regions() -> List[str]:
+    """Regions Bedrock calls are spread over (default: AWS_REGION only)"""
+    env_regions = [r.strip() for r in os.getenv("AI_GATEWAY_BEDROCK_REGIONS", "").split(",") if r.strip()]
+    configured = list(((config.get("providers", {}) or {}).get("bedrock") or {}).get("regions") or [])
+    return env_regions or configured or [os.getenv("AWS_REGION", "us-east-1")]
+
+ANTHROPIC_KEYS = anthropic_keys()
+
+# Conversations stick to one key / region so provider prompt caches stay warm (config: affinity)
+affinity = AffinityRouter.from_config(config, targets={"anthropic": list(ANTHROPIC_KEYS), "bedrock": bedrock_regions()})
+
+def anthropic_key(target: Optional[str]) -> Optional[str]:
+    return ANTHROPIC_KEYS.get(target) or os.getenv("ANTHROPIC_API_KEY")
+
+# Shared Bedrock runtime clients, one per region (boto3 clients are thread-safe)
+_bedrock_runtime: Dict[str, Any] = {}
+
+def bedrock_runtime(region: Optional[str] = None):
+    region = region or os.getenv("AWS_REGION", "us-east-1")
+    if region not in _bedrock_runtime:
+        _bedrock_runtime[region] = boto3.client(
+            "bedrock-runtime",
+            region_name=region,
+            endpoint_url=BEDROCK_ENDPOINT_URL,
+            config=BotoConfig(read_timeout=120, retries={"max_attempts": 1})
+        )
+    return _bedrock_runtime[region]
+
+_bedrock_control = None
+
+def bedrock_control():
+    """Shared Bedrock control-plane client (model listing)"""
+    global _bedrock_control
+    if _bedrock_control is None:
+        _bedrock_control = boto3.client("bedrock", region_name=os.getenv("AWS_REGION", "us-east-1"))
+    return _bedrock_control
+
+# Models served by each provider: config.yaml plus background discovery (config: catalog)
+catalog = ModelCatalog.from_config(
+    config,
+    available=provider_configured,
+    anthropic_fetch=anthropic_fetcher(ANTHROPIC_BASE_URL, lambda: os.getenv("ANTHROPIC_API_KEY")),
+    bedrock_fetch=bedrock_fetcher(bedrock_control),
+)
+
+# Re-applied on config reload; other sections take effect after a restart
+config_manager.subscribe("rate_limits", rate_limiter.prepare_reload)
+config_manager.subscribe("tokens", token_estimator.prepare_reload)
+config_manager.subscribe("providers", router.prepare_reload)
+config_manager.subscribe("providers", catalog.prepare_reload)
+
+def etag_response(body: bytes, etag: str, request: Request) -> Response:
+    """Serve a pre-serialized catalog body, or 304 when the client's copy is current"""
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    # Compressed responses carry the weak form of the ETag (W/"...")
+    if etag in request.headers.get("if-none-match", "").replace("W/", "").split(", "):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 def log_request(
     workspace_id: str,
@@ -304,11 +378,15 @@ def log_request(
     status: int,
     user_id: Optional[str] = None,
     template_name: Optional[str] = None,
-    endpoint: Optional[str] = None
+    endpoint: Optional[str] = None,
+    cached: bool = False,
+    coalesced: bool = False,
+    tokens_estimated: Optional[int] = None,
+    batched: bool = False
 ):
-    """Audit log for AI requests (console + database)"""
-    # Console logging
-    logger.info(json.dumps({
+    """Audit log for AI requests (audit file + database)"""
+    # Structured audit record (serialized and written by the audit thread)
+    audit_log.emit({
         "event": "ai_request",
         "timestamp": datetime.utcnow().isoformat(),
         "workspace_id": workspace_id,
@@ -318,12 +396,22 @@ def log_request(
         "model": model,
         "tokens_in": tokens_in,
         "tokens_out": tokens_out,
+        "tokens_estimated": tokens_estimated,
         "latency_ms": latency_ms,
-        "status": status
-    }))
-
-    # Persist to database
-    persist_usage(
+        "status": status,
+        "cached": cached,
+        "coalesced": coalesced,
+        "batched": batched
+    })
+
+    # Requests answered without an upstream call carry no upstream latency,
+    # and batch items have no per-item latency to report
+    if not cached and not coalesced:
+        latency = None if batched else latency_ms / 1000.0
+        metrics.record_upstream(provider, model, status, latency, tokens_in, tokens_out)
+
+    # Persist to database (background writers)
+    usage_db.submit(dict(
         workspace_id=workspace_id if workspace_id != "anonymous" else None,
         user_id=user_id,
         template_name=template_name,
@@ -333,8 +421,9 @@ def log_request(
         tokens_out=tokens_out,
         latency_ms=latency_ms,
         status_code=status,
-        endpoint=endpoint
-    )
+        endpoint=endpoint,
+        request_id=str(uuid.uuid4())[:8]
+    ))
 
 # ============================================================================
 # Health & Info Endpoints
@@ -351,48 +440,89 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "providers": providers_status
+        "providers": providers_status,
+        "routing": router.status(),
+        "catalog": catalog.status(),
+        "timeouts": upstream_timeouts.status(),
+        "affinity": affinity.status(),
+        "admission": admission.status(),
+        "config": config_manager.status(),
+        "database": await usage_db.ping()
     }
 
+if metrics.enabled:
+    metrics.stats.add("ai_gateway_cache_events_total", "Response cache events", "event",
+                      lambda: response_cache.stats)
+    metrics.stats.add("ai_gateway_coalescing_total", "Single-flight leaders and coalesced callers", "role",
+                      lambda: coalescer.stats)
+    metrics.stats.add("ai_gateway_rate_limit_decisions_total", "Rate limiter decisions", "decision",
+                      lambda: rate_limiter.stats)
+    metrics.stats.add("ai_gateway_routing_total", "Provider failovers and hedged requests", "event",
+                      lambda: router.counters)
+    metrics.stats.add("ai_gateway_context_window_total", "Requests over the context window", "action",
+                      lambda: token_estimator.stats)
+    metrics.stats.add("ai_gateway_admission_total", "Admission decisions", "decision",
+                      lambda: admission.stats)
+    metrics.stats.add("ai_gateway_admission_queue_depth", "Requests waiting for an upstream slot", "traffic_class",
+                      admission.queue_depths, kind="gauge")
+    metrics.stats.add("ai_gateway_admission_in_flight", "Upstream slots held per traffic class", "traffic_class",
+                      admission.class_in_flight, kind="gauge")
+    metrics.stats.add("ai_gateway_usage_writer_total", "Usage records by database writer outcome", "event",
+                      lambda: usage_db.stats)
+    metrics.stats.add("ai_gateway_audit_records_total", "Audit records by writer outcome", "event",
+                      lambda: audit_log.stats)
+    metrics.stats.add("ai_gateway_audit_queue_depth", "Audit records waiting to be written", "queue",
+                      lambda: {"audit": audit_log.queue_depth()}, kind="gauge")
+    metrics.stats.add("ai_gateway_batches_total", "Message batches submitted, items and polling outcomes", "event",
+                      lambda: batches.stats)
+    metrics.stats.add("ai_gateway_batches_in_progress", "Batches awaiting results", "backend",
+                      lambda: {type(batches.backend).__name__: batches.in_progress()}, kind="gauge")
+    metrics.stats.add("ai_gateway_config_reloads_total", "Config file reload outcomes", "event",
+                      lambda: config_manager.stats)
+    metrics.stats.add("ai_gateway_catalog_refresh_total", "Model catalog refreshes", "event",
+                      lambda: catalog.stats)
+    metrics.stats.add("ai_gateway_deadline_events_total", "Requests cut short by their deadline or a client disconnect",
+                      "event", lambda: deadline_policy.stats)
+    metrics.stats.add("ai_gateway_upstream_timeout_seconds", "Current adaptive upstream timeouts", "timeout",
+                      upstream_timeouts.status, kind="gauge")
+    metrics.stats.add("ai_gateway_affinity_total", "Upstream key/region placements by prefix affinity", "placement",
+                      lambda: affinity.stats)
+    metrics.stats.add("ai_gateway_upstream_target_in_flight", "Calls in flight per upstream key or region", "target",
+                      affinity.in_flight, kind="gauge")
+    metrics.stats.add("ai_gateway_compressed_responses_total", "Responses by compression outcome", "outcome",
+                      lambda: compressor.stats)
+    metrics.stats.add("ai_gateway_compression_bytes_total", "Response bytes before and after compression", "stage",
+                      lambda: compressor.bytes)
+    metrics.stats.add("ai_gateway_tracked_users", "Users held in the in-memory usage store", "store",
+                      lambda: {"usage": len(usage_store)}, kind="gauge")
+
+    @app.get(metrics.path, include_in_schema=False)
+    async def prometheus_metrics():
+        """Prometheus scrape endpoint"""
+        body, content_type = metrics.render()
+        return Response(content=body, media_type=content_type)
+
 @app.get("/v1/providers")
-async def list_providers():
-    """List available AI providers and their status"""
-    return {
-        "providers": [
-            {
-                "name": "anthropic",
-                "enabled": bool(os.getenv("ANTHROPIC_API_KEY")),
-                "models": ["claude-3-opus", "claude-3-sonnet", "claude-3-haiku"]
-            },
-            {
-                "name": "bedrock",
-                "enabled": bool(os.getenv("AWS_ACCESS_KEY_ID")),
-                "models": ["anthropic.claude-3-sonnet", "amazon.titan-text"]
-            },
-            {
-                "name": "gemini",
-                "enabled": bool(os.getenv("GOOGLE_API_KEY")),
-                "models": ["gemini-pro"]
-            }
-        ]
-    }
+async def list_providers(request: Request):
+    """List available AI providers and their models (from the catalog)"""
+    snapshot = catalog.snapshot
+    return etag_response(snapshot.body, snapshot.etag, request)
 
-@app.get("/v1/usage")
+@app.get("/v1/usage", response_model=UsageResponse)
 async def get_usage(x_workspace_id: Optional[str] = Header(None)):
-    """Get usage statistics for the current user"""
+    """Get usage statistics for the current user (rolling 1m / 1h / 24h windows)"""
     user = x_workspace_id or "anonymous"
-    today = datetime.now().strftime("%Y-%m-%d")
-    key = f"{user}:{today}"
-
-    current = usage_tracker.get(key, {"requests": 0, "tokens_in": 0, "tokens_out": 0})
+    windows = await usage_store.read_windows(user)
+    current = windows["24h"]
 
-    # Get limits from config
-    default_limits = config.get("rate_limits", {}).get("default", {})
-    rpm = default_limits.get("requests_per_minute", 60) * 60 * 24  # Daily
-    tpm = default_limits.get("tokens_per_minute", 100000) * 60 * 24
+    # Get limits from config (per-user override or default)
+    limits = rate_limiter.limits_for(user)
+    rpm = limits.get("requests_per_minute", 60) * 60 * 24  # Daily
+    tpm = limits.get("tokens_per_minute", 100000) * 60 * 24
 
     return {
         "today": current,
+        "windows": windows,
         "limit": {
             "requests_remaining": max(0, rpm - current["requests"]),
             "tokens_remaining": max(0, tpm - current["tokens_in"] - current["tokens_out"])
@@ -403,14 +533,44 @@ async def get_usage(x_workspace_id: Optional[str] = Header(None)):
 # Anthropic Claude API Proxy
 # ============================================================================
 
+# Upstream headers that describe the connection, not the payload. The body is
+# forwarded still encoded, so content-encoding stays; the length is recomputed.
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "transfer-encoding", "content-length",
+    "proxy-authenticate", "proxy-authorization", "te", "trailer", "upgrade",
+}
+_json_decoder = json.JSONDecoder()
+
+def extract_usage(body: bytes) -> tuple:
+    """
+    (input_tokens, output_tokens) from an Anthropic response body without
+    decoding the whole document. Messages end with the top-level "usage"
+    object, so only that object is parsed; a full decode is the fallback.
+    """
+    pos = body.rfind(b'"usage"')
+    if pos != -1:
+        start = body.find(b"{", pos)
+        if start != -1:
+            try:
+                usage, _ = _json_decoder.raw_decode(body[start:].decode("utf-8"))
+                if isinstance(usage, dict) and "input_tokens" in usage:
+                    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+            except (ValueError, UnicodeDecodeError):
+                pass
+    try:
+        usage = json.loads(body).get("usage") or {}
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    except (ValueError, AttributeError):
+        return 0, 0
+
 @app.api_route("/v1/claude/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
-@limiter.limit("60/minute")
 async def proxy_claude(
     request: Request,
     path: str,
     auth: Dict[str, Any] = Depends(verify_workspace_token),
     x_user_id: Optional[str] = Header(None),
-    x_template_name: Optional[str] = Header(None)
+    x_template_name: Optional[str] = Header(None),
+    x_scope: Optional[str] = Header(None)
 ):
     """Proxy requests to Anthropic Claude API. Requires authentication."""
     api_key = os.getenv("ANTHROPIC_API_KEY")
@@ -419,40 +579,80 @@ async def proxy_claude(
 
     workspace = auth.get("workspace_id", "anonymous")
     start_time = time.time()
+    request.state.metrics_labels = ("anthropic", "claude")
 
     # Build target URL
-    target_url = f"https://api.anthropic.com/{path}"
+    target_url = f"{ANTHROPIC_BASE_URL}/{path}"
 
     # Get request body if present
     body = None
     if request.method in ["POST", "PUT"]:
         body = await request.body()
 
-    # Forward headers (excluding hop-by-hop)
+    # Charge estimated tokens up front; reconciled with actual usage below
+    payload = None
+    try:
+        payload = json.loads(body) if body else None
+        tokens_estimated = token_estimator.estimate_payload(payload) if body else 0
+    except (ValueError, AttributeError, TypeError):
+        tokens_estimated = len(body) // 4
+    affinity_key = None
+    if isinstance(payload, dict) and payload.get("messages"):
+        affinity_key = affinity.key_for(payload.get("model", ""), payload.get("system"), payload["messages"])
+    ticket = await rate_limiter.acquire(rate_limit_identity(auth), tokens_estimated)
+    request.state.rate_limit_headers = ticket.headers if ticket else None
+
+    # Forward headers (excluding hop-by-hop). Upstream encodes the body in a
+    # coding the client accepts, so it can be passed through without recoding.
+    accept = request.headers.get("accept-encoding", "")
+    coding = negotiate(accept, compressor.offered) if compressor.enabled and accept else None
     headers = {
         "x-api-key": api_key,
         "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
+        "content-type": "application/json",
+        "accept-encoding": coding or "identity"
     }
 
+    # Slot wait and upstream call are abandoned at the deadline or on disconnect
+    traffic_class = admission.classify(x_scope, x_template_name)
+    deadline = deadline_policy.for_request(request.headers, traffic_class)
+
+    async def forward():
+        async with admission.slot(admission_identity(auth), traffic_class):
+            with affinity.lease("anthropic", affinity_key) as target:
+                upstream_start = time.perf_counter()
+                client = upstream_client()
+                upstream_request = client.build_request(
+                    method=request.method,
+                    url=target_url,
+                    content=body,
+                    headers={**headers, "x-api-key": anthropic_key(target)},
+                    **anthropic_call_options()
+                )
+                response = await client.send(upstream_request, stream=True)
+                try:
+                    # Raw bytes: still content-encoded, exactly as upstream sent them
+                    raw = b"".join([chunk async for chunk in response.aiter_raw()])
+                finally:
+                    await response.aclose()
+            request.state.upstream_seconds = time.perf_counter() - upstream_start
+            return response, raw
+
+    # The up-front estimate is settled on every path: a failed call charges nothing
+    tokens_used = 0
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                content=body,
-                headers=headers
-            )
+        response, raw = await run_until(forward(), deadline, request, deadline_policy)
 
         latency_ms = int((time.time() - start_time) * 1000)
 
-        # Parse response for logging
-        try:
-            resp_data = response.json()
-            tokens_in = resp_data.get("usage", {}).get("input_tokens", 0)
-            tokens_out = resp_data.get("usage", {}).get("output_tokens", 0)
-        except:
-            tokens_in, tokens_out = 0, 0
+        # The body is forwarded as-is; a decoded copy is read for the usage object only
+        tokens_in, tokens_out = 0, 0
+        if raw:
+            try:
+                tokens_in, tokens_out = extract_usage(decode(raw, response.headers.get("content-encoding", "")))
+            except ValueError as e:
+                logger.warning(f"Claude proxy: usage not read from response: {e}")
+        tokens_used = tokens_in + tokens_out
 
         # Track and log
         track_usage(workspace, tokens_in, tokens_out)
@@ -466,31 +666,38 @@ async def proxy_claude(
             status=response.status_code,
             user_id=x_user_id,
             template_name=x_template_name,
-            endpoint=f"/v1/claude/{path}"
+            endpoint=f"/v1/claude/{path}",
+            tokens_estimated=tokens_estimated
         )
 
-        return JSONResponse(
-            content=response.json(),
-            status_code=response.status_code
-        )
+        response_headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        if coding:
+            response_headers["vary"] = "Accept-Encoding"
+        return Response(content=raw, status_code=response.status_code, headers=response_headers)
 
+    except (DeadlineExceeded, ClientDisconnected, AdmissionRejected):
+        raise
     except httpx.TimeoutException:
+        metrics.record_error("anthropic", "timeout")
         raise HTTPException(status_code=504, detail="Upstream timeout")
     except Exception as e:
+        metrics.record_error("anthropic", "exception")
         logger.error(f"Claude proxy error: {str(e)}")
         raise HTTPException(status_code=502, detail=str(e))
+    finally:
+        await rate_limiter.reconcile(ticket, tokens_used)
 
 # ============================================================================
 # AWS Bedrock API Proxy
 # ============================================================================
 
 @app.post("/v1/bedrock/invoke")
-@limiter.limit("60/minute")
 async def invoke_bedrock(
     request: Request,
     auth: Dict[str, Any] = Depends(verify_workspace_token),
     x_user_id: Optional[str] = Header(None),
-    x_template_name: Optional[str] = Header(None)
+    x_template_name: Optional[str] = Header(None),
+    x_scope: Optional[str] = Header(None)
 ):
     """Invoke AWS Bedrock models. Requires authentication."""
     if not os.getenv("AWS_ACCESS_KEY_ID"):
@@ -501,23 +708,39 @@ async def invoke_bedrock(
 
     body = await request.json()
     model_id = body.get("model_id", "anthropic.claude-3-sonnet-20240229-v1:0")
+    request.state.metrics_labels = ("bedrock", model_id)
     prompt_body = body.get("body", {})
 
+    tokens_estimated = token_estimator.estimate_payload(prompt_body, model=model_id)
+    ticket = await rate_limiter.acquire(rate_limit_identity(auth), tokens_estimated)
+    request.state.rate_limit_headers = ticket.headers if ticket else None
+    traffic_class = admission.classify(x_scope, x_template_name)
+    deadline = deadline_policy.for_request(request.headers, traffic_class)
+    affinity_key = None
+    if isinstance(prompt_body, dict) and prompt_body.get("messages"):
+        affinity_key = affinity.key_for(model_id, prompt_body.get("system"), prompt_body["messages"])
+
+    # The up-front estimate is settled on every path: a failed call charges nothing
+    tokens_used = 0
     try:
-        # Initialize Bedrock client
-        client = boto3.client(
-            "bedrock-runtime",
-            region_name=os.getenv("AWS_REGION", "us-east-1")
-        )
+        def invoke(region: Optional[str]):
+            response = bedrock_runtime(region).invoke_model(
+                modelId=model_id,
+                body=json.dumps(prompt_body)
+            )
+            return json.loads(response["body"].read())
 
-        # Invoke model
-        response = client.invoke_model(
-            modelId=model_id,
-            body=json.dumps(prompt_body)
-        )
+        # Invoke model (boto3 is blocking; keep it off the event loop). A boto3
+        # call cannot be interrupted, but the slot is freed at the deadline.
+        async def forward():
+            async with admission.slot(admission_identity(auth), traffic_class):
+                with affinity.lease("bedrock", affinity_key) as region:
+                    upstream_start = time.perf_counter()
+                    response_body = await asyncio.to_thread(invoke, region)
+                    request.state.upstream_seconds = time.perf_counter() - upstream_start
+                return response_body
 
-        # Parse response
-        response_body = json.loads(response["body"].read())
+        response_body = await run_until(forward(), deadline, request, deadline_policy)
 
         latency_ms = int((time.time() - start_time) * 1000)
 
@@ -525,6 +748,8 @@ async def invoke_bedrock(
         tokens_in = response_body.get("usage", {}).get("input_tokens", 0)
         tokens_out = response_body.get("usage", {}).get("output_tokens", 0)
 
+        tokens_used = tokens_in + tokens_out
+
         # Track and log
         track_usage(workspace, tokens_in, tokens_out)
         log_request(
@@ -537,43 +762,193 @@ async def invoke_bedrock(
             status=200,
             user_id=x_user_id,
             template_name=x_template_name,
-            endpoint="/v1/bedrock/invoke"
+            endpoint="/v1/bedrock/invoke",
+            tokens_estimated=tokens_estimated
         )
 
-        return response_body
+        return FastJSONResponse(response_body)
 
-    except client.exceptions.ThrottlingException:
+    except (DeadlineExceeded, ClientDisconnected, AdmissionRejected):
+        raise
+    except bedrock_runtime().exceptions.ThrottlingException:
+        metrics.record_error("bedrock", "throttled")
         raise HTTPException(status_code=429, detail="Bedrock rate limited")
     except Exception as e:
+        metrics.record_error("bedrock", "exception")
         logger.error(f"Bedrock invoke error: {str(e)}")
         raise HTTPException(status_code=502, detail=str(e))
+    finally:
+        await rate_limiter.reconcile(ticket, tokens_used)
 
 @app.get("/v1/bedrock/models")
-async def list_bedrock_models():
-    """List available Bedrock models"""
+async def list_bedrock_models(request: Request):
+    """List available Bedrock models (from the catalog)"""
     if not os.getenv("AWS_ACCESS_KEY_ID"):
         raise HTTPException(status_code=503, detail="AWS Bedrock not configured")
 
+    snapshot = catalog.snapshot
+    return etag_response(snapshot.bedrock_body, snapshot.bedrock_etag, request)
+
+# ============================================================================
+# Message Batches (bulk CI / agent workloads)
+# ============================================================================
+
+BATCH_RESULT_STATUS = {"succeeded": 200, "errored": 502, "canceled": 499, "expired": 504}
+
+async def _batch_item_local(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Local batch stand-in: one Messages API call per item"""
+    response = await upstream_client().post(
+        f"{ANTHROPIC_BASE_URL}/v1/messages",
+        headers={"x-api-key": os.getenv("ANTHROPIC_API_KEY") or "", "anthropic-version": "2023-06-01"},
+        json=params,
+        **anthropic_call_options()
+    )
+    response.raise_for_status()
+    return response.json()
+
+async def record_batch_item(job, result: Dict[str, Any]):
+    """Usage and audit for one batch result"""
+    outcome = result.get("result") or {}
+    message = outcome.get("message") or {}
+    usage = message.get("usage") or {}
+    tokens_in = usage.get("input_tokens", 0)
+    tokens_out = usage.get("output_tokens", 0)
+    context = job.context
+    track_usage(context["workspace_id"], tokens_in, tokens_out)
+    log_request(
+        workspace_id=context["workspace_id"],
+        provider="anthropic",
+        model=message.get("model") or context["models"].get(result.get("custom_id"), "unknown"),
+        tokens_in=tokens_in,
+        tokens_out=tokens_out,
+        latency_ms=0,
+        status=BATCH_RESULT_STATUS.get(outcome.get("type"), 500),
+        user_id=context["user_id"],
+        template_name=context["template_name"],
+        endpoint="/v1/batches",
+        batched=True
+    )
+
+# Batch submission and polling (config: batches)
+batches = BatchManager.from_config(
+    config,
+    backends={
+        "anthropic": lambda: AnthropicBatchBackend(ANTHROPIC_BASE_URL, lambda: os.getenv("ANTHROPIC_API_KEY")),
+        "local": lambda: LocalBatchBackend(_batch_item_local),
+    },
+    on_item=record_batch_item
+)
+
+def _owned_batch(batch_id: str, auth: Dict[str, Any]):
+    job = batches.get(batch_id, rate_limit_identity(auth))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return job
+
+@app.post("/v1/batches", status_code=202)
+async def create_batch(
+    req: Request,
+    auth: Dict[str, Any] = Depends(verify_workspace_token),
+    x_user_id: Optional[str] = Header(None),
+    x_template_name: Optional[str] = Header(None)
+):
+    """
+    Submit a JSONL prompt set as one provider batch. Each line is an
+    Anthropic batch request ({"custom_id", "params"}) or a bare Messages
+    payload. Results are available from /v1/batches/{id}/results once the
+    batch has ended.
+
+    Items get the interactive checks (allowed model, max_tokens bounds,
+    context window) and must have an Anthropic equivalent. The whole batch
+    is charged against TPM at submission: the sum of every item's prompt
+    estimate plus max_tokens, beyond one minute's worth as debt.
+    """
+    if not batches.enabled:
+        raise HTTPException(status_code=404, detail="Batches are disabled")
+    if not os.getenv("ANTHROPIC_API_KEY"):
+        raise HTTPException(status_code=503, detail="Anthropic not configured")
+
     try:
-        client = boto3.client(
-            "bedrock",
-            region_name=os.getenv("AWS_REGION", "us-east-1")
-        )
-        response = client.list_foundation_models()
-
-        return {
-            "models": [
-                {
-                    "id": m["modelId"],
-                    "name": m.get("modelName", m["modelId"]),
-                    "provider": m.get("providerName", "unknown")
-                }
-                for m in response.get("modelSummaries", [])
-            ]
-        }
-    except Exception as e:
-        logger.error(f"Bedrock list models error: {str(e)}")
-        raise HTTPException(status_code=502, detail=str(e))
+        items = parse_items(await req.body(), batches.max_items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Batches run on Anthropic: map Bedrock IDs to their equivalents and size every prompt up front
+    models = {}
+    tokens_estimated = 0
+    for item in items:
+        params = item["params"]
+        model = params["model"]
+        if not catalog.allows(model):
+            raise HTTPException(status_code=400, detail=f"{item['custom_id']}: model '{model}' not allowed")
+        mapped = router.model_for("anthropic", model)
+        if mapped is None:
+            raise HTTPException(status_code=400,
+                                detail=f"{item['custom_id']}: model '{model}' has no Anthropic equivalent for batches")
+        params["model"] = mapped
+        max_tokens = params.setdefault("max_tokens", 1024)
+        if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) \
+                or not 1 <= max_tokens <= MAX_OUTPUT_TOKENS:
+            raise HTTPException(status_code=400,
+                                detail=f"{item['custom_id']}: max_tokens must be between 1 and {MAX_OUTPUT_TOKENS}")
+        try:
+            params["messages"], prompt_tokens = token_estimator.fit(
+                params["model"], params["messages"], max_tokens, params.get("system"))
+        except ContextWindowExceeded as e:
+            raise HTTPException(status_code=400, detail=f"{item['custom_id']}: {e}")
+        tokens_estimated += prompt_tokens + max_tokens
+        models[item["custom_id"]] = params["model"]
+
+    # A batch is one request against RPM and its full estimate against TPM.
+    # acquire() charges at most one minute's worth; the rest is forced on as debt.
+    identity = rate_limit_identity(auth)
+    ticket = await rate_limiter.acquire(identity, tokens_estimated)
+    await rate_limiter.reconcile(ticket, tokens_estimated)
+    req.state.rate_limit_headers = ticket.headers if ticket else None
+
+    context = {
+        "workspace_id": auth.get("workspace_id", "anonymous"),
+        "user_id": auth.get("user_id") or x_user_id,
+        "template_name": x_template_name,
+        "models": models,
+    }
+    try:
+        job = await batches.submit(items, identity, context)
+    except httpx.HTTPStatusError as e:
+        await rate_limiter.reconcile(ticket, 0)
+        status = e.response.status_code
+        raise HTTPException(status_code=status if status in (400, 413, 429) else 502, detail=e.response.text[:500])
+    except httpx.TransportError as e:
+        await rate_limiter.reconcile(ticket, 0)
+        raise HTTPException(status_code=502, detail=f"Batch submission failed: {e}")
+    return job.public()
+
+@app.get("/v1/batches")
+async def list_batches(auth: Dict[str, Any] = Depends(verify_workspace_token)):
+    """Batches submitted by the caller"""
+    return {"batches": [job.public() for job in batches.list(rate_limit_identity(auth))]}
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, auth: Dict[str, Any] = Depends(verify_workspace_token)):
+    """Batch status and per-outcome request counts"""
+    return _owned_batch(batch_id, auth).public()
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, auth: Dict[str, Any] = Depends(verify_workspace_token)):
+    """Cancel a batch; items already processed keep their results"""
+    try:
+        job = await batches.cancel(_owned_batch(batch_id, auth))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Batch cancel failed: {e}")
+    return job.public()
+
+@app.get("/v1/batches/{batch_id}/results")
+async def get_batch_results(batch_id: str, auth: Dict[str, Any] = Depends(verify_workspace_token)):
+    """Stream batch results as JSONL (one line per custom_id)"""
+    job = _owned_batch(batch_id, auth)
+    if not job.results_ready:
+        raise HTTPException(status_code=409, detail=f"Batch is {job.status}; results are not ready")
+    return StreamingResponse(batches.results(job), media_type="application/x-ndjson")
 
 # ============================================================================
 # Google Gemini API Proxy (Planned)
@@ -597,14 +972,14 @@ async def proxy_gemini(request: Request, path: str):
 # ============================================================================
 
 @app.post("/v1/chat/completions")
-@limiter.limit("60/minute")
 async def unified_chat(
     request: MessageRequest,
     req: Request,
     auth: Dict[str, Any] = Depends(verify_workspace_token),
     x_user_id: Optional[str] = Header(None),
     x_template_name: Optional[str] = Header(None),
-    x_provider: Optional[str] = Header("anthropic")
+    x_provider: Optional[str] = Header(None),
+    x_scope: Optional[str] = Header(None)
 ):
     """
     Unified chat endpoint that routes to the appropriate provider.
@@ -616,18 +991,170 @@ async def unified_chat(
         "workspace_id": workspace,
         "user_id": auth.get("user_id") or x_user_id,
         "template_name": x_template_name,
-        "authenticated": auth.get("authenticated", False)
+        "authenticated": auth.get("authenticated", False),
+        "admission_identity": admission_identity(auth),
+        "traffic_class": admission.classify(x_scope, x_template_name)
     }
-
-    # Route to appropriate provider
-    if x_provider == "anthropic" or request.model.startswith("claude"):
-        return await _chat_anthropic(request, context)
-    elif x_provider == "bedrock" or request.model.startswith("anthropic."):
-        return await _chat_bedrock(request, context)
-    elif x_provider == "gemini" or request.model.startswith("gemini"):
+    # Everything from here to the upstream answer runs under this deadline
+    context["deadline"] = deadline = deadline_policy.for_request(req.headers, context["traffic_class"])
+    # Taken before any trimming so the conversation keeps its upstream key / region
+    context["affinity_key"] = affinity.key_for(request.model, request.system, request.messages)
+
+    # Size the prompt locally: reject (or trim) what cannot fit the context window
+    max_tokens = request.max_tokens or 0
+    messages, prompt_tokens = token_estimator.fit(request.model, request.messages, max_tokens, request.system)
+    if messages is not request.messages:
+        request = request.model_copy(update={"messages": messages})
+    context["tokens_estimated"] = prompt_tokens
+
+    # Charge RPM and estimated TPM before any upstream call (or cache lookup)
+    context["rate_limit"] = await rate_limiter.acquire(rate_limit_identity(auth), prompt_tokens + max_tokens)
+    req.state.rate_limit_headers = context["rate_limit"].headers if context["rate_limit"] else None
+
+    # Preferred provider: X-Provider header, else inferred from the model ID.
+    # The router may still fail over to the equivalent model on the other one.
+    provider = x_provider or provider_for_model(request.model)
+    if provider == "gemini":
         raise HTTPException(status_code=501, detail="Gemini support coming soon")
-    else:
+    if provider not in ("anthropic", "bedrock"):
         raise HTTPException(status_code=400, detail=f"Unknown provider: {x_provider}")
+    req.state.metrics_labels = (provider, request.model)
+
+    # Serve deterministic repeats from the response cache
+    key = None
+    start_time = time.time()
+    if response_cache.eligible(request):
+        key = response_cache.key_for(request)
+        cached = await response_cache.get(key)
+        if cached is not None:
+            await _log_zero_token_request(context, provider, request.model, start_time, cached=True)
+            return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
+
+    # Streaming (Anthropic only); identical in-flight streams are fanned out
+    if request.stream and provider == "anthropic":
+        if not os.getenv("ANTHROPIC_API_KEY"):
+            raise HTTPException(status_code=503, detail="Anthropic not configured")
+
+        # Take the upstream slot before responding. It is held until the upstream
+        # stream ends, and the lease hands it back exactly once on every path,
+        # including a response torn down before its first chunk.
+        acquiring = asyncio.ensure_future(admission.lease(context["admission_identity"], context["traffic_class"]))
+        try:
+            lease = await run_until(acquiring, deadline, req, deadline_policy)
+        except BaseException:
+            # Admitted just as the wait was abandoned (deadline, disconnect, cancellation)
+            if acquiring.done() and not acquiring.cancelled() and acquiring.exception() is None:
+                acquiring.result().release()
+            raise
+        try:
+            if not coalescer.eligible(request):
+                return LeasedStreamingResponse(_stream_anthropic(request, context), lease,
+                                               media_type="text/event-stream")
+            # The shared upstream stream outlives any one subscriber: the leader's
+            # slot follows the stream, not the leader's response
+            flight_key = response_cache.key_for(request) + ":stream"
+            stream, leader = coalescer.stream(flight_key, lambda: _stream_anthropic(request, context),
+                                              on_done=lease.release)
+            if not leader:
+                lease.release()
+                await _log_zero_token_request(context, provider, request.model, start_time, coalesced=True)
+            return StreamingResponse(stream, media_type="text/event-stream")
+        except BaseException:
+            lease.release()
+            raise
+
+    # Identical in-flight requests share one upstream call; it is cancelled
+    # once every caller waiting on it has disconnected or run out of time
+    if coalescer.eligible(request):
+        flight_key = key or response_cache.key_for(request)
+        resp_data, leader = await run_until(
+            coalescer.do(flight_key, lambda: _route_chat(request, context, provider)), deadline, req, deadline_policy)
+        if not leader:
+            await _log_zero_token_request(context, provider, request.model, start_time, coalesced=True)
+    else:
+        resp_data = await run_until(_route_chat(request, context, provider), deadline, req, deadline_policy)
+    req.state.upstream_seconds = context.get("upstream_seconds")
+
+    # Serialized once: the same bytes are cached and returned.
+    # Only successful completions are cached, never upstream errors.
+    body = dumps(resp_data)
+    if key is not None and resp_data.get("type") == "message":
+        await response_cache.set(key, body)
+
+    return Response(content=body, media_type="application/json")
+
+async def _log_zero_token_request(
+    context: Dict[str, Any],
+    provider: str,
+    model: str,
+    start_time: float,
+    cached: bool = False,
+    coalesced: bool = False
+):
+    """Audit a request answered without its own upstream call (cache hit or coalesced)"""
+    await rate_limiter.reconcile(context.get("rate_limit"), 0)
+    log_request(
+        workspace_id=context["workspace_id"],
+        provider=provider,
+        model=model,
+        tokens_in=0,
+        tokens_out=0,
+        latency_ms=int((time.time() - start_time) * 1000),
+        status=200,
+        user_id=context["user_id"],
+        template_name=context["template_name"],
+        tokens_estimated=context.get("tokens_estimated"),
+        endpoint="/v1/chat/completions",
+        cached=cached,
+        coalesced=coalesced
+    )
+
+async def _route_chat(request: MessageRequest, context: Dict[str, Any], provider: str):
+    """Send a chat through the provider router (failover, hedging, circuit breakers)"""
+    handlers = {"anthropic": _chat_anthropic, "bedrock": _chat_bedrock}
+
+    async def invoke(target: str, model: str):
+        routed = request if model == request.model else request.model_copy(update={"model": model})
+        return await handlers[target](routed, context)
+
+    try:
+        async with admission.slot(context["admission_identity"], context["traffic_class"]):
+            upstream_start = time.perf_counter()
+            try:
+                return await router.call(provider, request.model, invoke)
+            finally:
+                context["upstream_seconds"] = time.perf_counter() - upstream_start
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status if e.status in (429, 503, 504) else 502, detail=str(e))
+
+class LeasedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse holding an admission slot until it is done, however it
+    ends: finished, failed, client gone, or cancelled before the body
+    generator ever ran (whose own finally blocks would then never run).
+    """
+
+    def __init__(self, content, lease: SlotLease, **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.lease.release()
+
+def messages_payload(request: MessageRequest) -> Dict[str, Any]:
+    """Messages API body for a unified chat request"""
+    payload = {
+        "model": request.model,
+        "messages": request.messages,
+        "max_tokens": request.max_tokens,
+        "temperature": request.temperature
+    }
+    if request.system is not None:
+        payload["system"] = request.system
+    return payload
 
 async def _chat_anthropic(request: MessageRequest, context: Dict[str, Any]):
     """Route chat to Anthropic"""
@@ -637,29 +1164,36 @@ async def _chat_anthropic(request: MessageRequest, context: Dict[str, Any]):
 
     start_time = time.time()
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json"
-            },
-            json={
-                "model": request.model,
-                "messages": request.messages,
-                "max_tokens": request.max_tokens,
-                "temperature": request.temperature
-            }
-        )
+    try:
+        with affinity.lease("anthropic", context.get("affinity_key")) as target:
+            response = await upstream_client().post(
+                f"{ANTHROPIC_BASE_URL}/v1/messages",
+                headers={
+                    "x-api-key": anthropic_key(target),
+                    "anthropic-version": "2023-06-01",
+                    "content-type": "application/json"
+                },
+                json=messages_payload(request),
+                **anthropic_call_options()
+            )
+    except httpx.TimeoutException:
+        metrics.record_error("anthropic", "timeout")
+        raise UpstreamError("anthropic", 504, "Upstream timeout")
+    except httpx.TransportError as e:
+        metrics.record_error("anthropic", "connection")
+        raise UpstreamError("anthropic", 502, str(e))
 
     latency_ms = int((time.time() - start_time) * 1000)
-    resp_data = response.json()
+    try:
+        resp_data = loads(response.content)
+    except ValueError:
+        resp_data = {"type": "error", "error": {"message": response.text[:500]}}
 
     tokens_in = resp_data.get("usage", {}).get("input_tokens", 0)
     tokens_out = resp_data.get("usage", {}).get("output_tokens", 0)
 
     track_usage(context["workspace_id"], tokens_in, tokens_out)
+    await rate_limiter.reconcile(context.get("rate_limit"), tokens_in + tokens_out)
     log_request(
         workspace_id=context["workspace_id"],
         provider="anthropic",
@@ -670,11 +1204,97 @@ async def _chat_anthropic(request: MessageRequest, context: Dict[str, Any]):
         status=response.status_code,
         user_id=context["user_id"],
         template_name=context["template_name"],
+        tokens_estimated=context.get("tokens_estimated"),
         endpoint="/v1/chat/completions"
     )
 
+    # Throttling and server errors are worth retrying on another provider
+    if response.status_code == 429 or response.status_code >= 500:
+        raise UpstreamError("anthropic", response.status_code, response.text)
+
     return resp_data
 
+# Sent in place of the rest of a stream that outlives its deadline (Anthropic SSE error shape)
+STREAM_DEADLINE_EVENT = (b'event: error\ndata: {"type": "error", "error": {"type": "timeout_error", '
+                         b'"message": "Request deadline of %gs exceeded"}}\n\n')
+
+async def _stream_anthropic(request: MessageRequest, context: Dict[str, Any]):
+    """Stream chat from Anthropic as raw SSE bytes, logging usage when the stream ends"""
+    start_time = time.time()
+    tokens_in, tokens_out, status = 0, 0, 0
+    pending = b""
+    deadline = context.get("deadline")
+
+    try:
+        with affinity.lease("anthropic", context.get("affinity_key")) as target:
+            async with upstream_client().stream(
+                "POST",
+                f"{ANTHROPIC_BASE_URL}/v1/messages",
+                headers={
+                    "x-api-key": anthropic_key(target),
+                    "anthropic-version": "2023-06-01",
+                    "content-type": "application/json"
+                },
+                json={**messages_payload(request), "stream": True},
+                **anthropic_call_options()
+            ) as response:
+                status = response.status_code
+                first_byte = True
+                chunks = response.aiter_raw()
+                while True:
+                    # Each read is bounded by what is left of the deadline
+                    try:
+                        if deadline is None:
+                            chunk = await chunks.__anext__()
+                        else:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), deadline.remaining())
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        status = 504
+                        deadline_policy.stats["exceeded"] += 1
+                        # Terminate any partial event, then tell the client why the stream ended
+                        yield (b"\n\n" if pending else b"\n") + STREAM_DEADLINE_EVENT % deadline.budget
+                        break
+                    if first_byte:
+                        metrics.observe_ttfb("anthropic", request.model, time.time() - start_time)
+                        first_byte = False
+                    yield chunk
+
+                    # Usage arrives in message_start (input) and message_delta (output)
+                    pending += chunk
+                    *lines, pending = pending.split(b"\n")
+                    for line in lines:
+                        if not line.startswith(b"data:") or b'"usage"' not in line:
+                            continue
+                        try:
+                            event = json.loads(line[5:])
+                        except ValueError:
+                            continue
+                        usage = event.get("usage") or event.get("message", {}).get("usage", {})
+                        tokens_in = usage.get("input_tokens", tokens_in)
+                        tokens_out = usage.get("output_tokens", tokens_out)
+    except (asyncio.CancelledError, GeneratorExit):
+        # Client disconnected (or every coalesced listener did)
+        status = 499
+        raise
+    finally:
+        track_usage(context["workspace_id"], tokens_in, tokens_out)
+        await rate_limiter.reconcile(context.get("rate_limit"), tokens_in + tokens_out)
+        log_request(
+            workspace_id=context["workspace_id"],
+            provider="anthropic",
+            model=request.model,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out,
+            latency_ms=int((time.time() - start_time) * 1000),
+            status=status or 499,
+            user_id=context["user_id"],
+            template_name=context["template_name"],
+            tokens_estimated=context.get("tokens_estimated"),
+            endpoint="/v1/chat/completions"
+        )
+
 async def _chat_bedrock(request: MessageRequest, context: Dict[str, Any]):
     """Route chat to AWS Bedrock"""
     if not os.getenv("AWS_ACCESS_KEY_ID"):
@@ -682,11 +1302,6 @@ async def _chat_bedrock(request: MessageRequest, context: Dict[str, Any]):
 
     start_time = time.time()
 
-    client = boto3.client(
-        "bedrock-runtime",
-        region_name=os.getenv("AWS_REGION", "us-east-1")
-    )
-
     # Convert to Bedrock format
     bedrock_body = {
         "anthropic_version": "bedrock-2023-05-31",
@@ -694,19 +1309,38 @@ async def _chat_bedrock(request: MessageRequest, context: Dict[str, Any]):
         "max_tokens": request.max_tokens,
         "temperature": request.temperature
     }
+    if request.system is not None:
+        bedrock_body["system"] = request.system
 
-    response = client.invoke_model(
-        modelId=request.model,
-        body=json.dumps(bedrock_body)
-    )
+    def invoke(region: Optional[str]):
+        response = bedrock_runtime(region).invoke_model(
+            modelId=request.model,
+            body=json.dumps(bedrock_body)
+        )
+        return json.loads(response["body"].read())
+
+    # boto3 is blocking; run it off the event loop so calls can overlap (hedging)
+    try:
+        with affinity.lease("bedrock", context.get("affinity_key")) as region:
+            response_body = await asyncio.to_thread(invoke, region)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code", "ClientError")
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 502)
+        metrics.record_error("bedrock", code)
+        if code == "ThrottlingException" or status == 429 or status >= 500:
+            raise UpstreamError("bedrock", 429 if code == "ThrottlingException" else status, str(e))
+        raise HTTPException(status_code=status, detail=str(e))
+    except BotoCoreError as e:
+        metrics.record_error("bedrock", "connection")
+        raise UpstreamError("bedrock", 504 if "timeout" in str(e).lower() else 502, str(e))
 
-    response_body = json.loads(response["body"].read())
     latency_ms = int((time.time() - start_time) * 1000)
 
     tokens_in = response_body.get("usage", {}).get("input_tokens", 0)
     tokens_out = response_body.get("usage", {}).get("output_tokens", 0)
 
     track_usage(context["workspace_id"], tokens_in, tokens_out)
+    await rate_limiter.reconcile(context.get("rate_limit"), tokens_in + tokens_out)
     log_request(
         workspace_id=context["workspace_id"],
         provider="bedrock",
@@ -717,30 +1351,125 @@ async def _chat_bedrock(request: MessageRequest, context: Dict[str, Any]):
         status=200,
         user_id=context["user_id"],
         template_name=context["template_name"],
+        tokens_estimated=context.get("tokens_estimated"),
         endpoint="/v1/chat/completions"
     )
 
     return response_body
 
+admission.on_wait = metrics.observe_queue_wait
+
+# ============================================================================
+# Lifecycle
+# ============================================================================
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Restore usage counters; start snapshots / shared flushes, usage DB writers, catalog refresh,
+    batch polling and the config watcher"""
+    usage_store.load_snapshot()
+    await usage_db.start()
+    audit_log.start()
+    app.state.background_tasks = [asyncio.create_task(usage_store.run_snapshots())]
+    if usage_store.backend is not None:
+        app.state.background_tasks.append(asyncio.create_task(usage_store.run_flush()))
+    if shared_state.sqlite is not None:
+        app.state.background_tasks.append(asyncio.create_task(shared_state.run_maintenance()))
+    app.state.background_tasks.append(asyncio.create_task(catalog.run_refresh()))
+    app.state.background_tasks.append(asyncio.create_task(batches.run_polling()))
+    app.state.background_tasks.append(asyncio.create_task(config_manager.run_watch()))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    """Write a final usage snapshot and flush queued usage records"""
+    for task in app.state.background_tasks:
+        task.cancel()
+    await usage_store.snapshot()
+    await usage_store.flush()
+    await usage_db.stop()
+    audit_log.stop()
+    metrics.shutdown()
+    global _upstream_client
+    if _upstream_client is not None:
+        await _upstream_client.aclose()
+        _upstream_client = None
+
 # ============================================================================
 # Error Handlers
 # ============================================================================
 
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
-    return JSONResponse(
+@app.exception_handler(RateLimited)
+async def rate_limit_handler(request: Request, exc: RateLimited):
+    metrics.record_rate_limited(exc.scope)
+    return FastJSONResponse(
         status_code=429,
         content={
             "error": "rate_limit_exceeded",
             "message": "Too many requests. Please wait and try again.",
-            "retry_after": 60
+            "retry_after": exc.retry_after
+        },
+        headers=exc.headers
+    )
+
+@app.exception_handler(ContextWindowExceeded)
+async def context_window_handler(request: Request, exc: ContextWindowExceeded):
+    return FastJSONResponse(
+        status_code=400,
+        content={
+            "error": "context_length_exceeded",
+            "message": str(exc),
+            "estimated_prompt_tokens": exc.prompt_tokens,
+            "max_tokens": exc.max_tokens,
+            "context_window": exc.context_window
+        }
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return FastJSONResponse(
+        status_code=504,
+        content={
+            "error": "deadline_exceeded",
+            "message": str(exc),
+            "timeout": exc.deadline.budget
         }
     )
 
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # Nobody is listening; 499 (nginx's "client closed request") is for logs and metrics
+    return Response(status_code=499)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return FastJSONResponse(
+        status_code=503,
+        content={
+            "error": exc.reason,
+            "message": "Gateway is at capacity. Please retry shortly.",
+            "traffic_class": exc.traffic_class,
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # ============================================================================
 # Main
 # ============================================================================
 
 if __name__ == "__main__":
     port = int(os.getenv("AI_GATEWAY_PORT", "8090"))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    workers = int(os.getenv("AI_GATEWAY_WORKERS") or (config.get("server", {}) or {}).get("workers", 1))
+    if workers > 1:
+        if not shared_state.shared:
+            logger.warning(f"Running {workers} workers with shared_state.backend=memory: "
+                           "rate limits, usage windows and the cache will be per worker")
+        prepare_multiprocess()
+        # Hand over to the uvicorn CLI: spawned workers would otherwise re-run this
+        # module as __mp_main__ and then import it again as "gateway:app"
+        os.execvp(sys.executable, [
+            sys.executable, "-m", "uvicorn", "gateway:app", "--host", "0.0.0.0",
+            "--port", str(port), "--workers", str(workers), "--log-level", "info",
+        ])
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Serialization and compression benchmark for gateway responses.
+
+Builds Anthropic-style completion bodies of several sizes, using source
+files from this directory as the completion text (code is what workspace
+extensions mostly receive), and reports for each size:
+
+  - serialization time: FastAPI's default path (jsonable_encoder + json)
+    against encoding.dumps (orjson when installed)
+  - bytes on the wire and compression time for each coding the gateway
+    offers at the configured levels (gzip; brotli when installed)
+
+Runs offline; no gateway or upstream is needed.
+
+Examples:
+  python loadtest/bench_encoding.py
+  python loadtest/bench_encoding.py --sizes 2,16,64 --iterations 500 --json bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+from typing import Dict, Any, List, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from encoding import ResponseCompressor, dumps, orjson  # noqa: E402
+
+
+def sample_text() -> str:
+    here = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    return "".join(open(path, encoding="utf-8").read() for path in sorted(glob.glob(os.path.join(here, "*.py"))))
+
+
+def completion(text: str, size_kb: int) -> Dict[str, Any]:
+    """A Messages API response whose text block makes the body about size_kb"""
+    chunk = text[:size_kb * 1024]
+    return {
+        "id": "msg_01XFDUDYJgAACzvnptvVoYEL",
+        "type": "message",
+        "role": "assistant",
+        "model": "claude-sonnet-4-5-20250929",
+        "content": [{"type": "text", "text": chunk}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 1250, "output_tokens": len(chunk) // 4},
+    }
+
+
+def timed(fn: Callable[[], Any], iterations: int) -> float:
+    """Mean microseconds per call"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def stdlib_default(content: Dict[str, Any]) -> bytes:
+    # What FastAPI does for a returned dict with the stock JSONResponse
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def run(sizes: List[int], iterations: int, compressor: ResponseCompressor) -> List[Dict[str, Any]]:
+    text = sample_text()
+    rows = []
+    for size_kb in sizes:
+        content = completion(text, size_kb)
+        body = dumps(content)
+        row = {
+            "size_kb": size_kb,
+            "bytes": len(body),
+            "stdlib_us": timed(lambda: stdlib_default(content), iterations),
+            "fast_us": timed(lambda: dumps(content), iterations),
+        }
+        for coding in compressor.offered:
+            compressed = compressor.compress(body, coding)
+            row[f"{coding}_bytes"] = len(compressed)
+            row[f"{coding}_us"] = timed(lambda: compressor.compress(body, coding), max(1, iterations // 10))
+        rows.append(row)
+    return rows
+
+
+def report(rows: List[Dict[str, Any]], compressor: ResponseCompressor):
+    encoder = "orjson" if orjson is not None else "json (orjson not installed)"
+    print(f"serializer: {encoder}; gzip level {compressor.gzip_level}"
+          + (f", brotli quality {compressor.brotli_quality}" if "br" in compressor.offered else ", brotli not installed"))
+    header = f"{'body':>9} {'stdlib us':>10} {'fast us':>9} {'speedup':>8}"
+    for coding in compressor.offered:
+        header += f" {coding + ' bytes':>11} {'saved':>6} {coding + ' us':>9}"
+    print(header)
+    for row in rows:
+        line = (f"{row['bytes']:>9} {row['stdlib_us']:>10.1f} {row['fast_us']:>9.1f}"
+                f" {row['stdlib_us'] / row['fast_us']:>7.1f}x")
+        for coding in compressor.offered:
+            saved = 1 - row[f"{coding}_bytes"] / row["bytes"]
+            line += f" {row[f'{coding}_bytes']:>11} {saved:>6.0%} {row[f'{coding}_us']:>9.1f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway response serialization / compression benchmark")
+    parser.add_argument("--sizes", default="1,4,16,64,128", help="Completion body sizes in KB")
+    parser.add_argument("--iterations", type=int, default=2000, help="Serializations per size")
+    parser.add_argument("--gzip-level", type=int, default=6)
+    parser.add_argument("--brotli-quality", type=int, default=4)
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    compressor = ResponseCompressor(gzip_level=args.gzip_level, brotli_quality=args.brotli_quality)
+    rows = run([int(s) for s in args.sizes.split(",")], args.iterations, compressor)
+    report(rows, compressor)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Load generator for the AI Gateway.
+
+Replays a weighted mix of request scenarios against a running gateway and
+reports throughput, latency percentiles (p50/p95/p99), time to first
+byte for streams, status codes and the gateway's own overhead per
+request. Overhead is total latency minus the upstream time the gateway
+reports in its Server-Timing header, so it is only available for
+responses that made their own upstream call (not cache hits, coalesced
+followers or streams).
+
+Scenarios:
+  chat         POST /v1/chat/completions, Anthropic model
+  cached       same, temperature 0 drawn from a small prompt pool (cache / coalescing hits)
+  stream       same, stream: true
+  bedrock      POST /v1/chat/completions with a Bedrock model ID
+  passthrough  POST /v1/claude/v1/messages
+  invoke       POST /v1/bedrock/invoke
+
+Examples:
+  python loadgen.py --duration 60 --concurrency 32
+  python loadgen.py --requests 500 --mix chat=6,stream=2,cached=2 --json report.json
+  python loadgen.py --rate 50 --duration 30 --max-error-rate 0.01
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from typing import Optional, Dict, Any, List, Tuple
+
+import httpx
+
+DEFAULT_MIX = "chat=50,stream=20,cached=10,bedrock=10,passthrough=5,invoke=5"
+ANTHROPIC_MODEL = "claude-sonnet-4-5-20250929"
+BEDROCK_MODEL = "us.anthropic.claude-sonnet-4-5-20250929-v1:0"
+
+WORDS = ("gateway", "token", "latency", "python", "request", "stream", "model", "context",
+         "workspace", "deploy", "function", "refactor", "test", "review", "cache", "queue")
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def server_timing_upstream(header: Optional[str]) -> Optional[float]:
+    """Seconds from 'upstream;dur=<ms>'"""
+    for metric in (header or "").split(","):
+        name, _, params = metric.strip().partition(";")
+        if name == "upstream" and params.startswith("dur="):
+            return float(params[4:]) / 1000.0
+    return None
+
+
+# ============================================================================
+# Traffic shapes
+# ============================================================================
+
+class Traffic:
+    """Realistic-ish prompts: mostly short turns, some long multi-turn contexts"""
+
+    def __init__(self, rng: random.Random, prompt_pool: int = 20):
+        self.rng = rng
+        self.pool = [self._text(rng.randint(20, 200)) for _ in range(prompt_pool)]
+
+    def _text(self, words: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+    def messages(self) -> List[Dict[str, Any]]:
+        turns = self.rng.choices((1, 3, 7), weights=(70, 20, 10))[0]
+        size = self.rng.choices((40, 400, 4000), weights=(60, 30, 10))[0]
+        messages = []
+        for i in range(turns):
+            role = "user" if i % 2 == 0 else "assistant"
+            messages.append({"role": role, "content": self._text(self.rng.randint(size // 2, size))})
+        return messages
+
+    def pooled(self) -> List[Dict[str, Any]]:
+        return [{"role": "user", "content": self.rng.choice(self.pool)}]
+
+    def max_tokens(self) -> int:
+        return self.rng.choice((128, 256, 512, 1024))
+
+
+def chat_request(traffic: Traffic, scenario: str) -> Tuple[str, Dict[str, Any]]:
+    body = {"model": ANTHROPIC_MODEL, "messages": traffic.messages(), "max_tokens": traffic.max_tokens()}
+    if scenario == "cached":
+        body.update(messages=traffic.pooled(), temperature=0, max_tokens=256)
+    elif scenario == "stream":
+        body["stream"] = True
+    elif scenario == "bedrock":
+        body["model"] = BEDROCK_MODEL
+    return "/v1/chat/completions", body
+
+
+def passthrough_request(traffic: Traffic, scenario: str) -> Tuple[str, Dict[str, Any]]:
+    return "/v1/claude/v1/messages", {
+        "model": ANTHROPIC_MODEL, "messages": traffic.messages(), "max_tokens": traffic.max_tokens()
+    }
+
+
+def invoke_request(traffic: Traffic, scenario: str) -> Tuple[str, Dict[str, Any]]:
+    return "/v1/bedrock/invoke", {
+        "model_id": BEDROCK_MODEL,
+        "body": {
+            "anthropic_version": "bedrock-2023-05-31",
+            "messages": traffic.messages(),
+            "max_tokens": traffic.max_tokens(),
+        },
+    }
+
+
+SCENARIOS = {
+    "chat": chat_request,
+    "cached": chat_request,
+    "stream": chat_request,
+    "bedrock": chat_request,
+    "passthrough": passthrough_request,
+    "invoke": invoke_request,
+}
+
+
+# ============================================================================
+# Runner
+# ============================================================================
+
+class Results:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.ttfb: Dict[str, List[float]] = defaultdict(list)
+        self.overhead: Dict[str, List[float]] = defaultdict(list)
+        self.status: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, scenario: str, status: str, latency: float,
+               ttfb: Optional[float] = None, upstream: Optional[float] = None):
+        self.status[scenario][status] += 1
+        self.latency[scenario].append(latency)
+        if ttfb is not None:
+            self.ttfb[scenario].append(ttfb)
+        if upstream is not None:
+            self.overhead[scenario].append(max(0.0, latency - upstream))
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        def dist(values: List[float]) -> Optional[Dict[str, float]]:
+            if not values:
+                return None
+            return {f"p{int(q * 100)}_ms": round(percentile(values, q) * 1000, 1) for q in (0.5, 0.95, 0.99)}
+
+        scenarios = {}
+        for name in sorted(self.status):
+            total = sum(self.status[name].values())
+            ok = sum(n for s, n in self.status[name].items() if s.startswith("2"))
+            scenarios[name] = {
+                "requests": total,
+                "errors": total - ok,
+                "status": dict(self.status[name]),
+                "latency": dist(self.latency[name]),
+                "ttfb": dist(self.ttfb[name]),
+                "overhead": dist(self.overhead[name]),
+            }
+        total = sum(s["requests"] for s in scenarios.values())
+        errors = sum(s["errors"] for s in scenarios.values())
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "latency": dist([v for values in self.latency.values() for v in values]),
+            "overhead": dist([v for values in self.overhead.values() for v in values]),
+            "scenarios": scenarios,
+        }
+
+
+async def run_one(client: httpx.AsyncClient, scenario: str, traffic: Traffic,
+                  headers: Dict[str, str], results: Results):
+    path, body = SCENARIOS[scenario](traffic, scenario)
+    start = time.perf_counter()
+    try:
+        if body.get("stream"):
+            async with client.stream("POST", path, json=body, headers=headers) as response:
+                ttfb = None
+                async for _ in response.aiter_raw():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - start
+                results.record(scenario, str(response.status_code), time.perf_counter() - start, ttfb=ttfb)
+            return
+        response = await client.post(path, json=body, headers=headers)
+        results.record(
+            scenario, str(response.status_code), time.perf_counter() - start,
+            upstream=server_timing_upstream(response.headers.get("server-timing"))
+        )
+    except httpx.TimeoutException:
+        results.record(scenario, "timeout", time.perf_counter() - start)
+    except httpx.TransportError as e:
+        results.record(scenario, type(e).__name__, time.perf_counter() - start)
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    traffic = Traffic(rng)
+    mix = parse_mix(args.mix)
+    names, weights = [m[0] for m in mix], [m[1] for m in mix]
+    results = Results()
+
+    base_headers = {"X-API-Key": args.api_key} if args.api_key else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    deadline = time.monotonic() + args.duration if args.duration else None
+    remaining = [args.requests] if args.requests else None
+    interval = 1.0 / args.rate if args.rate else 0.0
+    next_slot = [time.monotonic()]
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            if deadline and time.monotonic() >= deadline:
+                return
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            if interval:
+                # Open-loop pacing shared by all workers
+                slot, next_slot[0] = next_slot[0], max(next_slot[0], time.monotonic()) + interval
+                await asyncio.sleep(max(0.0, slot - time.monotonic()))
+            scenario = rng.choices(names, weights)[0]
+            headers = {**base_headers, "X-Workspace-ID": f"loadtest-{rng.randrange(args.workspaces)}"}
+            await run_one(client, scenario, traffic, headers, results)
+
+    async with httpx.AsyncClient(base_url=args.gateway_url, timeout=args.timeout, limits=limits) as client:
+        if args.warmup:
+            await asyncio.gather(*(run_one(client, "chat", traffic, base_headers, Results()) for _ in range(args.warmup)))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        return results.summary(time.perf_counter() - start)
+
+
+def print_report(summary: Dict[str, Any]):
+    def fmt(dist: Optional[Dict[str, float]]) -> str:
+        if not dist:
+            return "-"
+        return "/".join(f"{v:.0f}" for v in dist.values())
+
+    print(f"\n{summary['requests']} requests in {summary['elapsed_seconds']}s "
+          f"= {summary['throughput_rps']} req/s, error rate {summary['error_rate']:.2%}")
+    print(f"latency p50/p95/p99 ms: {fmt(summary['latency'])}   "
+          f"gateway overhead p50/p95/p99 ms: {fmt(summary['overhead'])}\n")
+    print(f"{'scenario':<12} {'reqs':>6} {'errors':>6}  {'latency p50/95/99':>20}  "
+          f"{'ttfb p50/95/99':>16}  {'overhead p50/95/99':>20}  status")
+    for name, s in summary["scenarios"].items():
+        print(f"{name:<12} {s['requests']:>6} {s['errors']:>6}  {fmt(s['latency']):>20}  "
+              f"{fmt(s['ttfb']):>16}  {fmt(s['overhead']):>20}  {s['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gateway-url", default="http://127.0.0.1:8090")
+    parser.add_argument("--api-key", default=None, help="Sent as X-API-Key when gateway auth is enabled")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted scenarios, e.g. chat=6,stream=2")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=None, help="Total requests to send")
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop target req/s (default: closed loop)")
+    parser.add_argument("--workspaces", type=int, default=20, help="Distinct X-Workspace-ID values")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before the run")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", default=None, help="Write the report as JSON to this path")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="Exit 1 if the error rate is higher")
+    args = parser.parse_args()
+    if not args.duration and not args.requests:
+        args.duration = 30.0
+
+    summary = asyncio.run(run(args))
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        print(f"\nError rate {summary['error_rate']:.2%} exceeds {args.max_error_rate:.2%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
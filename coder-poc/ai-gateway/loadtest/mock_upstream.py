@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Mock Anthropic / Bedrock upstream for offline load testing.
+
+Emulates:
+  POST /v1/messages                  Anthropic Messages API (JSON or SSE stream)
+  /v1/messages/batches[/{id}[/results|/cancel]]
+                                     Anthropic Message Batches (end after one latency draw)
+  POST /model/{model_id}/invoke      Bedrock InvokeModel (boto3 with endpoint_url)
+
+Latency is drawn from a log-normal distribution around --latency-ms (the
+median); streams emit their first event after --ttfb-ms and spread the
+remaining time over the content deltas. A fraction of requests fail with
+429 / 529 / 500 according to --error-rate. Output token counts are drawn
+around --tokens-out, and input tokens are estimated from the request size.
+
+Point the gateway at it with:
+  ANTHROPIC_BASE_URL=http://127.0.0.1:9100
+  BEDROCK_ENDPOINT_URL=http://127.0.0.1:9100
+  AWS_ACCESS_KEY_ID=mock AWS_SECRET_ACCESS_KEY=mock
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+
+
+class MockProfile:
+    """Latency, error and token distributions"""
+
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        latency_sigma: float = 0.5,
+        ttfb_ms: float = 300.0,
+        error_rate: float = 0.0,
+        tokens_out: int = 200,
+        seed: Optional[int] = None
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.ttfb_ms = ttfb_ms
+        self.error_rate = error_rate
+        self.tokens_out = tokens_out
+        self.random = random.Random(seed)
+
+    def latency(self) -> float:
+        """Seconds for a full (non-streamed) response"""
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.latency_ms / 1000.0), self.latency_sigma)
+
+    def ttfb(self) -> float:
+        if self.ttfb_ms <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.ttfb_ms / 1000.0), self.latency_sigma)
+
+    def output_tokens(self, max_tokens: int) -> int:
+        return max(1, min(max_tokens or self.tokens_out, int(self.random.gauss(self.tokens_out, self.tokens_out / 4))))
+
+    def error(self):
+        """(status, error type) for a failed request, or None"""
+        if self.error_rate <= 0 or self.random.random() >= self.error_rate:
+            return None
+        return self.random.choice([(429, "rate_limit_error"), (529, "overloaded_error"), (500, "api_error")])
+
+
+def input_tokens(payload: dict) -> int:
+    return max(1, len(json.dumps(payload.get("messages", []))) // 4 + len(str(payload.get("system", ""))) // 4)
+
+
+def message_body(model: str, tokens_in: int, tokens_out: int) -> dict:
+    return {
+        "id": f"msg_mock_{uuid.uuid4().hex[:16]}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": "lorem " * tokens_out}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": tokens_in, "output_tokens": tokens_out},
+    }
+
+
+def error_body(error_type: str) -> dict:
+    return {"type": "error", "error": {"type": error_type, "message": "mock upstream error"}}
+
+
+def sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def create_app(profile: MockProfile) -> FastAPI:
+    app = FastAPI(title="Mock LLM upstream")
+    app.state.requests = 0
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "requests": app.state.requests}
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        app.state.requests += 1
+        payload = await request.json()
+        model = payload.get("model", "claude-mock")
+        failure = profile.error()
+        if failure:
+            await asyncio.sleep(profile.ttfb())
+            return JSONResponse(error_body(failure[1]), status_code=failure[0])
+
+        tokens_in = input_tokens(payload)
+        tokens_out = profile.output_tokens(payload.get("max_tokens"))
+        if payload.get("stream"):
+            return StreamingResponse(stream_message(model, tokens_in, tokens_out), media_type="text/event-stream")
+
+        await asyncio.sleep(profile.latency())
+        return message_body(model, tokens_in, tokens_out)
+
+    async def stream_message(model: str, tokens_in: int, tokens_out: int):
+        await asyncio.sleep(profile.ttfb())
+        start = message_body(model, tokens_in, 1)
+        start["content"] = []
+        yield sse("message_start", {"type": "message_start", "message": start})
+        yield sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                          "content_block": {"type": "text", "text": ""}})
+        deltas = max(1, tokens_out // 10)
+        pause = max(0.0, profile.latency() - profile.ttfb_ms / 1000.0) / deltas
+        for _ in range(deltas):
+            await asyncio.sleep(pause)
+            yield sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                              "delta": {"type": "text_delta", "text": "lorem " * 10}})
+        yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                    "usage": {"output_tokens": tokens_out}})
+        yield sse("message_stop", {"type": "message_stop"})
+
+    batches = {}
+
+    def batch_view(batch_id: str) -> dict:
+        batch = batches.get(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail="batch not found")
+        if batch["status"] == "in_progress" and time.time() >= batch["ends_at"]:
+            batch["status"] = "ended"
+        done = batch["status"] == "ended"
+        total = len(batch["requests"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": batch["status"],
+            "request_counts": {"processing": 0 if done else total, "succeeded": total if done else 0,
+                               "errored": 0, "canceled": 0, "expired": 0},
+            "results_url": f"{batch['base_url']}v1/messages/batches/{batch_id}/results" if done else None,
+        }
+
+    @app.post("/v1/messages/batches")
+    async def create_batch(request: Request):
+        payload = await request.json()
+        batch_id = f"msgbatch_mock_{uuid.uuid4().hex[:16]}"
+        batches[batch_id] = {"requests": payload.get("requests", []), "status": "in_progress",
+                             "ends_at": time.time() + profile.latency(), "base_url": str(request.base_url)}
+        app.state.requests += 1
+        return batch_view(batch_id)
+
+    @app.get("/v1/messages/batches/{batch_id}")
+    async def get_batch(batch_id: str):
+        return batch_view(batch_id)
+
+    @app.post("/v1/messages/batches/{batch_id}/cancel")
+    async def cancel_batch(batch_id: str):
+        batch_view(batch_id)
+        batches[batch_id]["status"] = "ended"
+        return batch_view(batch_id)
+
+    @app.get("/v1/messages/batches/{batch_id}/results")
+    async def batch_results(batch_id: str):
+        if batch_view(batch_id)["processing_status"] != "ended":
+            raise HTTPException(status_code=409, detail="batch has not ended")
+        lines = []
+        for item in batches[batch_id]["requests"]:
+            params = item.get("params", {})
+            message = message_body(params.get("model", "claude-mock"), input_tokens(params),
+                                   profile.output_tokens(params.get("max_tokens")))
+            lines.append(json.dumps({"custom_id": item.get("custom_id"),
+                                     "result": {"type": "succeeded", "message": message}}))
+        return Response("\n".join(lines) + "\n", media_type="application/x-jsonl")
+
+    @app.post("/model/{model_id:path}/invoke")
+    async def bedrock_invoke(model_id: str, request: Request):
+        app.state.requests += 1
+        payload = json.loads(await request.body() or b"{}")
+        failure = profile.error()
+        if failure:
+            await asyncio.sleep(profile.ttfb())
+            # Bedrock error shapes: boto3 maps these to ThrottlingException / ServiceUnavailableException
+            code = {429: "ThrottlingException", 529: "ServiceUnavailableException"}.get(failure[0], "InternalServerException")
+            status = 503 if failure[0] == 529 else failure[0]
+            return JSONResponse({"message": "mock upstream error"}, status_code=status,
+                                headers={"x-amzn-ErrorType": code})
+
+        tokens_in = input_tokens(payload)
+        tokens_out = profile.output_tokens(payload.get("max_tokens"))
+        await asyncio.sleep(profile.latency())
+        return JSONResponse(
+            message_body(model_id, tokens_in, tokens_out),
+            headers={
+                "X-Amzn-Bedrock-Input-Token-Count": str(tokens_in),
+                "X-Amzn-Bedrock-Output-Token-Count": str(tokens_out),
+            },
+        )
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MOCK_UPSTREAM_PORT", "9100")))
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Median full-response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread (0 = fixed)")
+    parser.add_argument("--ttfb-ms", type=float, default=300.0, help="Median time to first streamed event")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--tokens-out", type=int, default=200, help="Mean output tokens")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    profile = MockProfile(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        ttfb_ms=args.ttfb_ms,
+        error_rate=args.error_rate,
+        tokens_out=args.tokens_out,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(profile), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env bash
+# Offline load test: mock upstream + gateway + load generator on localhost.
+#
+# Usage: loadtest/run_local.sh [loadgen.py args...]
+#   MOCK_ARGS     mock_upstream.py options (default: --latency-ms 200 --ttfb-ms 50)
+#   MOCK_PORT     mock upstream port (default 9100)
+#   GATEWAY_PORT  gateway port (default 8095)
+#
+# The gateway runs with config.yaml minus rate limits, database, usage
+# snapshots and model discovery, so results reflect the proxy path.
+set -euo pipefail
+
+HERE="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+GATEWAY_DIR="$(dirname "$HERE")"
+MOCK_PORT="${MOCK_PORT:-9100}"
+GATEWAY_PORT="${GATEWAY_PORT:-8095}"
+MOCK_ARGS="${MOCK_ARGS:---latency-ms 200 --ttfb-ms 50}"
+WORKDIR="$(mktemp -d)"
+PIDS=()
+
+cleanup() {
+    for pid in "${PIDS[@]}"; do kill "$pid" 2>/dev/null || true; done
+    rm -rf "$WORKDIR"
+}
+trap cleanup EXIT
+
+wait_healthy() {
+    for _ in $(seq 1 50); do
+        curl -sf "$1/health" >/dev/null && return 0
+        sleep 0.2
+    done
+    echo "Timed out waiting for $1" >&2
+    exit 1
+}
+
+python - "$GATEWAY_DIR/config.yaml" "$WORKDIR/config.yaml" <<'PY'
+import sys, yaml
+with open(sys.argv[1]) as f:
+    config = yaml.safe_load(f)
+config.setdefault("rate_limits", {})["enabled"] = False
+config.setdefault("database", {})["enabled"] = False
+config.setdefault("usage", {})["snapshot_path"] = ""
+config.setdefault("catalog", {})["discover"] = False
+config.setdefault("audit", {})["log_file"] = sys.argv[2].rsplit("/", 1)[0] + "/audit.log"
+with open(sys.argv[2], "w") as f:
+    yaml.safe_dump(config, f)
+PY
+
+# shellcheck disable=SC2086
+python "$HERE/mock_upstream.py" --port "$MOCK_PORT" $MOCK_ARGS &
+PIDS+=($!)
+wait_healthy "http://127.0.0.1:$MOCK_PORT"
+
+(
+    cd "$GATEWAY_DIR"
+    CONFIG_PATH="$WORKDIR/config.yaml" \
+    AI_GATEWAY_PORT="$GATEWAY_PORT" \
+    AI_GATEWAY_AUTH_ENABLED=false \
+    ANTHROPIC_API_KEY=mock \
+    ANTHROPIC_BASE_URL="http://127.0.0.1:$MOCK_PORT" \
+    BEDROCK_ENDPOINT_URL="http://127.0.0.1:$MOCK_PORT" \
+    AWS_ACCESS_KEY_ID=mock \
+    AWS_SECRET_ACCESS_KEY=mock \
+    AWS_REGION=us-east-1 \
+    exec python gateway.py >"$WORKDIR/gateway.log" 2>&1
+) &
+PIDS+=($!)
+wait_healthy "http://127.0.0.1:$GATEWAY_PORT"
+
+python "$HERE/loadgen.py" --gateway-url "http://127.0.0.1:$GATEWAY_PORT" "$@"
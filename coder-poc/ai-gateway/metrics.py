@@ -0,0 +1,267 @@
+"""
+Prometheus metrics for the AI Gateway (config: metrics).
+
+Histograms of upstream latency, time-to-first-byte (streamed responses)
+and total request latency by provider and model, plus counters for
+tokens, upstream errors, HTTP status codes and rate-limit rejections.
+
+The hot path stays cheap: labelled children are resolved once and cached
+in a plain dict, so each observation is a dict lookup plus an uncontended
+lock inside prometheus_client. Counters that other components already
+keep (cache, coalescing, DB writer queue) are read only at scrape time.
+
+With several workers, prepare_multiprocess() is called before they start
+and prometheus_client aggregates histograms and counters across workers
+through PROMETHEUS_MULTIPROC_DIR. Component stats are process-local and
+describe whichever worker served the scrape.
+"""
+
+import os
+import time
+import logging
+import tempfile
+from typing import Optional, Dict, Any, Callable, Iterable, Tuple
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    CONTENT_TYPE_LATEST, generate_latest,
+)
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# LLM calls range from sub-second cache hits to multi-minute completions
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, float("inf"))
+OTHER = "other"
+
+
+def prepare_multiprocess() -> str:
+    """Point prometheus_client at an empty multiprocess directory; call before workers start"""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="ai-gateway-metrics-")
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+class StatsCollector:
+    """Exposes component stats dicts (read at scrape time) as Prometheus metrics"""
+
+    def __init__(self):
+        self._sources = []
+
+    def add(self, name: str, documentation: str, label: str, read: Callable[[], Dict[str, float]], kind: str = "counter"):
+        self._sources.append((name, documentation, label, read, kind))
+
+    def collect(self) -> Iterable:
+        for name, documentation, label, read, kind in self._sources:
+            family_cls = CounterMetricFamily if kind == "counter" else GaugeMetricFamily
+            family = family_cls(name, documentation, labels=[label])
+            try:
+                for key, value in read().items():
+                    family.add_metric([key], value)
+            except Exception as e:
+                logger.warning(f"Metrics source {name} failed: {e}")
+                continue
+            yield family
+
+
+class GatewayMetrics:
+    """Metric definitions plus cheap recording helpers"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        histograms: bool = True,
+        path: str = "/metrics",
+        known_models: Optional[Iterable[str]] = None,
+        registry: CollectorRegistry = REGISTRY
+    ):
+        self.enabled = enabled
+        self.histograms = enabled and histograms
+        self.path = path
+        self.registry = registry
+        self.multiprocess = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+        self._queue_depth = None
+        # Model names come from clients; unknown ones collapse into "other"
+        self.known_models = set(known_models or ())
+        self._children: Dict[Tuple, Any] = {}
+        self.stats = StatsCollector()
+
+        self.upstream_latency = Histogram(
+            "ai_gateway_upstream_latency_seconds", "Upstream provider call latency",
+            ["provider", "model"], buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.time_to_first_byte = Histogram(
+            "ai_gateway_time_to_first_byte_seconds", "Time to first upstream byte of streamed responses",
+            ["provider", "model"], buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.request_latency = Histogram(
+            "ai_gateway_request_latency_seconds", "Total gateway request latency, including streamed bodies",
+            ["provider", "model"], buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.tokens = Counter(
+            "ai_gateway_tokens_total", "Tokens processed",
+            ["provider", "model", "direction"], registry=registry
+        )
+        self.upstream_requests = Counter(
+            "ai_gateway_upstream_requests_total", "Requests by provider, model and upstream status",
+            ["provider", "model", "status"], registry=registry
+        )
+        self.errors = Counter(
+            "ai_gateway_errors_total", "Upstream errors by provider and kind",
+            ["provider", "kind"], registry=registry
+        )
+        self.responses = Counter(
+            "ai_gateway_http_responses_total", "Gateway HTTP responses by route and status code",
+            ["route", "status"], registry=registry
+        )
+        self.rate_limited = Counter(
+            "ai_gateway_rate_limited_total", "Requests rejected by the rate limiter",
+            ["scope"], registry=registry
+        )
+        self.admission_wait = Histogram(
+            "ai_gateway_admission_wait_seconds", "Time queued for an upstream slot by traffic class",
+            ["traffic_class"], buckets=LATENCY_BUCKETS, registry=registry
+        )
+        self.db_queue_depth = Gauge(
+            "ai_gateway_db_write_queue_depth", "Usage records waiting to be written to the database",
+            registry=registry, multiprocess_mode="livesum"
+        )
+        registry.register(self.stats)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "GatewayMetrics":
+        metrics_config = config.get("metrics", {}) or {}
+        known_models = [
+            model
+            for provider in (config.get("providers", {}) or {}).values()
+            for model in (provider or {}).get("models", [])
+        ]
+        return cls(
+            enabled=metrics_config.get("enabled", True),
+            histograms=metrics_config.get("include_latency_histograms", True),
+            path=metrics_config.get("path", "/metrics"),
+            known_models=known_models,
+        )
+
+    def track_queue_depth(self, read: Callable[[], int]):
+        """Report the DB write queue depth (read at scrape time)"""
+        if self.multiprocess:
+            # Function gauges are not supported across processes; set on scrape instead
+            self._queue_depth = read
+        else:
+            self.db_queue_depth.set_function(read)
+
+    def _child(self, metric, *labels):
+        key = (id(metric), labels)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = metric.labels(*labels)
+        return child
+
+    def _model(self, model: Optional[str]) -> str:
+        return model if model in self.known_models else OTHER
+
+    # -------------------------------------------------------------------------
+    # Recording
+    # -------------------------------------------------------------------------
+
+    def record_upstream(
+        self,
+        provider: str,
+        model: str,
+        status: int,
+        latency_seconds: Optional[float],
+        tokens_in: int,
+        tokens_out: int
+    ):
+        if not self.enabled:
+            return
+        model = self._model(model)
+        self._child(self.upstream_requests, provider, model, str(status)).inc()
+        if tokens_in:
+            self._child(self.tokens, provider, model, "in").inc(tokens_in)
+        if tokens_out:
+            self._child(self.tokens, provider, model, "out").inc(tokens_out)
+        if status >= 500:
+            self._child(self.errors, provider, f"http_{status // 100}xx").inc()
+        if self.histograms and latency_seconds is not None:
+            self._child(self.upstream_latency, provider, model).observe(latency_seconds)
+
+    def observe_ttfb(self, provider: str, model: str, seconds: float):
+        if self.histograms:
+            self._child(self.time_to_first_byte, provider, self._model(model)).observe(seconds)
+
+    def observe_request(self, provider: str, model: str, seconds: float):
+        if self.histograms:
+            self._child(self.request_latency, provider, self._model(model)).observe(seconds)
+
+    def observe_queue_wait(self, traffic_class: str, seconds: float):
+        if self.histograms:
+            self._child(self.admission_wait, traffic_class).observe(seconds)
+
+    def record_error(self, provider: str, kind: str):
+        if self.enabled:
+            self._child(self.errors, provider, kind).inc()
+
+    def record_response(self, route: str, status: int):
+        if self.enabled:
+            self._child(self.responses, route, str(status)).inc()
+
+    def record_rate_limited(self, scope: str):
+        if self.enabled:
+            self._child(self.rate_limited, scope).inc()
+
+    def render(self) -> Tuple[bytes, str]:
+        if not self.multiprocess:
+            return generate_latest(self.registry), CONTENT_TYPE_LATEST
+        if self._queue_depth is not None:
+            self.db_queue_depth.set(self._queue_depth())
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(self.stats)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    def shutdown(self):
+        """Drop this worker's live gauges from the multiprocess aggregate"""
+        if self.multiprocess:
+            multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing each request until its last body chunk is sent,
+    so streamed responses are measured end to end. Handlers label requests
+    by setting request.state.metrics_labels = (provider, model).
+    """
+
+    def __init__(self, app, metrics: GatewayMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            self.metrics.record_response(getattr(route, "path", "unmatched"), status)
+            labels = scope.get("state", {}).get("metrics_labels")
+            if labels:
+                self.metrics.observe_request(labels[0], labels[1], time.perf_counter() - start)
@@ -0,0 +1,293 @@
+"""
+Token-bucket rate limiting driven by the rate_limits section of config.yaml.
+
+Every request is charged against four buckets: global RPM/TPM and the
+caller's RPM/TPM (default limits, or a per-user override). TPM is charged
+up front with an estimate and reconciled with actual usage afterwards.
+Limits are compiled into an immutable LimitTable that a config reload
+replaces in one assignment.
+
+Buckets live in process memory, in Redis when a URL is configured, or in
+the shared_state backend (see shared_state.py) so that limits hold across
+gateway workers and replicas. If the shared store is unreachable the
+limiter degrades to the in-process buckets rather than failing requests.
+"""
+
+import os
+import math
+import time
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis backend is optional
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "aigw:rl:"
+GLOBAL_IDENTITY = "__global__"
+
+# (bucket key, per-minute limit, cost)
+BucketSpec = Tuple[str, int, float]
+
+
+class RateLimited(Exception):
+    """Raised when a request exceeds one of its buckets"""
+
+    def __init__(self, retry_after: float, headers: Dict[str, str], scope: str):
+        super().__init__(f"rate limit exceeded ({scope})")
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.headers = {**headers, "Retry-After": str(self.retry_after)}
+        self.scope = scope
+
+
+class LimitTable:
+    """Compiled limits: per-user overrides pre-merged over the defaults"""
+
+    __slots__ = ("enabled", "global_limits", "default_limits", "user_limits")
+
+    def __init__(self, global_limits: Dict[str, int], default_limits: Dict[str, int],
+                 user_limits: Dict[str, Dict[str, int]], enabled: bool = True):
+        self.enabled = enabled
+        self.global_limits = dict(global_limits)
+        self.default_limits = dict(default_limits)
+        self.user_limits = {user: {**self.default_limits, **(override or {})} for user, override in user_limits.items()}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "LimitTable":
+        rate_config = config.get("rate_limits", {}) or {}
+        table = cls(
+            global_limits=rate_config.get("global", {}) or {},
+            default_limits=rate_config.get("default", {}) or {"requests_per_minute": 60, "tokens_per_minute": 100000},
+            user_limits=rate_config.get("users", {}) or {},
+            enabled=rate_config.get("enabled", True),
+        )
+        for name, limits in [("global", table.global_limits), ("default", table.default_limits)] + \
+                list(table.user_limits.items()):
+            for key, value in limits.items():
+                if not isinstance(value, int) or value < 0:
+                    raise ValueError(f"rate_limits {name}.{key} must be a non-negative integer, not {value!r}")
+        return table
+
+    def for_identity(self, identity: str) -> Dict[str, int]:
+        return self.user_limits.get(identity, self.default_limits)
+
+
+class RateLimitTicket:
+    """What a request was charged, so usage can be reconciled afterwards"""
+
+    def __init__(self, identity: str, limits: Dict[str, int], tokens_charged: int, headers: Dict[str, str]):
+        self.identity = identity
+        self.limits = limits
+        self.tokens_charged = tokens_charged
+        self.headers = headers
+
+
+class LocalBucketStore:
+    """In-process token buckets. Idle (fully refilled) buckets are swept when the table grows."""
+
+    def __init__(self, max_buckets: int = 50000):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take_all(self, specs: List[BucketSpec], force: bool = False) -> Tuple[bool, List[float], float]:
+        now = time.monotonic()
+        levels = []
+        for key, limit, _ in specs:
+            tokens, updated = self._buckets.get(key, (limit, now))
+            levels.append(min(limit, tokens + (now - updated) * limit / 60.0))
+
+        if not force:
+            retry_after = max(
+                ((cost - level) * 60.0 / limit for (_, limit, cost), level in zip(specs, levels) if level < cost),
+                default=0.0
+            )
+            if retry_after > 0:
+                return False, levels, retry_after
+
+        remaining = []
+        for (key, limit, cost), level in zip(specs, levels):
+            level = min(limit, level - cost)
+            self._buckets[key] = (level, now)
+            remaining.append(level)
+
+        if len(self._buckets) > self.max_buckets:
+            self._sweep(now)
+        return True, remaining, 0.0
+
+    def _sweep(self, now: float):
+        # A bucket untouched for a full minute has refilled and equals a fresh one
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated > 60.0]
+        for key in idle:
+            del self._buckets[key]
+
+
+# Atomically refill and charge N buckets; all-or-nothing unless forced.
+# ARGV: now, force, then (limit, cost) per key. Returns {allowed, retry_after, level...}
+_TAKE_ALL_LUA = """
+local now = tonumber(ARGV[1])
+local force = tonumber(ARGV[2])
+local levels = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[1 + i * 2])
+    local cost = tonumber(ARGV[2 + i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or limit
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(limit, tokens + math.max(0, now - ts) * limit / 60.0)
+    levels[i] = tokens
+    if tokens < cost then
+        retry_after = math.max(retry_after, (cost - tokens) * 60.0 / limit)
+    end
+end
+if force == 0 and retry_after > 0 then
+    local result = {0, tostring(retry_after)}
+    for i = 1, #levels do result[#result + 1] = tostring(levels[i]) end
+    return result
+end
+local result = {1, '0'}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[1 + i * 2])
+    local cost = tonumber(ARGV[2 + i * 2])
+    local tokens = math.min(limit, levels[i] - cost)
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', key, 120)
+    result[#result + 1] = tostring(tokens)
+end
+return result
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared across replicas through a single Lua script per request"""
+
+    def __init__(self, redis_url: str):
+        self.redis = aioredis.from_url(redis_url)
+        self._script = self.redis.register_script(_TAKE_ALL_LUA)
+
+    async def take_all(self, specs: List[BucketSpec], force: bool = False) -> Tuple[bool, List[float], float]:
+        keys = [KEY_PREFIX + key for key, _, _ in specs]
+        args: List[Any] = [time.time(), 1 if force else 0]
+        for _, limit, cost in specs:
+            args.extend([limit, cost])
+        result = await self._script(keys=keys, args=args)
+        return bool(int(result[0])), [float(level) for level in result[2:]], float(result[1])
+
+
+class RateLimiter:
+    """Per-identity and global RPM/TPM enforcement"""
+
+    def __init__(
+        self,
+        table: LimitTable,
+        redis_url: Optional[str] = None,
+        shared_store=None
+    ):
+        self.table = table
+        self.local = LocalBucketStore()
+        self.shared = None
+        self.stats = {"allowed": 0, "rejected": 0, "backend_errors": 0}
+
+        # Set up regardless of enabled, which a config reload may flip
+        if redis_url:
+            if aioredis is None:
+                logger.warning("Rate limit Redis URL set but redis package not installed, using in-process buckets")
+            else:
+                self.shared = RedisBucketStore(redis_url)
+                logger.info("Rate limiter using Redis-backed buckets")
+        elif shared_store is not None:
+            self.shared = shared_store
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], shared_store=None) -> "RateLimiter":
+        rate_config = config.get("rate_limits", {}) or {}
+        return cls(
+            LimitTable.from_config(config),
+            redis_url=rate_config.get("redis_url") or os.getenv("AI_GATEWAY_REDIS_URL"),
+            shared_store=shared_store,
+        )
+
+    def prepare_reload(self, config: Dict[str, Any]):
+        """Compile limits from a new config; the returned commit swaps them in"""
+        table = LimitTable.from_config(config)
+
+        def commit():
+            self.table = table
+        return commit
+
+    @property
+    def enabled(self) -> bool:
+        return self.table.enabled
+
+    def limits_for(self, identity: str) -> Dict[str, int]:
+        """Effective limits for an identity: per-user override merged over defaults"""
+        return self.table.for_identity(identity)
+
+    def _specs(self, identity: str, limits: Dict[str, int], requests: int, tokens: float) -> List[BucketSpec]:
+        specs = []
+        for scope, scope_limits in ((identity, limits), (GLOBAL_IDENTITY, self.table.global_limits)):
+            rpm = scope_limits.get("requests_per_minute")
+            tpm = scope_limits.get("tokens_per_minute")
+            if rpm and requests:
+                specs.append((f"{scope}:rpm", rpm, requests))
+            if tpm:
+                specs.append((f"{scope}:tpm", tpm, min(tokens, tpm)))
+        return specs
+
+    async def _take_all(self, specs: List[BucketSpec], force: bool = False) -> Tuple[bool, List[float], float]:
+        if self.shared is not None:
+            try:
+                return await self.shared.take_all(specs, force)
+            except Exception as e:
+                self.stats["backend_errors"] += 1
+                logger.warning(f"Shared rate limit store unavailable, using in-process buckets: {e}")
+        return await self.local.take_all(specs, force)
+
+    @staticmethod
+    def _headers(specs: List[BucketSpec], levels: List[float], identity: str) -> Dict[str, str]:
+        headers = {}
+        for (key, limit, _), level in zip(specs, levels):
+            scope, kind = key.rsplit(":", 1)
+            if scope != identity:
+                continue
+            name = "Requests" if kind == "rpm" else "Tokens"
+            remaining = max(0, int(level))
+            headers[f"X-RateLimit-Limit-{name}"] = str(limit)
+            headers[f"X-RateLimit-Remaining-{name}"] = str(remaining)
+            headers[f"X-RateLimit-Reset-{name}"] = f"{math.ceil((limit - remaining) * 60.0 / limit)}s"
+        return headers
+
+    async def acquire(self, identity: str, estimated_tokens: int) -> Optional[RateLimitTicket]:
+        """Charge one request and its estimated tokens, or raise RateLimited"""
+        table = self.table
+        if not table.enabled:
+            return None
+
+        limits = table.for_identity(identity)
+        specs = self._specs(identity, limits, 1, estimated_tokens)
+        allowed, levels, retry_after = await self._take_all(specs)
+        headers = self._headers(specs, levels, identity)
+
+        if not allowed:
+            self.stats["rejected"] += 1
+            exhausted = [key for (key, _, cost), level in zip(specs, levels) if level < cost]
+            scope = "global" if all(key.startswith(GLOBAL_IDENTITY) for key in exhausted) else "user"
+            raise RateLimited(retry_after, headers, scope)
+
+        self.stats["allowed"] += 1
+        charged = int(min(estimated_tokens, limits.get("tokens_per_minute") or estimated_tokens))
+        return RateLimitTicket(identity, limits, charged, headers)
+
+    async def reconcile(self, ticket: Optional[RateLimitTicket], actual_tokens: int):
+        """Charge (or refund) the difference between the estimate and actual usage"""
+        if ticket is None:
+            return
+        delta = actual_tokens - ticket.tokens_charged
+        if delta == 0:
+            return
+        ticket.tokens_charged = actual_tokens
+        specs = self._specs(ticket.identity, ticket.limits, 0, delta)
+        await self._take_all(specs, force=True)
@@ -0,0 +1,172 @@
+"""
+Exact-match response cache for the unified chat endpoint.
+
+Two tiers:
+  1. In-process LRU bounded by cache.max_size_mb (serialized bytes)
+  2. Optional shared tier: Redis (cache.redis_url) or the shared_state
+     backend, so workers and replicas see each other's entries
+
+Entries are keyed by a canonical hash of model, system prompt, messages,
+temperature and max_tokens. Only deterministic requests (temperature 0)
+are eligible unless cache.deterministic_only is disabled.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis tier is optional
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "aigw:cache:"
+
+
+def cache_key(model: str, messages: list, temperature: Optional[float], max_tokens: Optional[int],
+              system: Any = None) -> str:
+    """Canonical hash of the fields that determine a completion"""
+    fields = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    # Only present when set, so keys of requests without a system prompt are unchanged
+    if system is not None:
+        fields["system"] = system
+    canonical = json.dumps(
+        fields,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return KEY_PREFIX + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Byte-bounded LRU of serialized responses with per-entry expiry"""
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, body = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return body
+
+    def set(self, key: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: str):
+        _, body = self._entries.pop(key)
+        self.size -= len(body)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ResponseCache:
+    """Response cache with an in-process LRU tier and optional Redis tier"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        ttl: int = 3600,
+        max_size_mb: int = 100,
+        deterministic_only: bool = True,
+        redis_url: Optional[str] = None,
+        shared_store=None
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.deterministic_only = deterministic_only
+        self.local = LRUCache(max_bytes=max_size_mb * 1024 * 1024, ttl=ttl)
+        # Anything with async get(key) / set(key, value, ex=ttl)
+        self.shared = None
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+        if enabled and redis_url:
+            if aioredis is None:
+                logger.warning("cache.redis_url set but redis package not installed, using local tier only")
+            else:
+                self.shared = aioredis.from_url(redis_url)
+                logger.info("Response cache Redis tier enabled")
+        elif enabled and shared_store is not None:
+            self.shared = shared_store
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], shared_store=None) -> "ResponseCache":
+        cache_config = config.get("cache", {}) or {}
+        return cls(
+            enabled=cache_config.get("enabled", False),
+            ttl=int(cache_config.get("ttl", 3600)),
+            max_size_mb=int(cache_config.get("max_size_mb", 100)),
+            deterministic_only=cache_config.get("deterministic_only", True),
+            redis_url=cache_config.get("redis_url") or os.getenv("AI_GATEWAY_REDIS_URL"),
+            shared_store=shared_store,
+        )
+
+    def eligible(self, request) -> bool:
+        """Whether a MessageRequest may be served from / stored in the cache"""
+        if not self.enabled or request.stream:
+            return False
+        return not self.deterministic_only or request.temperature == 0
+
+    def key_for(self, request) -> str:
+        return cache_key(request.model, request.messages, request.temperature, request.max_tokens,
+                         getattr(request, "system", None))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        body = self.local.get(key)
+        if body is not None:
+            self.stats["hits"] += 1
+            return body
+
+        if self.shared is not None:
+            try:
+                body = await self.shared.get(key)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Cache shared tier get failed: {e}")
+                body = None
+            if body is not None:
+                self.local.set(key, body)
+                self.stats["shared_hits"] += 1
+                return body
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, body: bytes):
+        self.local.set(key, body)
+        self.stats["stores"] += 1
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, body, ex=self.ttl)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Cache shared tier set failed: {e}")
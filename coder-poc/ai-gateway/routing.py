@@ -0,0 +1,311 @@
+"""
+Latency-aware provider routing between Anthropic and Bedrock.
+
+Equivalent models are derived from the provider model lists in
+config.yaml (claude-sonnet-4-5-20250929 <-> us.anthropic.claude-sonnet-
+4-5-20250929-v1:0). Each provider keeps a rolling window of latencies and
+outcomes and a circuit breaker. Requests go to the preferred provider and
+fail over to the equivalent model on the other one when it errors, times
+out or its breaker is open. Optionally a hedged request is sent to the
+alternate after a p95-based delay; the first success wins and the other
+call is cancelled.
+"""
+
+import re
+import time
+import itertools
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Awaitable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("anthropic", "bedrock")
+
+# us.anthropic.claude-x-20250101-v1:0 -> claude-x-20250101
+_BEDROCK_MODEL = re.compile(r"^(?:[a-z]{2,4}\.)?anthropic\.(?P<base>claude[\w.-]*?)(?:-v\d+(?::\d+)?)?$")
+
+
+class UpstreamError(Exception):
+    """A provider call failed in a way another provider might not"""
+
+    def __init__(self, provider: str, status: int, detail: str = ""):
+        super().__init__(f"{provider} upstream error {status}: {detail[:200]}")
+        self.provider = provider
+        self.status = status
+        self.detail = detail
+
+
+def canonical_model(model: str) -> str:
+    """Provider-neutral model name"""
+    match = _BEDROCK_MODEL.match(model)
+    return match.group("base") if match else model
+
+
+def provider_for_model(model: str) -> Optional[str]:
+    """Infer the provider from a model ID"""
+    if _BEDROCK_MODEL.match(model) or model.startswith(("amazon.", "meta.", "mistral.")):
+        return "bedrock"
+    if model.startswith("claude"):
+        return "anthropic"
+    if model.startswith("gemini"):
+        return "gemini"
+    return None
+
+
+class ProviderStats:
+    """Rolling latency and error window for one provider"""
+
+    def __init__(self, window: int = 200):
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        if ok:
+            self.latencies.append(latency)
+        self.outcomes.append(ok)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+
+class CircuitBreaker:
+    """Closed -> open on consecutive failures or error rate; half-open probe after cooldown"""
+
+    def __init__(self, failure_threshold: int = 5, error_rate_threshold: float = 0.5,
+                 min_samples: int = 20, cooldown_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        # One probe per cooldown period while open / half-open
+        now = time.monotonic()
+        if now - self.opened_at >= self.cooldown_seconds:
+            self.state = "half_open"
+            self.opened_at = now
+            return True
+        return False
+
+    def record(self, ok: bool, stats: ProviderStats):
+        if ok:
+            self.consecutive_failures = 0
+            self.state = "closed"
+            return
+        self.consecutive_failures += 1
+        tripped = (
+            self.state == "half_open"
+            or self.consecutive_failures >= self.failure_threshold
+            or (len(stats.outcomes) >= self.min_samples and stats.error_rate >= self.error_rate_threshold)
+        )
+        if tripped:
+            if self.state == "closed":
+                logger.warning(f"Circuit opened after {self.consecutive_failures} failures "
+                               f"(error rate {stats.error_rate:.0%})")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class ProviderRouter:
+    """Chooses, fails over and hedges between equivalent provider models"""
+
+    def __init__(
+        self,
+        model_lists: Dict[str, List[str]],
+        available: Callable[[str], bool],
+        failover: bool = True,
+        hedging: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 2.0,
+        window: int = 200,
+        breaker_config: Optional[Dict[str, Any]] = None
+    ):
+        self.available = available
+        self.failover = failover
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.stats = {p: ProviderStats(window) for p in PROVIDERS}
+        self.breakers = {p: CircuitBreaker(**(breaker_config or {})) for p in PROVIDERS}
+        self.counters = {"failovers": 0, "hedges": 0, "hedge_wins": 0}
+
+        self.equivalents = self._equivalents(model_lists)
+
+    @staticmethod
+    def _equivalents(model_lists: Dict[str, List[str]]) -> Dict[str, Dict[str, str]]:
+        """canonical name -> {provider: model id}"""
+        equivalents: Dict[str, Dict[str, str]] = {}
+        for provider, models in model_lists.items():
+            for model in models:
+                equivalents.setdefault(canonical_model(model), {})[provider] = model
+        return equivalents
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], available: Callable[[str], bool]) -> "ProviderRouter":
+        routing_config = config.get("routing", {}) or {}
+        hedging_config = routing_config.get("hedging", {}) or {}
+        return cls(
+            model_lists=cls._model_lists(config),
+            available=available,
+            failover=routing_config.get("failover", True),
+            hedging=hedging_config.get("enabled", False),
+            hedge_percentile=float(hedging_config.get("percentile", 0.95)),
+            hedge_min_delay=hedging_config.get("min_delay_ms", 2000) / 1000.0,
+            window=int(routing_config.get("window", 200)),
+            breaker_config=routing_config.get("circuit_breaker"),
+        )
+
+    @staticmethod
+    def _model_lists(config: Dict[str, Any]) -> Dict[str, List[str]]:
+        providers = config.get("providers", {}) or {}
+        return {
+            p: (providers.get(p) or {}).get("models", [])
+            for p in PROVIDERS if (providers.get(p) or {}).get("enabled", True)
+        }
+
+    def prepare_reload(self, config: Dict[str, Any]):
+        """Rebuild model equivalents from new provider lists (breakers and stats are kept)"""
+        equivalents = self._equivalents(self._model_lists(config))
+
+        def commit():
+            self.equivalents = equivalents
+        return commit
+
+    def model_for(self, provider: str, model: str) -> Optional[str]:
+        """The equivalent of model on provider, if one is configured"""
+        if provider_for_model(model) == provider:
+            return model
+        return self.equivalents.get(canonical_model(model), {}).get(provider)
+
+    def plan(self, provider: str, model: str) -> List[Tuple[str, str]]:
+        """Ordered (provider, model) candidates; healthy providers first"""
+        candidates = []
+        for p in (provider,) + tuple(x for x in PROVIDERS if x != provider):
+            if p != provider and not self.failover:
+                break
+            mapped = self.model_for(p, model)
+            if mapped and self.available(p):
+                candidates.append((p, mapped))
+        # Providers with an open breaker go last rather than being dropped
+        return sorted(candidates, key=lambda c: self.breakers[c[0]].state == "open")
+
+    async def _attempt(self, provider: str, model: str, invoke: Callable[[str, str], Awaitable[Any]]) -> Any:
+        start = time.monotonic()
+        try:
+            result = await invoke(provider, model)
+        except UpstreamError:
+            self._record(provider, time.monotonic() - start, ok=False)
+            raise
+        self._record(provider, time.monotonic() - start, ok=True)
+        return result
+
+    def _record(self, provider: str, latency: float, ok: bool):
+        self.stats[provider].record(latency, ok)
+        self.breakers[provider].record(ok, self.stats[provider])
+
+    def hedge_delay(self, provider: str) -> float:
+        p = self.stats[provider].percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, p or 0.0)
+
+    async def call(self, provider: str, model: str, invoke: Callable[[str, str], Awaitable[Any]]) -> Any:
+        """
+        Run invoke(provider, model) against the best candidate, failing over
+        (and optionally hedging) on UpstreamError. Raises the last
+        UpstreamError if every candidate fails.
+        """
+        candidates = self.plan(provider, model)
+        if not candidates:
+            raise UpstreamError(provider, 503, f"no configured provider serves {model}")
+
+        admitted = self._admitted(candidates)
+        primary = next(admitted)
+        if primary[0] != provider:
+            self.counters["failovers"] += 1
+
+        if self.hedging and len(candidates) > 1:
+            return await self._hedged(primary, admitted, invoke)
+
+        last_error: Optional[UpstreamError] = None
+        previous = None
+        for p, m in itertools.chain([primary], admitted):
+            if previous is not None:
+                self.counters["failovers"] += 1
+                logger.warning(f"Failing over from {previous} to {p} ({last_error})")
+            previous = p
+            try:
+                return await self._attempt(p, m, invoke)
+            except UpstreamError as e:
+                last_error = e
+        raise last_error
+
+    def _admitted(self, candidates: List[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+        """
+        Candidates whose breaker lets a call through, or the first candidate if
+        none does. Lazy: allow() hands out a half-open breaker's single probe,
+        so it is only asked for the candidate about to be called.
+        """
+        admitted = False
+        for candidate in candidates:
+            if self.breakers[candidate[0]].allow():
+                admitted = True
+                yield candidate
+        if not admitted:
+            yield candidates[0]
+
+    async def _hedged(self, primary: Tuple[str, str], backups: Iterator[Tuple[str, str]],
+                      invoke: Callable[[str, str], Awaitable[Any]]) -> Any:
+        """Primary first; a backup after the hedge delay or on primary failure; first success wins"""
+        tasks = {asyncio.ensure_future(self._attempt(*primary, invoke)): primary}
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary[0]))
+        last_error: Optional[UpstreamError] = None
+
+        try:
+            while True:
+                for task in done:
+                    target = tasks.pop(task)
+                    try:
+                        result = task.result()
+                        if target is not primary:
+                            self.counters["hedge_wins"] += 1
+                        return result
+                    except UpstreamError as e:
+                        last_error = e
+
+                # Primary slow or failed: launch the next backup if any remain
+                target = next(backups, None) if last_error is not None or not done else None
+                if target is not None:
+                    self.counters["hedges"] += 1
+                    tasks[asyncio.ensure_future(self._attempt(*target, invoke))] = target
+                if not tasks:
+                    raise last_error
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def status(self) -> Dict[str, Any]:
+        """Breaker state and rolling stats per provider, for /health"""
+        return {
+            p: {
+                "circuit": self.breakers[p].state,
+                "error_rate": round(self.stats[p].error_rate, 3),
+                "p95_ms": int((self.stats[p].percentile(0.95) or 0) * 1000),
+            }
+            for p in PROVIDERS
+        }
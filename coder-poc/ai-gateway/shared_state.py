@@ -0,0 +1,282 @@
+"""
+Shared state for multi-worker deployments (config: shared_state).
+
+With more than one gateway worker, rate-limit buckets, rolling usage
+counters and the response cache must live outside process memory or each
+worker enforces and reports only its own share. Backends:
+
+  memory  Process-local (default). Correct only with a single worker.
+  redis   Shared across workers and hosts (shared_state.redis_url or
+          AI_GATEWAY_REDIS_URL).
+  sqlite  A WAL-mode SQLite file on tmpfs (/dev/shm by default) shared by
+          the workers of one host. No extra service. Calls run one at a
+          time on a dedicated thread: they usually take microseconds, but
+          under write contention one may wait out the busy timeout, and
+          that must not stall the event loop.
+
+Each backend exposes the same three facets: token buckets (take_all, as
+in rate_limiting), a TTL key/value store (response cache tier) and
+per-minute / per-hour usage counters.
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis backend is optional
+    aioredis = None
+
+from rate_limiting import RedisBucketStore, BucketSpec
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("memory", "redis", "sqlite")
+USAGE_PREFIX = "aigw:usage:"
+MINUTE_SLOTS = 60
+HOUR_SLOTS = 24
+WINDOWS = {"1m": 60, "1h": 3600, "24h": 86400}
+
+# (user, minute index, requests, tokens_in, tokens_out)
+UsageDelta = Tuple[str, int, int, int, int]
+
+
+def _empty() -> Dict[str, int]:
+    return {"requests": 0, "tokens_in": 0, "tokens_out": 0}
+
+
+# ============================================================================
+# Redis
+# ============================================================================
+
+class RedisUsageBackend:
+    """Usage counters as per-minute and per-hour hashes with expiry"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def add_many(self, deltas: List[UsageDelta]):
+        pipe = self.redis.pipeline(transaction=False)
+        for user, minute, requests, tokens_in, tokens_out in deltas:
+            for key, ttl in ((f"{USAGE_PREFIX}{user}:m:{minute}", 2 * 3600),
+                             (f"{USAGE_PREFIX}{user}:h:{minute // 60}", 25 * 3600)):
+                pipe.hincrby(key, "requests", requests)
+                pipe.hincrby(key, "tokens_in", tokens_in)
+                pipe.hincrby(key, "tokens_out", tokens_out)
+                pipe.expire(key, ttl)
+        await pipe.execute()
+
+    async def windows(self, user: str, now: float) -> Dict[str, Dict[str, int]]:
+        minute = int(now // 60)
+        keys = [f"{USAGE_PREFIX}{user}:m:{minute - i}" for i in range(MINUTE_SLOTS)]
+        keys += [f"{USAGE_PREFIX}{user}:h:{minute // 60 - i}" for i in range(HOUR_SLOTS)]
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "requests", "tokens_in", "tokens_out")
+        rows = await pipe.execute()
+
+        result = {name: _empty() for name in WINDOWS}
+        for i, row in enumerate(rows):
+            values = [int(v or 0) for v in row]
+            targets = (["1m"] if i == 0 else []) + (["1h"] if i < MINUTE_SLOTS else ["24h"])
+            for name in targets:
+                for field, value in zip(("requests", "tokens_in", "tokens_out"), values):
+                    result[name][field] += value
+        return result
+
+
+# ============================================================================
+# SQLite (single host)
+# ============================================================================
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS usage (
+    user TEXT NOT NULL, kind TEXT NOT NULL, stamp INTEGER NOT NULL,
+    requests INTEGER NOT NULL, tokens_in INTEGER NOT NULL, tokens_out INTEGER NOT NULL,
+    PRIMARY KEY (user, kind, stamp)
+);
+"""
+
+
+class SqliteStore:
+    """Buckets, key/value and usage tables in one SQLite file shared by local workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.executescript(_SCHEMA)
+        # One thread owns the connection, so transactions never interleave
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+
+    async def _call(self, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # Token buckets (same contract as rate_limiting.LocalBucketStore)
+
+    async def take_all(self, specs: List[BucketSpec], force: bool = False) -> Tuple[bool, List[float], float]:
+        return await self._call(self._take_all, specs, force)
+
+    def _take_all(self, specs: List[BucketSpec], force: bool) -> Tuple[bool, List[float], float]:
+        now = time.time()
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, limit, _ in specs:
+                row = db.execute("SELECT tokens, ts FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, ts = row if row else (limit, now)
+                levels.append(min(limit, tokens + max(0.0, now - ts) * limit / 60.0))
+
+            if not force:
+                retry_after = max(
+                    ((cost - level) * 60.0 / limit for (_, limit, cost), level in zip(specs, levels) if level < cost),
+                    default=0.0
+                )
+                if retry_after > 0:
+                    db.execute("ROLLBACK")
+                    return False, levels, retry_after
+
+            remaining = []
+            for (key, limit, cost), level in zip(specs, levels):
+                level = min(limit, level - cost)
+                db.execute("INSERT OR REPLACE INTO buckets (key, tokens, ts) VALUES (?, ?, ?)", (key, level, now))
+                remaining.append(level)
+            db.execute("COMMIT")
+            return True, remaining, 0.0
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    # Key/value with expiry (response cache tier; same call shape as redis)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        row = await self._call(
+            lambda: self.db.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone())
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    async def set(self, key: str, value: bytes, ex: int):
+        await self._call(self.db.execute, "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                         (key, value, time.time() + ex))
+
+    # Usage counters
+
+    async def add_many(self, deltas: List[UsageDelta]):
+        rows = []
+        for user, minute, requests, tokens_in, tokens_out in deltas:
+            rows.append((user, "m", minute, requests, tokens_in, tokens_out))
+            rows.append((user, "h", minute // 60, requests, tokens_in, tokens_out))
+        await self._call(
+            self.db.executemany,
+            """INSERT INTO usage (user, kind, stamp, requests, tokens_in, tokens_out) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (user, kind, stamp) DO UPDATE SET
+                   requests = requests + excluded.requests,
+                   tokens_in = tokens_in + excluded.tokens_in,
+                   tokens_out = tokens_out + excluded.tokens_out""",
+            rows
+        )
+
+    async def windows(self, user: str, now: float) -> Dict[str, Dict[str, int]]:
+        return await self._call(self._windows, user, now)
+
+    def _windows(self, user: str, now: float) -> Dict[str, Dict[str, int]]:
+        minute = int(now // 60)
+        result = {}
+        for name, kind, low, high in (("1m", "m", minute, minute),
+                                      ("1h", "m", minute - MINUTE_SLOTS + 1, minute),
+                                      ("24h", "h", minute // 60 - HOUR_SLOTS + 1, minute // 60)):
+            row = self.db.execute(
+                "SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(tokens_in), 0), COALESCE(SUM(tokens_out), 0) "
+                "FROM usage WHERE user = ? AND kind = ? AND stamp BETWEEN ? AND ?",
+                (user, kind, low, high)
+            ).fetchone()
+            result[name] = {"requests": row[0], "tokens_in": row[1], "tokens_out": row[2]}
+        return result
+
+    async def maintain(self):
+        await self._call(self.prune)
+
+    def prune(self, now: Optional[float] = None):
+        """Drop expired cache entries, idle buckets and usage older than a day"""
+        now = now or time.time()
+        minute = int(now // 60)
+        self.db.execute("DELETE FROM kv WHERE expires < ?", (now,))
+        # A bucket untouched for a minute has refilled and equals a fresh one
+        self.db.execute("DELETE FROM buckets WHERE ts < ?", (now - 60,))
+        self.db.execute("DELETE FROM usage WHERE (kind = 'm' AND stamp < ?) OR (kind = 'h' AND stamp < ?)",
+                        (minute - MINUTE_SLOTS, minute // 60 - HOUR_SLOTS))
+
+
+# ============================================================================
+# Facade
+# ============================================================================
+
+class SharedState:
+    """Selects the configured backend and hands out its facets"""
+
+    def __init__(self, backend: str = "memory", redis_url: Optional[str] = None,
+                 sqlite_path: str = "/dev/shm/ai-gateway-state.db"):
+        if backend not in BACKENDS:
+            raise ValueError(f"shared_state.backend must be one of {BACKENDS}, not {backend!r}")
+        if backend == "redis" and (aioredis is None or not redis_url):
+            logger.warning("shared_state.backend is redis but redis is not installed or no URL is set; "
+                           "falling back to process memory")
+            backend = "memory"
+        self.backend = backend
+        self.redis = aioredis.from_url(redis_url) if backend == "redis" else None
+        self.sqlite = SqliteStore(sqlite_path) if backend == "sqlite" else None
+        self.redis_url = redis_url
+        if backend != "memory":
+            logger.info(f"Shared state backend: {backend}")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SharedState":
+        shared_config = config.get("shared_state", {}) or {}
+        return cls(
+            backend=os.getenv("AI_GATEWAY_SHARED_STATE") or shared_config.get("backend", "memory"),
+            redis_url=shared_config.get("redis_url") or os.getenv("AI_GATEWAY_REDIS_URL"),
+            sqlite_path=shared_config.get("sqlite_path", "/dev/shm/ai-gateway-state.db"),
+        )
+
+    @property
+    def shared(self) -> bool:
+        """Whether state is visible to every worker"""
+        return self.backend != "memory"
+
+    def bucket_store(self):
+        """take_all() store for the rate limiter, or None for process-local buckets"""
+        if self.backend == "redis":
+            return RedisBucketStore(self.redis_url)
+        return self.sqlite
+
+    def kv_store(self):
+        """get()/set(ex=) store for the response cache tier, or None"""
+        return self.redis if self.backend == "redis" else self.sqlite
+
+    def usage_backend(self):
+        """add_many()/windows() backend for usage counters, or None"""
+        if self.backend == "redis":
+            return RedisUsageBackend(self.redis)
+        return self.sqlite
+
+    async def run_maintenance(self, interval: int = 60):
+        """Background task: prune the SQLite tables (Redis expires keys itself)"""
+        if self.sqlite is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sqlite.maintain()
+            except sqlite3.Error as e:
+                logger.warning(f"Shared state prune failed: {e}")
@@ -0,0 +1,13 @@
+"""
+Unit tests for the AI gateway modules.
+Run with: pytest coder-poc/ai-gateway/tests -q
+"""
+
+import os
+import sys
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The gateway is a flat set of modules run from its own directory
+sys.path.insert(0, GATEWAY_DIR)
+os.environ.setdefault("CONFIG_PATH", os.path.join(GATEWAY_DIR, "config.yaml"))
@@ -0,0 +1,165 @@
+"""Admission slots: caps, queueing and release on every path (admission, gateway streaming)."""
+
+import asyncio
+import gc
+import json
+
+import pytest
+
+import gateway
+from admission import AdmissionController, AdmissionRejected
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestAdmissionController:
+    def test_slot_is_released_on_exit_and_on_error(self):
+        controller = AdmissionController(max_concurrent=4, per_identity=2)
+
+        async def scenario():
+            async with controller.slot("ws-1"):
+                assert controller.in_flight == 1
+            with pytest.raises(RuntimeError):
+                async with controller.slot("ws-1"):
+                    raise RuntimeError("upstream failed")
+        run(scenario())
+        assert controller.in_flight == 0
+        assert controller.by_identity == {}
+
+    def test_per_identity_cap_queues_until_release(self):
+        controller = AdmissionController(max_concurrent=4, per_identity=1, queue_timeout=5)
+
+        async def scenario():
+            first = await controller.lease("ws-1")
+            second = asyncio.ensure_future(controller.acquire("ws-1"))
+            await asyncio.sleep(0)
+            assert not second.done() and controller.queue_depths()["interactive"] == 1
+            first.release()
+            await second
+            assert controller.by_identity == {"ws-1": 1}
+            controller.release("ws-1")
+        run(scenario())
+        assert controller.in_flight == 0
+
+    def test_queue_timeout_rejects_and_leaves_nothing_behind(self):
+        controller = AdmissionController(max_concurrent=1, per_identity=1, queue_timeout=0.01)
+
+        async def scenario():
+            held = await controller.lease("ws-1")
+            with pytest.raises(AdmissionRejected):
+                await controller.acquire("ws-2")
+            held.release()
+        run(scenario())
+        assert controller.in_flight == 0
+        assert controller.queue_depths()["interactive"] == 0
+
+    def test_lease_releases_exactly_once(self):
+        controller = AdmissionController(max_concurrent=4, per_identity=4)
+
+        async def scenario():
+            kept = await controller.lease("ws-1")
+            lease = await controller.lease("ws-1")
+            lease.release()
+            lease.release()
+            assert controller.in_flight == 1
+            kept.release()
+        run(scenario())
+        assert controller.in_flight == 0
+
+
+async def fake_upstream_stream(request, context):
+    for chunk in (b"event: message_start\n\n", b"event: message_stop\n\n"):
+        await asyncio.sleep(0)
+        yield chunk
+
+
+@pytest.fixture
+def streaming_gateway(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    monkeypatch.setattr(gateway, "AUTH_ENABLED", False)
+    monkeypatch.setattr(gateway, "_stream_anthropic", fake_upstream_stream)
+    monkeypatch.setattr(gateway, "admission", AdmissionController(max_concurrent=8, per_identity=4))
+    return gateway
+
+
+def asgi_request(body):
+    payload = json.dumps(body).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/v1/chat/completions", "raw_path": b"/v1/chat/completions",
+        "query_string": b"", "root_path": "", "server": ("test", 80), "client": ("test", 1234),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode()),
+                    (b"x-workspace-id", b"ws-1")],
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    return scope, receive
+
+
+async def settle():
+    """Let cancelled tasks and any shared upstream stream run to their end"""
+    for _ in range(50):
+        await asyncio.sleep(0)
+    gc.collect()
+    for _ in range(50):
+        await asyncio.sleep(0)
+
+
+STREAM_BODY = {"model": "claude-sonnet-4-5-20250929", "stream": True, "max_tokens": 16,
+               "messages": [{"role": "user", "content": "hi"}]}
+TEMPERATURES = pytest.mark.parametrize("temperature", [0.7, 0.0], ids=["direct", "coalesced"])
+
+
+class TestStreamingSlotRelease:
+    @TEMPERATURES
+    def test_client_gone_before_first_chunk(self, streaming_gateway, temperature):
+        body = {**STREAM_BODY, "temperature": temperature}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                raise OSError("client went away")
+
+        async def scenario():
+            for _ in range(6):
+                scope, receive = asgi_request(body)
+                with pytest.raises(Exception):
+                    await streaming_gateway.app(scope, receive, send)
+                await settle()
+
+        run(scenario())
+        admission = streaming_gateway.admission
+        assert admission.stats["admitted"] == 6
+        assert admission.in_flight == 0
+        assert admission.by_identity == {}
+
+    @TEMPERATURES
+    def test_request_cancelled_at_any_point(self, streaming_gateway, temperature):
+        body = {**STREAM_BODY, "temperature": temperature}
+
+        async def send(message):
+            # A client that never reads: the response cannot get past its start
+            await asyncio.sleep(3600)
+
+        async def scenario():
+            for steps in range(40):
+                scope, receive = asgi_request(body)
+                task = asyncio.ensure_future(streaming_gateway.app(scope, receive, send))
+                for _ in range(steps):
+                    await asyncio.sleep(0)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await settle()
+                assert streaming_gateway.admission.in_flight == 0, f"slot leaked when cancelled after {steps} steps"
+
+        run(scenario())
+        assert streaming_gateway.admission.by_identity == {}
@@ -0,0 +1,95 @@
+"""Prompt-prefix affinity: stable placement and bounded-load spillover (affinity)."""
+
+from contextlib import ExitStack
+
+import pytest
+
+from affinity import AffinityRouter, BoundedLoadRing, prefix_key
+
+TARGETS = ["key0", "key1", "key2"]
+KEYS = [f"conversation-{n}" for n in range(300)]
+
+
+class TestPrefixKey:
+    def test_later_turns_keep_the_key(self):
+        first = [{"role": "user", "content": "hi"}]
+        later = first + [{"role": "assistant", "content": "hello"}, {"role": "user", "content": "more"}]
+        assert prefix_key("claude-3-haiku", "be brief", first) == prefix_key("claude-3-haiku", "be brief", later)
+
+    def test_model_and_system_are_part_of_the_key(self):
+        messages = [{"role": "user", "content": "hi"}]
+        key = prefix_key("claude-3-haiku", "be brief", messages)
+        assert key != prefix_key("claude-3-opus", "be brief", messages)
+        assert key != prefix_key("claude-3-haiku", "be thorough", messages)
+
+    def test_nothing_to_key_on(self):
+        assert prefix_key("claude-3-haiku", None, []) is None
+
+
+class TestBoundedLoadRing:
+    def test_idle_placement_is_stable_and_spread(self):
+        ring = BoundedLoadRing(TARGETS)
+        homes = [ring.pick(key) for key in KEYS]
+        assert all(home for _, home in homes)
+        assert [ring.pick(key)[0] for key in KEYS] == [target for target, _ in homes]
+        assert {target for target, _ in homes} == set(TARGETS)
+
+    def test_removing_a_target_only_moves_its_conversations(self):
+        before = BoundedLoadRing(TARGETS)
+        after = BoundedLoadRing(["key0", "key1"])
+        for key in KEYS:
+            old = before.pick(key)[0]
+            if old != "key2":
+                assert after.pick(key)[0] == old
+
+    def test_full_home_spills_over_and_load_stays_bounded(self):
+        ring = BoundedLoadRing(TARGETS, load_factor=1.0)
+        home = ring.pick("hot")[0]
+        placed = []
+        for _ in range(9):
+            target, _ = ring.pick("hot")
+            ring.in_flight[target] += 1
+            placed.append(target)
+        # The hot conversation starts at home, then walks on as home fills up
+        assert placed[0] == home and set(placed) == set(TARGETS)
+        assert max(ring.in_flight.values()) <= ring.capacity()
+
+    def test_conversation_returns_home_once_load_drops(self):
+        ring = BoundedLoadRing(TARGETS, load_factor=1.0)
+        home = ring.pick("hot")[0]
+        ring.in_flight[home] = 2
+        target, is_home = ring.pick("hot")
+        assert target != home and not is_home
+        ring.in_flight[home] = 0
+        assert ring.pick("hot") == (home, True)
+
+    def test_unkeyed_requests_go_to_the_least_loaded_target(self):
+        ring = BoundedLoadRing(TARGETS)
+        ring.in_flight.update({"key0": 3, "key1": 1, "key2": 2})
+        assert ring.pick(None) == ("key1", False)
+
+
+class TestAffinityRouter:
+    def test_lease_counts_in_flight_and_releases_on_error(self):
+        router = AffinityRouter({"anthropic": TARGETS})
+        key = router.key_for("claude-3-haiku", None, [{"role": "user", "content": "hi"}])
+        with pytest.raises(RuntimeError):
+            with router.lease("anthropic", key) as target:
+                assert router.in_flight()[f"anthropic:{target}"] == 1
+                raise RuntimeError("upstream failed")
+        assert set(router.in_flight().values()) == {0}
+        assert router.stats["home"] == 1
+
+    def test_concurrent_leases_spill_and_are_counted(self):
+        router = AffinityRouter({"anthropic": TARGETS}, load_factor=1.0)
+        with ExitStack() as stack:
+            targets = [stack.enter_context(router.lease("anthropic", "hot")) for _ in range(6)]
+            assert sorted(router.in_flight().values()) == [2, 2, 2]
+        assert len(set(targets)) == 3
+        assert router.stats["spilled"] > 0
+        assert set(router.in_flight().values()) == {0}
+
+    def test_disabled_or_unconfigured(self):
+        assert AffinityRouter({"anthropic": TARGETS}, enabled=False).key_for("m", None, [{"content": "x"}]) is None
+        with AffinityRouter({"anthropic": []}).lease("anthropic", "k") as target:
+            assert target is None
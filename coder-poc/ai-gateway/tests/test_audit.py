@@ -0,0 +1,59 @@
+"""Audit log file per worker and pruning of rotated files (audit.AuditLog)."""
+
+import os
+import threading
+
+from audit import AuditLog
+
+
+def audit_config(log_file, workers):
+    return {"audit": {"log_file": log_file}, "server": {"workers": workers}}
+
+
+class TestLogFilePerWorker:
+    def test_single_worker_keeps_the_configured_path(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("AI_GATEWAY_WORKERS", raising=False)
+        audit = AuditLog.from_config(audit_config(str(tmp_path / "audit.log"), 1))
+        assert audit.path == str(tmp_path / "audit.log")
+
+    def test_several_workers_get_their_own_file(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("AI_GATEWAY_WORKERS", raising=False)
+        audit = AuditLog.from_config(audit_config(str(tmp_path / "audit.log"), 4))
+        assert audit.path == str(tmp_path / f"audit.{os.getpid()}.log")
+
+    def test_workers_from_the_environment(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("AI_GATEWAY_WORKERS", "2")
+        audit = AuditLog.from_config(audit_config(str(tmp_path / "audit-{pid}.jsonl"), 1))
+        assert audit.path == str(tmp_path / f"audit-{os.getpid()}.jsonl")
+
+
+class TestPrune:
+    def make_backups(self, tmp_path, names):
+        for name in names:
+            (tmp_path / name).write_bytes(b"{}\n")
+
+    def test_keeps_the_newest_backups(self, tmp_path):
+        audit = AuditLog(log_file=str(tmp_path / "audit.log"), backup_count=2)
+        self.make_backups(tmp_path, ["audit.log", "audit.log.1.gz", "audit.log.2.gz", "audit.log.3.gz"])
+        audit._prune()
+        assert sorted(os.listdir(tmp_path)) == ["audit.log", "audit.log.2.gz", "audit.log.3.gz"]
+
+    def test_skips_files_still_being_compressed(self, tmp_path):
+        audit = AuditLog(log_file=str(tmp_path / "audit.log"), backup_count=1)
+        self.make_backups(tmp_path, ["audit.log.1.gz", "audit.log.2", "audit.log.2.gz", "audit.log.3.gz"])
+        # Another rotation's compression of audit.log.2 is still running
+        audit._compressing[str(tmp_path / "audit.log.2")] = threading.Thread(target=lambda: None)
+        audit._prune()
+        assert sorted(os.listdir(tmp_path)) == ["audit.log.2", "audit.log.2.gz", "audit.log.3.gz"]
+
+    def test_rotation_compresses_and_prunes(self, tmp_path):
+        audit = AuditLog(log_file=str(tmp_path / "audit.log"), max_bytes=10, backup_count=2,
+                         flush_interval=0.01)
+        audit.start()
+        for n in range(5):
+            audit._write([{"n": n}])
+        audit.stop()
+        names = sorted(os.listdir(tmp_path))
+        assert names[0] == "audit.log"
+        assert len(names) == 3 and all(name.endswith(".gz") for name in names[1:])
+        assert audit._compressing == {}
@@ -0,0 +1,197 @@
+"""Batch submission checks, collection, usage recording and listing across workers (batches, gateway)."""
+
+import asyncio
+import json
+import os
+
+import httpx
+import pytest
+
+import batches
+import gateway
+from batches import BatchManager, LocalBatchBackend
+from rate_limiting import RateLimitTicket
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def echo(params):
+    return {"model": params["model"], "usage": {"input_tokens": 1, "output_tokens": 2}}
+
+
+ITEMS = [{"custom_id": f"r{n}", "params": {"model": "claude-3-haiku", "messages": []}} for n in range(3)]
+
+
+class SharedBackend:
+    """A provider batch every worker can see (like the Anthropic backend)"""
+
+    def __init__(self):
+        self.local = LocalBatchBackend(echo)
+
+    def knows(self, batch_id):
+        return True
+
+    def forget(self, batch_id):
+        pass
+
+    async def create(self, items):
+        return await self.local.create(items)
+
+    async def retrieve(self, batch_id):
+        return await self.local.retrieve(batch_id)
+
+    async def results(self, batch):
+        async for result in self.local.results(batch):
+            yield result
+
+
+def worker(spool_dir, backend, recorded):
+    async def on_item(job, result):
+        recorded.append((job.id, result["custom_id"]))
+    return BatchManager(backend, spool_dir=str(spool_dir), on_item=on_item)
+
+
+async def finish(manager, job):
+    """Wait for the local stand-in to work through the batch"""
+    backend = getattr(manager.backend, "local", manager.backend)
+    await backend._batches[job.id]["task"]
+
+
+class TestCollection:
+    def test_failed_collection_keeps_the_results_for_the_next_poll(self, tmp_path, monkeypatch):
+        recorded = []
+        manager = worker(tmp_path, LocalBatchBackend(echo), recorded)
+        real_replace = os.replace
+        failures = []
+
+        def flaky_replace(src, dst):
+            if dst.endswith(".jsonl") and not failures:
+                failures.append(dst)
+                raise OSError("disk full")
+            return real_replace(src, dst)
+
+        async def scenario():
+            job = await manager.submit(ITEMS, "ws-1", {})
+            await finish(manager, job)
+            monkeypatch.setattr(batches.os, "replace", flaky_replace)
+            await manager.poll_once()
+            assert not job.results_ready and manager.stats["poll_errors"] == 1
+            await manager.poll_once()
+            return job
+
+        job = run(scenario())
+        assert job.results_ready
+        with open(tmp_path / f"{job.id}.jsonl") as f:
+            assert sorted(json.loads(line)["custom_id"] for line in f) == ["r0", "r1", "r2"]
+        assert sorted(recorded) == [(job.id, "r0"), (job.id, "r1"), (job.id, "r2")]
+        assert manager.backend._batches == {}
+
+    def test_usage_is_recorded_once_across_workers_and_retries(self, tmp_path):
+        recorded = []
+        backend = SharedBackend()
+        first, second = worker(tmp_path, backend, recorded), worker(tmp_path, backend, recorded)
+
+        async def scenario():
+            job = await first.submit(ITEMS, "ws-1", {})
+            await finish(first, job)
+            second.load()
+            await first.poll_once()
+            await second.poll_once()
+            # A worker that lost its memory of the batch collects it again
+            second.jobs[job.id].results_ready = False
+            await second.poll_once()
+            return job
+
+        job = run(scenario())
+        assert sorted(recorded) == [(job.id, "r0"), (job.id, "r1"), (job.id, "r2")]
+
+
+class TestList:
+    def test_lists_batches_from_every_worker(self, tmp_path):
+        recorded = []
+        first = worker(tmp_path, LocalBatchBackend(echo), recorded)
+        second = worker(tmp_path, LocalBatchBackend(echo), recorded)
+
+        async def scenario():
+            mine = await first.submit(ITEMS, "ws-1", {})
+            theirs = await second.submit(ITEMS, "ws-1", {})
+            await second.submit(ITEMS, "ws-2", {})
+            await finish(first, mine)
+            await finish(second, theirs)
+            await second.poll_once()
+            return mine, theirs
+
+        mine, theirs = run(scenario())
+        listed = {job.id: job for job in first.list("ws-1")}
+        assert set(listed) == {mine.id, theirs.id}
+        # The other worker's batch as it last spooled it
+        assert listed[theirs.id].results_ready
+
+    def test_missing_spool_lists_nothing(self, tmp_path):
+        manager = BatchManager(LocalBatchBackend(echo), spool_dir=str(tmp_path / "missing"), enabled=False)
+        assert manager.list("ws-1") == []
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.charged = []
+
+    async def acquire(self, identity, estimated_tokens):
+        self.charged.append(estimated_tokens)
+        return RateLimitTicket(identity, {}, estimated_tokens, {})
+
+    async def reconcile(self, ticket, actual_tokens):
+        self.charged.append(actual_tokens)
+        ticket.tokens_charged = actual_tokens
+
+
+@pytest.fixture
+def submit(tmp_path, monkeypatch):
+    limiter = RecordingLimiter()
+    monkeypatch.setattr(gateway, "AUTH_ENABLED", False)
+    monkeypatch.setattr(gateway, "rate_limiter", limiter)
+    monkeypatch.setattr(gateway, "batches", BatchManager(LocalBatchBackend(echo), spool_dir=str(tmp_path)))
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+
+    def post(lines):
+        async def call():
+            transport = httpx.ASGITransport(app=gateway.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as c:
+                return await c.post("/v1/batches", content="\n".join(json.dumps(line) for line in lines),
+                                    headers={"x-workspace-id": "ws-1"})
+        return run(call())
+
+    post.limiter = limiter
+    return post
+
+
+def item(custom_id, **params):
+    return {"custom_id": custom_id, "params": {"model": "claude-3-haiku-20240307",
+                                               "messages": [{"role": "user", "content": "hi " * 100}], **params}}
+
+
+class TestSubmission:
+    @pytest.mark.parametrize("max_tokens", [0, 4097, "1024"])
+    def test_max_tokens_gets_the_interactive_bounds(self, submit, max_tokens):
+        resp = submit([item("ok"), item("big", max_tokens=max_tokens)])
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "big: max_tokens must be between 1 and 4096"
+        assert submit.limiter.charged == []
+
+    def test_models_without_an_anthropic_equivalent_are_rejected(self, submit):
+        resp = submit([item("titan", model="amazon.titan-text-express-v1")])
+        assert resp.status_code == 400
+        assert "no Anthropic equivalent" in resp.json()["detail"]
+
+    def test_bedrock_ids_are_mapped(self, submit):
+        resp = submit([item("r1", model="anthropic.claude-3-haiku-20240307-v1:0")])
+        assert resp.status_code == 202
+
+    def test_whole_estimate_is_charged_against_tpm(self, submit):
+        resp = submit([item("r1", max_tokens=100), item("r2", max_tokens=200)])
+        assert resp.status_code == 202
+        prompt = gateway.token_estimator.fit("claude-3-haiku-20240307", item("r")["params"]["messages"], 100)[1]
+        # Both prompts plus both completions, in full
+        assert submit.limiter.charged == [2 * prompt + 300, 2 * prompt + 300]
@@ -0,0 +1,53 @@
+"""Model validation against the config-seeded catalog (catalog.ModelCatalog)."""
+
+import os
+
+import pytest
+import yaml
+
+from catalog import ModelCatalog, model_aliases
+
+# Accepted by the gateway before the catalog (ALLOWED_MODELS plus the Claude prefixes)
+BASELINE_MODELS = [
+    "claude-3-opus", "claude-3-sonnet", "claude-3-haiku",
+    "claude-sonnet-4-5-20250929", "claude-haiku-4-5-20251001", "claude-opus-4-20250514",
+    "anthropic.claude-3-sonnet", "anthropic.claude-3-haiku",
+    "us.anthropic.claude-3-sonnet",
+    "us.anthropic.claude-sonnet-4-5-20250929-v1:0",
+    "us.anthropic.claude-haiku-4-5-20251001-v1:0",
+    "us.anthropic.claude-opus-4-20250514-v1:0",
+    "claude-3-opus-20240229", "claude-3-5-sonnet-20241022", "claude-3-5-haiku-20241022",
+    "anthropic.claude-3-opus-20240229-v1:0", "anthropic.claude-3-haiku-20240307-v1:0",
+]
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    with open(os.environ["CONFIG_PATH"]) as f:
+        config = yaml.safe_load(f)
+    return ModelCatalog.from_config(config, available=lambda name: True)
+
+
+class TestModelAliases:
+    def test_bedrock_id_resolves_to_its_family(self):
+        aliases = model_aliases("us.anthropic.claude-3-sonnet-20240229-v1:0")
+        assert aliases[1:] == ["claude-3-sonnet-20240229", "claude-3-sonnet"]
+
+    def test_family_without_version_suffix(self):
+        assert model_aliases("anthropic.claude-3-haiku")[1:] == ["claude-3-haiku", "claude-3-haiku"]
+
+
+class TestAllows:
+    @pytest.mark.parametrize("model", BASELINE_MODELS)
+    def test_baseline_models_are_still_accepted(self, catalog, model):
+        assert catalog.allows(model)
+
+    @pytest.mark.parametrize("model", [
+        "eu.anthropic.claude-3-haiku-20240307-v1:0", "apac.anthropic.claude-sonnet-4-5",
+    ])
+    def test_other_region_prefixes_resolve_to_configured_families(self, catalog, model):
+        assert catalog.allows(model)
+
+    @pytest.mark.parametrize("model", ["gpt-4", "claude-2", "anthropic.claude-instant-v1", "gemini-pro"])
+    def test_unconfigured_and_disabled_models_are_rejected(self, catalog, model):
+        assert not catalog.allows(model)
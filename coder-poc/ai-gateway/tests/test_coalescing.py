@@ -0,0 +1,180 @@
+"""Single-flight coalescing of identical in-flight calls and streams (coalescing)."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from coalescing import SingleFlight, StreamBroadcast
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+class Upstream:
+    """One call per start(); finishes when release() is called"""
+
+    def __init__(self):
+        self.calls = 0
+        self.released = asyncio.Event()
+        self.cancelled = False
+
+    async def call(self):
+        self.calls += 1
+        try:
+            await self.released.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return {"answer": self.calls}
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for chunk in (b"a", b"b", b"c"):
+                await self.released.wait()
+                yield chunk
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+class TestDo:
+    def test_identical_calls_share_one_upstream_call(self):
+        flights = SingleFlight()
+
+        async def scenario():
+            upstream = Upstream()
+            waiters = [asyncio.ensure_future(flights.do("k", upstream.call)) for _ in range(3)]
+            await asyncio.sleep(0)
+            upstream.released.set()
+            return upstream, await asyncio.gather(*waiters)
+
+        upstream, results = run(scenario())
+        assert upstream.calls == 1
+        assert [r for r, _ in results] == [{"answer": 1}] * 3
+        assert [leader for _, leader in results] == [True, False, False]
+        assert flights.stats["leaders"] == 1 and flights.stats["coalesced"] == 2
+        assert flights.in_flight == 0
+
+    def test_leader_leaving_does_not_cancel_the_call_for_others(self):
+        flights = SingleFlight()
+
+        async def scenario():
+            upstream = Upstream()
+            leader = asyncio.ensure_future(flights.do("k", upstream.call))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flights.do("k", upstream.call))
+            await asyncio.sleep(0)
+            leader.cancel()
+            await asyncio.sleep(0)
+            upstream.released.set()
+            return upstream, await follower
+
+        upstream, (result, leader) = run(scenario())
+        assert result == {"answer": 1} and not leader
+        assert not upstream.cancelled
+
+    def test_call_is_cancelled_once_every_waiter_has_gone(self):
+        flights = SingleFlight()
+
+        async def scenario():
+            upstream = Upstream()
+            waiters = [asyncio.ensure_future(flights.do("k", upstream.call)) for _ in range(2)]
+            await asyncio.sleep(0)
+            for waiter in waiters:
+                waiter.cancel()
+            await asyncio.gather(*waiters, return_exceptions=True)
+            await asyncio.sleep(0)
+            return upstream
+
+        upstream = run(scenario())
+        assert upstream.cancelled
+        assert flights.stats["abandoned"] == 1
+        assert flights.in_flight == 0
+
+    def test_errors_reach_every_waiter(self):
+        flights = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0)
+            raise RuntimeError("upstream failed")
+
+        async def scenario():
+            waiters = [asyncio.ensure_future(flights.do("k", failing)) for _ in range(2)]
+            return await asyncio.gather(*waiters, return_exceptions=True)
+
+        assert [type(r) for r in run(scenario())] == [RuntimeError, RuntimeError]
+        assert flights.in_flight == 0
+
+    def test_only_deterministic_requests_are_eligible(self):
+        assert SingleFlight().eligible(SimpleNamespace(temperature=0))
+        assert not SingleFlight().eligible(SimpleNamespace(temperature=0.7))
+        assert SingleFlight(deterministic_only=False).eligible(SimpleNamespace(temperature=0.7))
+        assert not SingleFlight(enabled=False).eligible(SimpleNamespace(temperature=0))
+
+
+class TestStream:
+    def test_late_subscriber_gets_the_whole_stream(self):
+        flights = SingleFlight()
+
+        async def scenario():
+            upstream = Upstream()
+            done = []
+            first, leader = flights.stream("k", upstream.stream, on_done=lambda: done.append(1))
+            early = asyncio.ensure_future(collect(first))
+            upstream.released.set()
+            await asyncio.sleep(0)
+            late, follower_leads = flights.stream("k", upstream.stream)
+            chunks = await asyncio.gather(early, collect(late))
+            await asyncio.sleep(0)
+            return upstream, leader, follower_leads, chunks, done
+
+        upstream, leader, follower_leads, chunks, done = run(scenario())
+        assert upstream.calls == 1
+        assert leader and not follower_leads
+        assert chunks == [[b"a", b"b", b"c"]] * 2
+        assert done == [1]
+        assert flights.in_flight == 0
+
+    def test_stream_is_cancelled_when_every_subscriber_leaves(self):
+        flights = SingleFlight()
+
+        async def scenario():
+            upstream = Upstream()
+            done = []
+            stream, _ = flights.stream("k", upstream.stream, on_done=lambda: done.append(1))
+            reader = asyncio.ensure_future(collect(stream))
+            await asyncio.sleep(0)
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+            for _ in range(3):
+                await asyncio.sleep(0)
+            # A new request after the abandonment starts its own upstream stream
+            _, leads_again = flights.stream("k", upstream.stream)
+            return upstream, done, leads_again
+
+        upstream, done, leads_again = run(scenario())
+        assert upstream.cancelled
+        assert done == [1]
+        assert leads_again
+
+    def test_upstream_error_reaches_subscribers(self):
+        async def failing():
+            yield b"a"
+            raise RuntimeError("stream broke")
+
+        async def scenario():
+            broadcast = StreamBroadcast(failing())
+            received = []
+            with pytest.raises(RuntimeError):
+                async for chunk in broadcast.subscribe():
+                    received.append(chunk)
+            return received
+
+        assert run(scenario()) == [b"a"]
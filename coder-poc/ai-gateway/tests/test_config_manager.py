@@ -0,0 +1,55 @@
+"""CORS origin allowlist from the configuration (config_manager.ConfigSnapshot)."""
+
+import os
+
+import pytest
+import yaml
+
+from config_manager import DEFAULT_ORIGINS, ConfigManager, ConfigSnapshot, OriginPolicy
+
+
+@pytest.fixture
+def no_env_origins(monkeypatch):
+    monkeypatch.delenv("AI_GATEWAY_ALLOWED_ORIGINS", raising=False)
+
+
+class TestOrigins:
+    def test_shipped_config_allows_only_the_default_origins(self, no_env_origins):
+        with open(os.environ["CONFIG_PATH"]) as f:
+            snapshot = ConfigSnapshot(yaml.safe_load(f), "test")
+        for origin in DEFAULT_ORIGINS:
+            assert snapshot.origins.allows(origin)
+        for origin in ("http://localhost:3000", "http://coder-server:8080", "http://evil.coder.internal"):
+            assert not snapshot.origins.allows(origin)
+
+    def test_defaults_without_configured_origins(self, no_env_origins):
+        policy = ConfigSnapshot({"security": {}}, "test").origins
+        assert policy.exact == frozenset(DEFAULT_ORIGINS)
+        assert policy.pattern is None
+
+    def test_environment_overrides_config(self, monkeypatch):
+        monkeypatch.setenv("AI_GATEWAY_ALLOWED_ORIGINS", "https://ide.example.com")
+        policy = ConfigSnapshot({"security": {"allowed_origins": ["http://localhost:*"]}}, "test").origins
+        assert policy.allows("https://ide.example.com")
+        assert not policy.allows("http://localhost:7080")
+
+    def test_wildcard_matches_one_host_part_or_port(self):
+        policy = OriginPolicy(["http://*.coder.internal", "http://localhost:*"])
+        assert policy.allows("http://ws-1.coder.internal")
+        assert policy.allows("http://localhost:7080")
+        assert not policy.allows("http://ws-1.coder.internal.evil.com/")
+        assert not policy.allows("https://localhost:7080")
+
+    def test_bare_wildcard_is_rejected(self, no_env_origins):
+        with pytest.raises(ValueError, match="not allowed with credentials"):
+            ConfigSnapshot({"security": {"allowed_origins": ["http://localhost:7080", "*"]}}, "test")
+
+    def test_reload_with_a_bare_wildcard_keeps_the_running_origins(self, tmp_path, no_env_origins):
+        path = tmp_path / "config.yaml"
+        path.write_text(yaml.safe_dump({"security": {"allowed_origins": ["http://localhost:7080"]}}))
+        manager = ConfigManager(str(path))
+        path.write_text(yaml.safe_dump({"security": {"allowed_origins": ["*"]}, "padding": True}))
+        assert not manager.reload()
+        assert manager.stats["reload_errors"] == 1
+        assert manager.current.origins.allows("http://localhost:7080")
+        assert not manager.current.origins.allows("https://evil.example.com")
@@ -0,0 +1,128 @@
+"""Request deadlines, disconnect cancellation and adaptive timeouts (deadlines)."""
+
+import asyncio
+
+import pytest
+
+from deadlines import AdaptiveTimeouts, ClientDisconnected, Deadline, DeadlineExceeded, DeadlinePolicy, run_until
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeRequest:
+    """ASGI request whose client disconnects once disconnected is set"""
+
+    def __init__(self):
+        self.disconnected = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+
+class TestDeadlinePolicy:
+    def test_client_header_wins_and_is_capped(self):
+        policy = DeadlinePolicy(default=120, maximum=600)
+        assert policy.for_request({"x-request-timeout": "15"}).budget == 15
+        assert policy.for_request({"x-stainless-timeout": "900"}).budget == 600
+        assert policy.for_request({"x-request-timeout": "15"}).source == "client"
+        assert policy.stats["client_supplied"] == 3
+
+    @pytest.mark.parametrize("value", ["soon", "0", "-5"])
+    def test_invalid_header_falls_back_to_the_class_default(self, value):
+        policy = DeadlinePolicy(default=120, by_class={"batch": 300})
+        assert policy.for_request({"x-request-timeout": value}).budget == 120
+        assert policy.for_request({"x-request-timeout": value}, "batch").budget == 300
+
+    def test_disabled(self):
+        assert DeadlinePolicy(enabled=False).for_request({"x-request-timeout": "5"}) is None
+
+
+class TestRunUntil:
+    def test_result_within_the_deadline(self):
+        async def work():
+            await asyncio.sleep(0)
+            return "answer"
+        assert run(run_until(work(), Deadline(5))) == "answer"
+
+    def test_deadline_cancels_the_work(self):
+        policy = DeadlinePolicy()
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            finally:
+                cancelled.append(True)
+
+        with pytest.raises(DeadlineExceeded):
+            run(run_until(work(), Deadline(0.01), policy=policy))
+        assert cancelled == [True]
+        assert policy.stats["exceeded"] == 1
+
+    def test_disconnect_cancels_the_work(self):
+        policy = DeadlinePolicy()
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            finally:
+                cancelled.append(True)
+
+        async def scenario():
+            request = FakeRequest()
+            asyncio.get_running_loop().call_later(0.01, request.disconnected.set)
+            await run_until(work(), Deadline(5), request, policy)
+
+        with pytest.raises(ClientDisconnected):
+            run(scenario())
+        assert cancelled == [True]
+        assert policy.stats["disconnected"] == 1
+
+    def test_errors_propagate(self):
+        async def work():
+            raise RuntimeError("upstream failed")
+        with pytest.raises(RuntimeError):
+            run(run_until(work(), Deadline(5), FakeRequest()))
+
+
+class TestAdaptiveTimeouts:
+    def test_upper_bounds_until_enough_samples(self):
+        timeouts = AdaptiveTimeouts(lambda provider: [0.5] * 5, min_samples=20)
+        assert timeouts.read_timeout("anthropic") == 600.0
+        assert timeouts.connect_timeout("anthropic") == 10.0
+
+    def test_read_timeout_follows_the_latency_percentile(self):
+        latencies = [10.0] * 99 + [40.0]
+        timeouts = AdaptiveTimeouts(lambda provider: latencies, percentile=0.99, multiplier=3.0, min_samples=20)
+        assert timeouts.read_timeout("anthropic") == 120.0
+
+    def test_timeouts_are_clamped(self):
+        fast = AdaptiveTimeouts(lambda provider: [0.1] * 50, min_samples=20)
+        slow = AdaptiveTimeouts(lambda provider: [500.0] * 50, min_samples=20)
+        assert fast.read_timeout("anthropic") == 30.0
+        assert slow.read_timeout("anthropic") == 600.0
+
+    def test_connect_timeout_from_traced_handshakes(self, monkeypatch):
+        clock = [0.0]
+        monkeypatch.setattr("deadlines.time.monotonic", lambda: clock[0])
+        timeouts = AdaptiveTimeouts(lambda provider: [], min_samples=3, connect_min=0.1)
+
+        async def handshake(seconds):
+            trace = timeouts.tracer("anthropic")
+            await trace("connection.connect_tcp.started", {})
+            clock[0] += seconds / 2
+            await trace("connection.connect_tcp.complete", {})
+            clock[0] += seconds / 2
+            await trace("connection.start_tls.complete", {})
+
+        for _ in range(3):
+            run(handshake(0.2))
+        # One sample per connection: the TLS time replaces the TCP-only one
+        assert list(timeouts._connects["anthropic"]) == [pytest.approx(0.2)] * 3
+        assert timeouts.connect_timeout("anthropic") == pytest.approx(0.6)
+        call = timeouts.for_call("anthropic")
+        assert call.connect == call.pool == call.write == pytest.approx(0.6)
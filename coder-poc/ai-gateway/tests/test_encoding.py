@@ -0,0 +1,117 @@
+"""Negotiated response compression and JSON encoding (encoding)."""
+
+import asyncio
+import gzip
+import json
+
+from encoding import CompressionMiddleware, ResponseCompressor, dumps, negotiate
+
+BIG = json.dumps({"text": "x" * 4000}).encode()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def app_sending(body, headers=(), chunks=1):
+    """ASGI app answering with body (in chunks parts) and the given extra headers"""
+
+    async def app(scope, receive, send):
+        response_headers = [(b"content-type", b"application/json"), *headers]
+        if not any(name == b"content-length" for name, _ in headers) and chunks == 1:
+            response_headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": response_headers})
+        size = -(-len(body) // chunks)
+        for i in range(chunks):
+            await send({"type": "http.response.body", "body": body[i * size:(i + 1) * size],
+                        "more_body": i < chunks - 1})
+    return app
+
+
+def call(app, accept_encoding=None, compressor=None):
+    """(headers, body) as the client receives them through CompressionMiddleware"""
+    compressor = compressor or ResponseCompressor(minimum_size=1024)
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": headers}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    run(CompressionMiddleware(app, compressor)(scope, receive, send))
+    start = sent[0]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return {k.decode(): v.decode() for k, v in start["headers"]}, body
+
+
+class TestNegotiate:
+    def test_q_values_pick_the_coding(self):
+        assert negotiate("gzip, br", ("br", "gzip")) == "br"
+        assert negotiate("gzip;q=1.0, br;q=0.5", ("br", "gzip")) == "gzip"
+
+    def test_refused_or_unknown_codings(self):
+        assert negotiate("br;q=0, deflate", ("br", "gzip")) is None
+        assert negotiate("identity", ("gzip",)) is None
+
+    def test_wildcard(self):
+        assert negotiate("*", ("gzip",)) == "gzip"
+        assert negotiate("*;q=0, gzip", ("br", "gzip")) == "gzip"
+
+
+class TestCompressionMiddleware:
+    def test_large_json_is_gzipped_when_accepted(self):
+        compressor = ResponseCompressor(minimum_size=1024)
+        headers, body = call(app_sending(BIG), "gzip", compressor)
+        assert headers["content-encoding"] == "gzip"
+        assert headers["vary"] == "Accept-Encoding"
+        assert int(headers["content-length"]) == len(body) < len(BIG)
+        assert gzip.decompress(body) == BIG
+        assert compressor.stats["gzip"] == 1
+        assert compressor.bytes == {"before": len(BIG), "after": len(body)}
+
+    def test_without_accept_encoding_the_body_is_untouched(self):
+        headers, body = call(app_sending(BIG))
+        assert "content-encoding" not in headers and body == BIG
+
+    def test_below_minimum_size_is_untouched(self):
+        compressor = ResponseCompressor(minimum_size=1024)
+        headers, body = call(app_sending(b'{"ok": true}'), "gzip", compressor)
+        assert "content-encoding" not in headers and body == b'{"ok": true}'
+        assert compressor.stats["too_small"] == 1
+
+    def test_already_encoded_body_passes_through(self):
+        encoded = gzip.compress(BIG)
+        compressor = ResponseCompressor(minimum_size=1024)
+        headers, body = call(app_sending(encoded, [(b"content-encoding", b"gzip")]), "gzip", compressor)
+        assert headers["content-encoding"] == "gzip" and body == encoded
+        assert compressor.stats["gzip"] == 0
+
+    def test_streamed_body_passes_through(self):
+        compressor = ResponseCompressor(minimum_size=1024)
+        headers, body = call(app_sending(BIG, chunks=4), "gzip", compressor)
+        assert "content-encoding" not in headers and body == BIG
+        assert compressor.stats["streamed"] == 1
+
+    def test_incompressible_type_passes_through(self):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"image/png"), (b"content-length", str(len(BIG)).encode())]})
+            await send({"type": "http.response.body", "body": BIG})
+        headers, body = call(app, "gzip")
+        assert "content-encoding" not in headers and body == BIG
+
+    def test_strong_etag_becomes_weak(self):
+        headers, _ = call(app_sending(BIG, [(b"etag", b'"abc"')]), "gzip")
+        assert headers["etag"] == 'W/"abc"'
+
+    def test_disabled(self):
+        headers, body = call(app_sending(BIG), "gzip", ResponseCompressor(enabled=False))
+        assert "content-encoding" not in headers and body == BIG
+
+
+class TestDumps:
+    def test_compact_utf8(self):
+        assert dumps({"a": [1, "é"]}) == '{"a":[1,"é"]}'.encode()
@@ -0,0 +1,82 @@
+"""Claude passthrough: upstream bytes and encoding forwarded as-is, usage still read (gateway.proxy_claude)."""
+
+import asyncio
+import gzip
+import json
+
+import httpx
+import pytest
+
+import gateway
+
+USAGE = {"input_tokens": 7, "output_tokens": 3}
+# Large enough that CompressionMiddleware would otherwise encode it
+MESSAGE = json.dumps({"content": [{"type": "text", "text": "x" * 20000}], "usage": USAGE}).encode()
+
+
+class NetworkStream(httpx.AsyncByteStream):
+    """A body that arrives over the wire (httpx reads in-memory bodies eagerly)"""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+
+@pytest.fixture
+def claude(monkeypatch):
+    seen = []
+    tracked = []
+
+    def upstream(request):
+        seen.append(request.headers.get("accept-encoding"))
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return httpx.Response(200, headers={"content-type": "application/json", "content-encoding": "gzip"},
+                                  stream=NetworkStream(gzip.compress(MESSAGE, mtime=0)))
+        return httpx.Response(200, headers={"content-type": "application/json"}, stream=NetworkStream(MESSAGE))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(gateway, "upstream_client", lambda: client)
+    monkeypatch.setattr(gateway, "AUTH_ENABLED", False)
+    monkeypatch.setattr(gateway.rate_limiter.table, "enabled", False)
+    monkeypatch.setattr(gateway, "track_usage",
+                        lambda workspace, tokens_in, tokens_out: tracked.append((tokens_in, tokens_out)))
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+
+    def post(accept_encoding):
+        async def call():
+            transport = httpx.ASGITransport(app=gateway.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as c:
+                request = c.build_request("POST", "/v1/claude/v1/messages", headers={
+                    "x-workspace-id": "ws-1", "accept-encoding": accept_encoding,
+                }, json={"model": "claude-3-haiku-20240307", "max_tokens": 16,
+                         "messages": [{"role": "user", "content": "hi"}]})
+                resp = await c.send(request, stream=True)
+                resp.raw_body = b"".join([chunk async for chunk in resp.aiter_raw()])
+                await resp.aclose()
+                return resp
+        return asyncio.run(call())
+
+    post.seen = seen
+    post.tracked = tracked
+    return post
+
+
+class TestPassthrough:
+    def test_encoded_body_is_forwarded_without_recompression(self, claude):
+        compressed_before = gateway.compressor.stats["gzip"]
+        resp = claude("gzip")
+        assert claude.seen == ["gzip"]
+        assert resp.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["vary"]
+        assert resp.raw_body == gzip.compress(MESSAGE, mtime=0)
+        assert gateway.compressor.stats["gzip"] == compressed_before
+        assert claude.tracked == [(7, 3)]
+
+    def test_client_without_accept_encoding_gets_identity(self, claude):
+        resp = claude("identity")
+        assert claude.seen == ["identity"]
+        assert "content-encoding" not in resp.headers
+        assert resp.raw_body == MESSAGE
+        assert claude.tracked == [(7, 3)]
@@ -0,0 +1,196 @@
+"""Token-bucket refill and charging, and settling estimates (rate_limiting, gateway proxies)."""
+
+import asyncio
+import io
+import json
+
+import httpx
+import pytest
+
+import rate_limiting
+from rate_limiting import LocalBucketStore, RateLimitTicket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiting, "time", clock)
+    return clock
+
+
+def take(store, specs, force=False):
+    return asyncio.run(store.take_all(specs, force=force))
+
+
+class TestLocalBucketStore:
+    def test_new_bucket_starts_full(self, clock):
+        allowed, levels, retry_after = take(LocalBucketStore(), [("u", 60, 1)])
+        assert allowed
+        assert levels == [59]
+        assert retry_after == 0.0
+
+    def test_empty_bucket_rejects_with_retry_after(self, clock):
+        store = LocalBucketStore()
+        assert take(store, [("u", 60, 60)])[0]
+        allowed, _, retry_after = take(store, [("u", 60, 1)])
+        assert not allowed
+        assert retry_after == pytest.approx(1.0)
+
+    def test_refills_at_limit_per_minute(self, clock):
+        store = LocalBucketStore()
+        take(store, [("u", 60, 60)])
+        clock.now += 30
+        allowed, levels, _ = take(store, [("u", 60, 10)])
+        assert allowed
+        assert levels == [pytest.approx(20)]
+
+    def test_refill_is_capped_at_the_limit(self, clock):
+        store = LocalBucketStore()
+        take(store, [("u", 60, 10)])
+        clock.now += 3600
+        _, levels, _ = take(store, [("u", 60, 0)])
+        assert levels == [60]
+
+    def test_all_or_nothing_across_buckets(self, clock):
+        store = LocalBucketStore()
+        take(store, [("tpm", 100, 100)])
+        allowed, _, _ = take(store, [("rpm", 60, 1), ("tpm", 100, 50)])
+        assert not allowed
+        # The RPM bucket was not charged for the rejected request
+        _, levels, _ = take(store, [("rpm", 60, 0)])
+        assert levels == [60]
+
+    def test_forced_charge_may_go_negative(self, clock):
+        store = LocalBucketStore()
+        allowed, levels, _ = take(store, [("u", 60, 90)], force=True)
+        assert allowed
+        assert levels == [-30]
+
+    def test_sweep_drops_idle_buckets(self, clock):
+        store = LocalBucketStore(max_buckets=2)
+        take(store, [("a", 60, 1)])
+        take(store, [("b", 60, 1)])
+        clock.now += 61
+        take(store, [("c", 60, 1)])
+        assert set(store._buckets) == {"c"}
+
+
+class RecordingLimiter:
+    """Charges nothing; records what each request was reconciled to"""
+
+    def __init__(self):
+        self.reconciled = []
+
+    async def acquire(self, identity, estimated_tokens):
+        return RateLimitTicket(identity, {}, estimated_tokens, {})
+
+    async def reconcile(self, ticket, actual_tokens):
+        self.reconciled.append((ticket.tokens_charged, actual_tokens))
+        ticket.tokens_charged = actual_tokens
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    import gateway
+
+    limiter = RecordingLimiter()
+    monkeypatch.setattr(gateway, "AUTH_ENABLED", False)
+    monkeypatch.setattr(gateway, "rate_limiter", limiter)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+
+    def post(path, body, upstream=None, bedrock=None):
+        if upstream:
+            client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+            monkeypatch.setattr(gateway, "upstream_client", lambda: client)
+        if bedrock:
+            monkeypatch.setattr(gateway, "bedrock_runtime", lambda region=None: bedrock)
+
+        async def call():
+            transport = httpx.ASGITransport(app=gateway.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as c:
+                return await c.post(path, json=body, headers={"x-workspace-id": "ws-1"})
+        return asyncio.run(call())
+
+    post.limiter = limiter
+    return post
+
+
+class NetworkStream(httpx.AsyncByteStream):
+    """A body that arrives over the wire (httpx reads in-memory bodies eagerly)"""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+
+def upstream_response(status_code, body, headers=None):
+    return httpx.Response(status_code, headers={"content-type": "application/json", **(headers or {})},
+                          stream=NetworkStream(body))
+
+
+CLAUDE_BODY = {"model": "claude-3-haiku-20240307", "max_tokens": 16,
+               "messages": [{"role": "user", "content": "hi " * 200}]}
+
+
+class FakeBedrock:
+    class exceptions:
+        class ThrottlingException(Exception):
+            pass
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def invoke_model(self, modelId, body):
+        if self.error:
+            raise self.error
+        return {"body": io.BytesIO(json.dumps({"usage": {"input_tokens": 7, "output_tokens": 3}}).encode())}
+
+
+class TestReconcileOnEveryPath:
+    def test_claude_success_charges_actual_usage(self, proxy):
+        def upstream(request):
+            return upstream_response(200, json.dumps({"usage": {"input_tokens": 7, "output_tokens": 3}}).encode())
+        resp = proxy("/v1/claude/v1/messages", CLAUDE_BODY, upstream=upstream)
+        assert resp.status_code == 200
+        [(estimated, actual)] = proxy.limiter.reconciled
+        assert estimated > 10 and actual == 10
+
+    @pytest.mark.parametrize("error, status", [(httpx.ConnectError("refused"), 502),
+                                               (httpx.ReadTimeout("slow"), 504)], ids=["error", "timeout"])
+    def test_claude_failure_refunds_the_estimate(self, proxy, error, status):
+        def upstream(request):
+            raise error
+        resp = proxy("/v1/claude/v1/messages", CLAUDE_BODY, upstream=upstream)
+        assert resp.status_code == status
+        [(estimated, actual)] = proxy.limiter.reconciled
+        assert estimated > 0 and actual == 0
+
+    def test_bedrock_success_charges_actual_usage(self, proxy):
+        resp = proxy("/v1/bedrock/invoke", {"model_id": "anthropic.claude-3-haiku-20240307-v1:0",
+                                            "body": CLAUDE_BODY}, bedrock=FakeBedrock())
+        assert resp.status_code == 200
+        assert proxy.limiter.reconciled[-1][1] == 10
+
+    @pytest.mark.parametrize("error, status", [(RuntimeError("boom"), 502),
+                                               (FakeBedrock.exceptions.ThrottlingException(), 429)],
+                             ids=["error", "throttled"])
+    def test_bedrock_failure_refunds_the_estimate(self, proxy, error, status):
+        resp = proxy("/v1/bedrock/invoke", {"model_id": "anthropic.claude-3-haiku-20240307-v1:0",
+                                            "body": CLAUDE_BODY}, bedrock=FakeBedrock(error))
+        assert resp.status_code == status
+        [(estimated, actual)] = proxy.limiter.reconciled
+        assert estimated > 0 and actual == 0
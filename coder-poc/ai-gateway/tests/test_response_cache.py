@@ -0,0 +1,109 @@
+"""Exact-match response cache: keys, LRU bounds, expiry and the shared tier (response_cache)."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import response_cache
+from response_cache import LRUCache, ResponseCache, cache_key
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def request(**fields):
+    return SimpleNamespace(**{"model": "claude-3-haiku", "messages": MESSAGES, "temperature": 0.0,
+                              "max_tokens": 16, "stream": False, "system": None, **fields})
+
+
+class FakeShared:
+    def __init__(self, fail=False):
+        self.data = {}
+        self.fail = fail
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("shared tier down")
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("shared tier down")
+        self.data[key] = value
+
+
+class TestCacheKey:
+    def test_key_ignores_dict_order(self):
+        assert cache_key("m", [{"role": "user", "content": "hi"}], 0, 16) == \
+            cache_key("m", [{"content": "hi", "role": "user"}], 0, 16)
+
+    def test_every_field_counts(self):
+        base = cache_key("m", MESSAGES, 0, 16)
+        assert base != cache_key("n", MESSAGES, 0, 16)
+        assert base != cache_key("m", MESSAGES, 0.5, 16)
+        assert base != cache_key("m", MESSAGES, 0, 32)
+        assert base != cache_key("m", MESSAGES, 0, 16, system="be brief")
+        assert base == cache_key("m", MESSAGES, 0, 16, system=None)
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used_past_the_byte_bound(self):
+        lru = LRUCache(max_bytes=10, ttl=60)
+        lru.set("a", b"aaaa")
+        lru.set("b", b"bbbb")
+        assert lru.get("a") == b"aaaa"
+        lru.set("c", b"cccc")
+        assert lru.get("b") is None
+        assert lru.get("a") == b"aaaa" and lru.get("c") == b"cccc"
+        assert lru.size == 8
+
+    def test_oversized_entries_are_not_stored(self):
+        lru = LRUCache(max_bytes=4, ttl=60)
+        lru.set("a", b"too big")
+        assert len(lru) == 0 and lru.size == 0
+
+    def test_entries_expire(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+        lru = LRUCache(max_bytes=100, ttl=60)
+        lru.set("a", b"aaaa")
+        now[0] += 61
+        assert lru.get("a") is None
+        assert lru.size == 0
+
+
+class TestResponseCache:
+    def test_only_deterministic_complete_requests_are_eligible(self):
+        cache = ResponseCache(enabled=True)
+        assert cache.eligible(request())
+        assert not cache.eligible(request(temperature=0.7))
+        assert not cache.eligible(request(stream=True))
+        assert ResponseCache(enabled=True, deterministic_only=False).eligible(request(temperature=0.7))
+        assert not ResponseCache(enabled=False).eligible(request())
+
+    def test_shared_hit_fills_the_local_tier(self):
+        shared = FakeShared()
+        writer = ResponseCache(enabled=True, shared_store=shared)
+        reader = ResponseCache(enabled=True, shared_store=shared)
+        key = writer.key_for(request())
+        run(writer.set(key, b"answer"))
+        assert run(reader.get(key)) == b"answer"
+        assert reader.stats["shared_hits"] == 1
+        assert reader.local.get(key) == b"answer"
+
+    def test_shared_tier_errors_fall_back_to_local(self):
+        cache = ResponseCache(enabled=True, shared_store=FakeShared(fail=True))
+        run(cache.set("k", b"answer"))
+        assert run(cache.get("k")) == b"answer"
+        assert run(cache.get("other")) is None
+        assert cache.stats["errors"] == 2
+        assert cache.stats["misses"] == 1
+
+    @pytest.mark.parametrize("enabled", [False, True])
+    def test_shared_store_only_when_enabled(self, enabled):
+        cache = ResponseCache(enabled=enabled, shared_store=FakeShared())
+        assert (cache.shared is not None) == enabled
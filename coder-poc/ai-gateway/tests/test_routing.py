@@ -0,0 +1,97 @@
+"""Provider failover and circuit breakers (routing.ProviderRouter)."""
+
+import asyncio
+
+import pytest
+
+from routing import ProviderRouter, UpstreamError
+
+MODELS = {
+    "anthropic": ["claude-sonnet-4-5-20250929"],
+    "bedrock": ["us.anthropic.claude-sonnet-4-5-20250929-v1:0"],
+}
+
+
+def make_router(**kwargs):
+    return ProviderRouter(MODELS, available=lambda provider: True,
+                          breaker_config={"cooldown_seconds": 30}, **kwargs)
+
+
+def open_breaker(router, provider, cooled_down):
+    breaker = router.breakers[provider]
+    breaker.state = "open"
+    breaker.opened_at = -1e9 if cooled_down else float("inf")
+
+
+def invoker(failing=()):
+    calls = []
+
+    async def invoke(provider, model):
+        calls.append(provider)
+        if provider in failing:
+            raise UpstreamError(provider, 503, "unavailable")
+        return {"provider": provider, "model": model}
+
+    invoke.calls = calls
+    return invoke
+
+
+def call(router, invoke, provider="anthropic"):
+    return asyncio.run(router.call(provider, MODELS["anthropic"][0], invoke))
+
+
+class TestFailover:
+    def test_fails_over_to_equivalent_model(self):
+        router = make_router()
+        invoke = invoker(failing={"anthropic"})
+        result = call(router, invoke)
+        assert result == {"provider": "bedrock", "model": MODELS["bedrock"][0]}
+        assert invoke.calls == ["anthropic", "bedrock"]
+        assert router.counters["failovers"] == 1
+
+    def test_open_breaker_is_skipped(self):
+        router = make_router()
+        open_breaker(router, "anthropic", cooled_down=False)
+        invoke = invoker()
+        assert call(router, invoke)["provider"] == "bedrock"
+        assert invoke.calls == ["bedrock"]
+
+    def test_all_open_still_tries_the_first_candidate(self):
+        router = make_router()
+        open_breaker(router, "anthropic", cooled_down=False)
+        open_breaker(router, "bedrock", cooled_down=False)
+        invoke = invoker()
+        assert call(router, invoke)["provider"] == "anthropic"
+
+    def test_every_candidate_failing_raises_the_last_error(self):
+        router = make_router()
+        with pytest.raises(UpstreamError) as e:
+            call(router, invoker(failing={"anthropic", "bedrock"}))
+        assert e.value.provider == "bedrock"
+
+
+class TestHalfOpenProbe:
+    def test_unused_candidate_keeps_its_probe(self):
+        router = make_router()
+        open_breaker(router, "bedrock", cooled_down=True)
+        invoke = invoker()
+        call(router, invoke)
+        assert invoke.calls == ["anthropic"]
+        # Bedrock was never called, so its probe is still available
+        assert router.breakers["bedrock"].state == "open"
+        assert router.breakers["bedrock"].allow()
+
+    def test_probe_is_spent_on_the_candidate_actually_called(self):
+        router = make_router()
+        open_breaker(router, "bedrock", cooled_down=True)
+        invoke = invoker(failing={"anthropic"})
+        assert call(router, invoke)["provider"] == "bedrock"
+        assert router.breakers["bedrock"].state == "closed"
+
+    def test_hedging_leaves_backup_probe_alone_when_primary_answers(self):
+        router = make_router(hedging=True)
+        open_breaker(router, "bedrock", cooled_down=True)
+        invoke = invoker()
+        call(router, invoke)
+        assert invoke.calls == ["anthropic"]
+        assert router.breakers["bedrock"].allow()
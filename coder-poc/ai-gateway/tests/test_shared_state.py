@@ -0,0 +1,68 @@
+"""SQLite shared-state backend (shared_state.SqliteStore)."""
+
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from shared_state import SqliteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteStore(str(tmp_path / "state.db"))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestSqliteStore:
+    def test_buckets_charge_and_reject(self, store):
+        assert run(store.take_all([("u", 60, 60)]))[0]
+        allowed, _, retry_after = run(store.take_all([("u", 60, 1)]))
+        assert not allowed
+        assert retry_after > 0
+
+    def test_kv_with_expiry(self, store):
+        run(store.set("k", b"v", ex=60))
+        assert run(store.get("k")) == b"v"
+        run(store.set("old", b"v", ex=-1))
+        assert run(store.get("old")) is None
+
+    def test_usage_windows(self, store):
+        now = time.time()
+        minute = int(now // 60)
+        run(store.add_many([("alice", minute, 1, 10, 20), ("alice", minute - 5, 2, 5, 5)]))
+        windows = run(store.windows("alice", now))
+        assert windows["1m"] == {"requests": 1, "tokens_in": 10, "tokens_out": 20}
+        assert windows["1h"] == {"requests": 3, "tokens_in": 15, "tokens_out": 25}
+        assert windows["24h"]["requests"] == 3
+
+    def test_lock_wait_does_not_block_the_event_loop(self, store):
+        # Another worker holds the write lock for longer than the busy timeout
+        other = sqlite3.connect(store.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async def scenario():
+            task = asyncio.ensure_future(ticker())
+            try:
+                with pytest.raises(sqlite3.OperationalError):
+                    await store.take_all([("u", 60, 1)])
+            finally:
+                task.cancel()
+
+        try:
+            run(scenario())
+        finally:
+            other.execute("ROLLBACK")
+        # The one-second busy wait happened off the loop
+        assert ticks >= 20
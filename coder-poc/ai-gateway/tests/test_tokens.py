@@ -0,0 +1,89 @@
+"""Pre-flight token estimates and context-window fitting (tokens.TokenEstimator)."""
+
+import pytest
+
+from tokens import IMAGE_TOKENS, MESSAGE_OVERHEAD, ContextWindowExceeded, TokenEstimator
+
+MODEL = "claude-3-haiku-20240307"
+
+
+def turn(role, words):
+    return {"role": role, "content": "word " * words}
+
+
+CONVERSATION = [turn("user", 400), turn("assistant", 400), turn("user", 400), turn("assistant", 400),
+                turn("user", 40)]
+
+
+@pytest.fixture
+def trimming():
+    return TokenEstimator(overflow="trim", context_windows={"claude-3": 1500})
+
+
+class TestEstimate:
+    def test_ascii_uses_the_family_ratio(self):
+        estimator = TokenEstimator()
+        assert estimator.estimate(MODEL, [{"role": "user", "content": "x" * 350}]) == 100 + MESSAGE_OVERHEAD
+        # Other families fall back to three characters per token
+        assert estimator.estimate("gpt-4", [{"role": "user", "content": "x" * 300}]) == 100 + MESSAGE_OVERHEAD
+
+    def test_non_ascii_counts_about_a_token_each(self):
+        estimator = TokenEstimator()
+        assert estimator.estimate(MODEL, [{"role": "user", "content": "日本語テキスト"}]) >= 7 + MESSAGE_OVERHEAD
+
+    def test_blocks_system_and_images(self):
+        estimator = TokenEstimator()
+        message = {"role": "user", "content": [{"type": "text", "text": "x" * 35},
+                                               {"type": "image", "source": {}}]}
+        assert estimator.estimate(MODEL, [message], system="y" * 70) == 10 + IMAGE_TOKENS + MESSAGE_OVERHEAD + 20
+
+    def test_payload_adds_the_completion_budget(self):
+        estimator = TokenEstimator()
+        payload = {"model": MODEL, "max_tokens": 500, "messages": [{"role": "user", "content": "x" * 350}]}
+        assert estimator.estimate_payload(payload) == 100 + MESSAGE_OVERHEAD + 500
+
+    def test_context_window_by_family(self):
+        estimator = TokenEstimator(context_windows={"claude-3": 1500}, default_context_window=9000)
+        assert estimator.context_window(MODEL) == 1500
+        assert estimator.context_window("anthropic.claude-3-haiku-20240307-v1:0") == 1500
+        assert estimator.context_window("claude-2.1") == 9000
+
+
+class TestFit:
+    def test_fitting_prompt_is_unchanged(self):
+        estimator = TokenEstimator()
+        messages, prompt = estimator.fit(MODEL, CONVERSATION, 1024, "be brief")
+        assert messages is CONVERSATION
+        assert prompt == estimator.estimate(MODEL, CONVERSATION, "be brief")
+
+    def test_reject_mode_raises(self):
+        estimator = TokenEstimator(context_windows={"claude-3": 1500})
+        with pytest.raises(ContextWindowExceeded) as e:
+            estimator.fit(MODEL, CONVERSATION, 500)
+        assert e.value.context_window == 1500 and e.value.max_tokens == 500
+        assert estimator.stats["rejected"] == 1
+
+    def test_trim_keeps_the_system_prompt_and_newest_turn(self, trimming):
+        system = "s" * 700
+        messages, prompt = trimming.fit(MODEL, CONVERSATION, 500, system)
+        assert messages[-1] is CONVERSATION[-1]
+        assert messages == CONVERSATION[-len(messages):]
+        # The oldest turns went; what is left opens with a user turn
+        assert len(messages) < len(CONVERSATION) and messages[0]["role"] == "user"
+        assert prompt == trimming.estimate(MODEL, messages, system)
+        assert prompt + 500 <= 1500
+        assert trimming.stats["trimmed"] == 1
+
+    def test_trim_never_drops_the_newest_turn(self, trimming):
+        huge = [turn("user", 100), turn("user", 5000)]
+        with pytest.raises(ContextWindowExceeded):
+            trimming.fit(MODEL, huge, 500)
+        assert trimming.stats["rejected"] == 1
+
+    def test_system_prompt_alone_too_big(self, trimming):
+        with pytest.raises(ContextWindowExceeded):
+            trimming.fit(MODEL, [turn("user", 1)], 500, "s" * 6000)
+
+    def test_invalid_overflow_mode(self):
+        with pytest.raises(ValueError):
+            TokenEstimator(overflow="truncate")
@@ -0,0 +1,73 @@
+"""Batched usage writes while the connection pool is saturated (usage_db.UsageDB)."""
+
+import asyncio
+
+from usage_db import UsageDB
+
+
+class FakeStatement:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def executemany(self, rows):
+        self.rows.extend(rows)
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def prepare(self, sql):
+        return FakeStatement(self.rows)
+
+
+class SaturatedPool:
+    """Times out the first `busy` acquires, then hands out a connection"""
+
+    def __init__(self, busy):
+        self.busy = busy
+        self.rows = []
+        self.acquires = 0
+        self.released = 0
+
+    async def acquire(self, timeout=None):
+        self.acquires += 1
+        if self.acquires <= self.busy:
+            raise asyncio.TimeoutError()
+        return FakeConnection(self.rows)
+
+    async def release(self, conn):
+        self.released += 1
+
+
+def record(n):
+    return {"provider": "anthropic", "model": "claude", "workspace_id": f"ws-{n}", "request_id": str(n)}
+
+
+def write(busy, write_retries=3):
+    db = UsageDB(write_retries=write_retries, retry_backoff=0)
+    db.pool = SaturatedPool(busy)
+    asyncio.run(db._write([record(1), record(2)]))
+    return db
+
+
+class TestSaturatedPool:
+    def test_batch_is_retried_until_a_connection_frees_up(self):
+        db = write(busy=2)
+        assert [row[0] for row in db.pool.rows] == ["ws-1", "ws-2"]
+        assert db.stats["written"] == 2
+        assert db.stats["retried"] == 2
+        assert db.stats["failed"] == 0
+        assert db.pool.released == 1
+
+    def test_batch_is_counted_as_lost_after_its_retries(self):
+        db = write(busy=10, write_retries=3)
+        assert db.pool.acquires == 4
+        assert db.pool.rows == []
+        assert db.stats["failed"] == 2
+        assert db.stats["written"] == 0
+
+    def test_no_retries_configured(self):
+        db = write(busy=1, write_retries=0)
+        assert db.pool.acquires == 1
+        assert db.stats["failed"] == 2
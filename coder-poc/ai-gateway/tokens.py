@@ -0,0 +1,206 @@
+"""
+Local pre-flight token estimation (config: tokens).
+
+Prompts are sized before any upstream call so that requests which cannot
+fit the model's context window fail fast (or are trimmed to the most
+recent turns), and so TPM buckets are pre-charged with a realistic number
+instead of a flat characters/4 guess.
+
+The estimator is a calibrated heuristic, not a tokenizer: ASCII text is
+divided by the family's characters-per-token ratio and other characters
+count roughly one token each, which keeps it O(1) per string and errs on
+the high side. Family profiles are resolved once per model ID and cached.
+"""
+
+import re
+import json
+import math
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+from routing import canonical_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_WINDOW = 200000
+# Per-message framing (role markers, separators)
+MESSAGE_OVERHEAD = 4
+# Anthropic bills images by size; this is a typical ~1.1 megapixel image
+IMAGE_TOKENS = 1600
+
+_DATE_SUFFIX = re.compile(r"-\d{8}$")
+
+# Characters per token for ASCII text, by family prefix (first match wins)
+FAMILY_CHARS_PER_TOKEN = (
+    ("claude-3", 3.5),
+    ("claude", 3.2),
+)
+
+
+class ContextWindowExceeded(Exception):
+    """The prompt plus max_tokens cannot fit the model's context window"""
+
+    def __init__(self, model: str, prompt_tokens: int, max_tokens: int, context_window: int):
+        super().__init__(
+            f"{model}: ~{prompt_tokens} prompt tokens + {max_tokens} max_tokens "
+            f"exceeds the {context_window} token context window"
+        )
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.context_window = context_window
+
+
+class FamilyProfile:
+    __slots__ = ("family", "chars_per_token", "context_window")
+
+    def __init__(self, family: str, chars_per_token: float, context_window: int):
+        self.family = family
+        self.chars_per_token = chars_per_token
+        self.context_window = context_window
+
+
+class TokenEstimator:
+    """Per-family token estimates and context-window checks"""
+
+    def __init__(
+        self,
+        overflow: str = "reject",
+        context_windows: Optional[Dict[str, int]] = None,
+        default_context_window: int = DEFAULT_CONTEXT_WINDOW
+    ):
+        if overflow not in ("reject", "trim"):
+            raise ValueError(f"tokens.overflow must be 'reject' or 'trim', not {overflow!r}")
+        self.overflow = overflow
+        self.context_windows = dict(context_windows or {})
+        self.default_context_window = default_context_window
+        self._profiles: Dict[str, FamilyProfile] = {}
+        self.stats = {"rejected": 0, "trimmed": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "TokenEstimator":
+        tokens_config = config.get("tokens", {}) or {}
+        return cls(
+            overflow=tokens_config.get("overflow", "reject"),
+            context_windows=tokens_config.get("context_windows"),
+            default_context_window=int(tokens_config.get("default_context_window", DEFAULT_CONTEXT_WINDOW)),
+        )
+
+    def prepare_reload(self, config: Dict[str, Any]):
+        """Validate new token settings; the returned commit applies them and drops cached profiles"""
+        updated = TokenEstimator.from_config(config)
+
+        def commit():
+            self.overflow = updated.overflow
+            self.context_windows = updated.context_windows
+            self.default_context_window = updated.default_context_window
+            self._profiles = {}
+        return commit
+
+    def profile(self, model: str) -> FamilyProfile:
+        """Family profile for a model ID (cached)"""
+        profile = self._profiles.get(model)
+        if profile is None:
+            family = _DATE_SUFFIX.sub("", canonical_model(model or ""))
+            ratio = next((r for prefix, r in FAMILY_CHARS_PER_TOKEN if family.startswith(prefix)), 3.0)
+            window = next(
+                (w for prefix, w in self.context_windows.items() if family.startswith(prefix)),
+                self.default_context_window
+            )
+            profile = self._profiles[model] = FamilyProfile(family, ratio, int(window))
+        return profile
+
+    def context_window(self, model: str) -> int:
+        return self.profile(model).context_window
+
+    # -------------------------------------------------------------------------
+    # Estimation
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _text_tokens(text: str, chars_per_token: float) -> int:
+        if not text:
+            return 0
+        extra_bytes = len(text.encode("utf-8")) - len(text)
+        if not extra_bytes:
+            return math.ceil(len(text) / chars_per_token)
+        # Non-ASCII characters are 2-4 UTF-8 bytes and tokenize close to 1:1
+        non_ascii = max(1, extra_bytes // 2)
+        return math.ceil((len(text) - non_ascii) / chars_per_token) + non_ascii
+
+    def _content_tokens(self, content: Any, chars_per_token: float) -> int:
+        if isinstance(content, str):
+            return self._text_tokens(content, chars_per_token)
+        if isinstance(content, list):
+            return sum(self._content_tokens(block, chars_per_token) for block in content)
+        if isinstance(content, dict):
+            kind = content.get("type")
+            if kind in ("image", "document"):
+                return IMAGE_TOKENS
+            if kind == "text":
+                return self._text_tokens(content.get("text", ""), chars_per_token)
+            if kind == "tool_result":
+                return self._content_tokens(content.get("content", ""), chars_per_token)
+            if kind == "tool_use":
+                return self._text_tokens(json.dumps(content.get("input", {})), chars_per_token) + 8
+        if content is None:
+            return 0
+        return self._text_tokens(str(content), chars_per_token)
+
+    def message_tokens(self, model: str, message: Any) -> int:
+        ratio = self.profile(model).chars_per_token
+        if not isinstance(message, dict):
+            return MESSAGE_OVERHEAD + self._text_tokens(str(message), ratio)
+        return MESSAGE_OVERHEAD + self._content_tokens(message.get("content", ""), ratio)
+
+    def estimate(self, model: str, messages: List[Any], system: Any = None) -> int:
+        """Estimated prompt tokens for a messages request"""
+        tokens = sum(self.message_tokens(model, m) for m in messages)
+        if system:
+            tokens += self._content_tokens(system, self.profile(model).chars_per_token)
+        return tokens
+
+    def estimate_payload(self, payload: Dict[str, Any], model: Optional[str] = None) -> int:
+        """Prompt plus completion budget for a raw provider payload (for TPM pre-charge)"""
+        model = model or payload.get("model", "")
+        if "messages" in payload:
+            prompt = self.estimate(model, payload.get("messages") or [], payload.get("system"))
+        else:
+            prompt = self._text_tokens(str(payload.get("prompt", "")), self.profile(model).chars_per_token)
+        return prompt + int(payload.get("max_tokens") or payload.get("max_tokens_to_sample") or 0)
+
+    # -------------------------------------------------------------------------
+    # Context-window enforcement
+    # -------------------------------------------------------------------------
+
+    def fit(self, model: str, messages: List[Any], max_tokens: int, system: Any = None) -> Tuple[List[Any], int]:
+        """
+        Return (messages, prompt_tokens) that fit the context window with
+        max_tokens left for the completion. In trim mode the oldest turns
+        are dropped, keeping the conversation starting on a user turn.
+        Raises ContextWindowExceeded otherwise.
+        """
+        window = self.context_window(model)
+        system_tokens = self._content_tokens(system, self.profile(model).chars_per_token) if system else 0
+        sizes = [self.message_tokens(model, m) for m in messages]
+        prompt = system_tokens + sum(sizes)
+        if prompt + max_tokens <= window:
+            return messages, prompt
+
+        if self.overflow == "trim":
+            start = 0
+            while start < len(messages) - 1 and prompt + max_tokens > window:
+                prompt -= sizes[start]
+                start += 1
+            # A conversation must open with a user turn
+            while start < len(messages) - 1 and isinstance(messages[start], dict) \
+                    and messages[start].get("role") != "user":
+                prompt -= sizes[start]
+                start += 1
+            if prompt + max_tokens <= window:
+                self.stats["trimmed"] += 1
+                logger.info(f"Trimmed {start} oldest messages to fit {model} context ({prompt} tokens)")
+                return messages[start:], prompt
+
+        self.stats["rejected"] += 1
+        raise ContextWindowExceeded(model, system_tokens + sum(sizes), max_tokens, window)
@@ -0,0 +1,265 @@
+"""
+Async PostgreSQL writer for usage records (config: database).
+
+Requests never touch the database directly: log_request() drops a record
+on a bounded asyncio queue and a few writer tasks drain it in batches
+through an asyncpg pool with a prepared INSERT. When the pool is
+saturated a writer retries its batch with backoff (write_retries times)
+while the queue absorbs new records, so batches grow instead of requests
+waiting. Records are dropped and counted when the queue is full, or when
+their batch still finds no connection after its retries. Idle
+connections are recycled, a connection-level failure rebuilds the pool,
+and ping() backs the database check in /health.
+
+Without asyncpg, with the section disabled, or while the database is
+unreachable, records are discarded so the gateway still runs for local
+development.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List
+
+try:
+    import asyncpg
+except ImportError:  # Usage persistence is optional
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+INSERT_USAGE_SQL = """
+    INSERT INTO provisioning.ai_usage
+    (workspace_id, user_id, template_name, provider, model,
+     tokens_in, tokens_out, latency_ms, status_code, endpoint, request_id)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+"""
+
+
+def usage_row(record: Dict[str, Any]) -> tuple:
+    """INSERT parameters for a record built by log_request()"""
+    return (
+        record.get("workspace_id"),
+        record.get("user_id"),
+        record.get("template_name"),
+        record["provider"],
+        record["model"],
+        record.get("tokens_in", 0),
+        record.get("tokens_out", 0),
+        record.get("latency_ms"),
+        record.get("status_code"),
+        record.get("endpoint"),
+        record.get("request_id") or str(uuid.uuid4())[:8],
+    )
+
+
+class UsageDB:
+    """Bounded queue plus batched writers over an asyncpg pool"""
+
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        enabled: bool = True,
+        min_size: int = 1,
+        max_size: int = 5,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        acquire_timeout: float = 5.0,
+        command_timeout: float = 10.0,
+        retry_interval: float = 30.0,
+        write_retries: int = 3,
+        retry_backoff: float = 0.5,
+        connect_kwargs: Optional[Dict[str, Any]] = None
+    ):
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs or {}
+        self.enabled = enabled and asyncpg is not None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.acquire_timeout = acquire_timeout
+        self.command_timeout = command_timeout
+        self.retry_interval = retry_interval
+        self.write_retries = write_retries
+        self.retry_backoff = retry_backoff
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_queue)
+        self.pool = None
+        self._next_connect = 0.0
+        self._connect_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"written": 0, "batches": 0, "retried": 0, "dropped": 0, "failed": 0, "skipped": 0}
+
+        if enabled and asyncpg is None:
+            logger.warning("asyncpg not installed, usage records will not be persisted")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "UsageDB":
+        db_config = config.get("database", {}) or {}
+        return cls(
+            dsn=db_config.get("url") or os.getenv("AI_GATEWAY_DATABASE_URL"),
+            enabled=db_config.get("enabled", True),
+            min_size=int(db_config.get("min_connections", 1)),
+            max_size=int(db_config.get("max_connections", 5)),
+            max_queue=int(db_config.get("max_queue", 10000)),
+            batch_size=int(db_config.get("batch_size", 200)),
+            acquire_timeout=float(db_config.get("acquire_timeout_seconds", 5)),
+            command_timeout=float(db_config.get("command_timeout_seconds", 10)),
+            retry_interval=float(db_config.get("retry_interval_seconds", 30)),
+            write_retries=int(db_config.get("write_retries", 3)),
+            retry_backoff=float(db_config.get("retry_backoff_seconds", 0.5)),
+            connect_kwargs={
+                "host": os.getenv("DEVDB_HOST", "devdb"),
+                "port": int(os.getenv("DEVDB_PORT", "5432")),
+                "user": os.getenv("DEVDB_USER", "ai_gateway"),
+                "password": os.getenv("DEVDB_PASSWORD", "aigateway123"),
+                "database": os.getenv("DEVDB_NAME", "devdb"),
+            },
+        )
+
+    # -------------------------------------------------------------------------
+    # Producer side (request path)
+    # -------------------------------------------------------------------------
+
+    def submit(self, record: Dict[str, Any]):
+        """Queue a record without blocking the request; drop it if the queue is full"""
+        if not self.enabled:
+            return
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning("Usage queue full, dropping record")
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    # -------------------------------------------------------------------------
+    # Pool management
+    # -------------------------------------------------------------------------
+
+    async def _get_pool(self):
+        """The pool, (re)creating it at most once per retry_interval"""
+        if self.pool is not None or time.monotonic() < self._next_connect:
+            return self.pool
+        async with self._connect_lock:
+            if self.pool is None and time.monotonic() >= self._next_connect:
+                try:
+                    self.pool = await asyncpg.create_pool(
+                        dsn=self.dsn,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        command_timeout=self.command_timeout,
+                        max_inactive_connection_lifetime=300,
+                        timeout=self.acquire_timeout,
+                        **({} if self.dsn else self.connect_kwargs)
+                    )
+                    logger.info(f"Database pool created ({self.min_size}-{self.max_size} connections)")
+                except Exception as e:
+                    self._next_connect = time.monotonic() + self.retry_interval
+                    logger.warning(f"Database unavailable, usage records will be skipped: {e}")
+        return self.pool
+
+    async def _reset_pool(self):
+        pool, self.pool = self.pool, None
+        self._next_connect = time.monotonic() + self.retry_interval
+        if pool is not None:
+            pool.terminate()
+
+    async def ping(self) -> bool:
+        """Health check: a pooled connection answers SELECT 1"""
+        pool = await self._get_pool() if self.enabled else None
+        if pool is None:
+            return False
+        try:
+            async with pool.acquire(timeout=self.acquire_timeout) as conn:
+                return await conn.fetchval("SELECT 1") == 1
+        except Exception:
+            return False
+
+    # -------------------------------------------------------------------------
+    # Writers
+    # -------------------------------------------------------------------------
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self.queue.get()]
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _acquire(self, pool, batch: List[Dict[str, Any]]):
+        """
+        A pooled connection, retrying with backoff while the pool is saturated.
+        None once write_retries are used up (the batch is then lost).
+        """
+        for attempt in range(self.write_retries + 1):
+            try:
+                return await pool.acquire(timeout=self.acquire_timeout)
+            except asyncio.TimeoutError:
+                if attempt == self.write_retries:
+                    break
+                # Meanwhile the queue absorbs new records and later batches grow
+                self.stats["retried"] += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+        self.stats["failed"] += len(batch)
+        logger.warning(f"No database connection after {self.write_retries} retries, "
+                       f"lost {len(batch)} usage records")
+        return None
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        pool = await self._get_pool()
+        if pool is None:
+            self.stats["skipped"] += len(batch)
+            return
+        try:
+            conn = await self._acquire(pool, batch)
+            if conn is None:
+                return
+            try:
+                # Prepared statements are cached per connection by asyncpg.
+                # Not retried: a statement that timed out may have been applied.
+                statement = await conn.prepare(INSERT_USAGE_SQL)
+                await statement.executemany([usage_row(r) for r in batch])
+            finally:
+                await pool.release(conn)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+            self.stats["failed"] += len(batch)
+            logger.warning(f"Database connection failed, resetting pool: {e}")
+            await self._reset_pool()
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            logger.warning(f"Failed to persist usage batch: {e}")
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def start(self):
+        """Start one writer per pooled connection"""
+        if not self.enabled or self._tasks:
+            return
+        await self._get_pool()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.max_size)]
+
+    async def stop(self, flush_timeout: float = 5.0):
+        """Flush queued records (bounded by flush_timeout) and close the pool"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), flush_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutting down with {self.queue.qsize()} usage records unwritten")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
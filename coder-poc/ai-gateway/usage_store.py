@@ -0,0 +1,270 @@
+"""
+Bounded, windowed in-memory usage store.
+
+Each user gets two fixed-size ring buffers of (requests, tokens_in,
+tokens_out) counters: 60 per-minute slots for the last hour and 24
+per-hour slots for the last day. Counters are 32-bit, so a user costs
+about 1.7KB regardless of traffic, and the table is capped at max_users
+with least-recently-active eviction (50,000 users ~ 85MB).
+
+Rolling windows up to an hour are exact to the minute; longer windows are
+summed from hourly slots. The store is snapshotted to a JSON file
+periodically so counters survive restarts.
+
+With a shared backend (shared_state.py) the local rings still serve this
+worker, and per-minute deltas are flushed to the backend every
+flush_interval seconds so that windows() reflects every worker. The
+shared backend then replaces snapshots.
+"""
+
+import os
+import json
+import asyncio
+import time
+import base64
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MINUTE_SLOTS = 60
+HOUR_SLOTS = 24
+# Per slot: stamp (minute or hour index), requests, tokens_in, tokens_out
+FIELDS = 4
+SNAPSHOT_VERSION = 1
+
+
+class UserUsage:
+    """Ring buffers for one user"""
+
+    __slots__ = ("minutes", "hours", "last_seen")
+
+    def __init__(self):
+        self.minutes = array("I", bytes(4 * MINUTE_SLOTS * FIELDS))
+        self.hours = array("I", bytes(4 * HOUR_SLOTS * FIELDS))
+        self.last_seen = 0.0
+
+    @staticmethod
+    def _add(ring: array, slots: int, stamp: int, requests: int, tokens_in: int, tokens_out: int):
+        base = (stamp % slots) * FIELDS
+        if ring[base] > stamp:
+            return  # Older than the ring's horizon
+        if ring[base] != stamp:
+            ring[base:base + FIELDS] = array("I", (stamp, 0, 0, 0))
+        ring[base + 1] += requests
+        ring[base + 2] += tokens_in
+        ring[base + 3] += tokens_out
+
+    def add(self, now: float, requests: int, tokens_in: int, tokens_out: int):
+        minute = int(now // 60)
+        self._add(self.minutes, MINUTE_SLOTS, minute, requests, tokens_in, tokens_out)
+        self._add(self.hours, HOUR_SLOTS, minute // 60, requests, tokens_in, tokens_out)
+        self.last_seen = now
+
+    def window(self, now: float, seconds: int) -> Dict[str, int]:
+        """Sum counters over the trailing window"""
+        minute = int(now // 60)
+        if seconds <= MINUTE_SLOTS * 60:
+            ring, slots, current, span = self.minutes, MINUTE_SLOTS, minute, max(1, seconds // 60)
+        else:
+            ring, slots, current, span = self.hours, HOUR_SLOTS, minute // 60, min(HOUR_SLOTS, seconds // 3600)
+
+        totals = [0, 0, 0]
+        for i in range(slots):
+            base = i * FIELDS
+            if current - span < ring[base] <= current:
+                totals[0] += ring[base + 1]
+                totals[1] += ring[base + 2]
+                totals[2] += ring[base + 3]
+        return {"requests": totals[0], "tokens_in": totals[1], "tokens_out": totals[2]}
+
+
+class UsageStore:
+    """Per-user rolling usage counters with LRU eviction and snapshots"""
+
+    WINDOWS = {"1m": 60, "1h": 3600, "24h": 86400}
+
+    def __init__(
+        self,
+        max_users: int = 50000,
+        idle_seconds: int = 86400,
+        snapshot_path: Optional[str] = None,
+        snapshot_interval: int = 60,
+        backend=None,
+        flush_interval: float = 1.0
+    ):
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._users: "OrderedDict[str, UserUsage]" = OrderedDict()
+        self.stats = {"evicted": 0, "snapshots": 0, "snapshot_errors": 0, "flushes": 0, "flush_errors": 0}
+        # Shared backend (add_many / windows) and deltas not yet flushed to it
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, int], List[int]] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], backend=None) -> "UsageStore":
+        usage_config = config.get("usage", {}) or {}
+        return cls(
+            max_users=int(usage_config.get("max_users", 50000)),
+            idle_seconds=int(usage_config.get("idle_seconds", 86400)),
+            snapshot_path=usage_config.get("snapshot_path") or os.getenv("AI_GATEWAY_USAGE_SNAPSHOT"),
+            snapshot_interval=int(usage_config.get("snapshot_interval", 60)),
+            backend=backend,
+            flush_interval=float(usage_config.get("flush_interval", 1.0)),
+        )
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def record(self, user: str, tokens_in: int, tokens_out: int, requests: int = 1, now: Optional[float] = None):
+        now = now or time.time()
+        usage = self._users.get(user)
+        if usage is None:
+            usage = self._users[user] = UserUsage()
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.stats["evicted"] += 1
+        else:
+            self._users.move_to_end(user)
+        usage.add(now, requests, tokens_in, tokens_out)
+
+        if self.backend is not None:
+            pending = self._pending.get((user, int(now // 60)))
+            if pending is None:
+                self._pending[(user, int(now // 60))] = [requests, tokens_in, tokens_out]
+            else:
+                pending[0] += requests
+                pending[1] += tokens_in
+                pending[2] += tokens_out
+
+    def window(self, user: str, seconds: int, now: Optional[float] = None) -> Dict[str, int]:
+        usage = self._users.get(user)
+        if usage is None:
+            return {"requests": 0, "tokens_in": 0, "tokens_out": 0}
+        return usage.window(now or time.time(), seconds)
+
+    def windows(self, user: str, now: Optional[float] = None) -> Dict[str, Dict[str, int]]:
+        """Usage over the last 1m, 1h and 24h"""
+        now = now or time.time()
+        return {name: self.window(user, seconds, now) for name, seconds in self.WINDOWS.items()}
+
+    async def read_windows(self, user: str) -> Dict[str, Dict[str, int]]:
+        """Usage over the last 1m, 1h and 24h across all workers when a backend is shared"""
+        if self.backend is None:
+            return self.windows(user)
+        await self.flush()
+        try:
+            return await self.backend.windows(user, time.time())
+        except Exception as e:
+            logger.warning(f"Shared usage read failed, reporting this worker only: {e}")
+            return self.windows(user)
+
+    # -------------------------------------------------------------------------
+    # Shared backend
+    # -------------------------------------------------------------------------
+
+    async def flush(self):
+        """Push pending per-minute deltas to the shared backend"""
+        if self.backend is None or not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self.backend.add_many([(user, minute, *counts) for (user, minute), counts in pending.items()])
+            self.stats["flushes"] += 1
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            logger.warning(f"Failed to flush {len(pending)} usage deltas to shared backend: {e}")
+
+    async def run_flush(self):
+        """Background task: flush deltas to the shared backend on an interval"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop users with no activity inside idle_seconds (oldest are at the front)"""
+        cutoff = (now or time.time()) - self.idle_seconds
+        evicted = 0
+        while self._users:
+            user, usage = next(iter(self._users.items()))
+            if usage.last_seen >= cutoff:
+                break
+            del self._users[user]
+            evicted += 1
+        self.stats["evicted"] += evicted
+        return evicted
+
+    # -------------------------------------------------------------------------
+    # Snapshots
+    # -------------------------------------------------------------------------
+
+    def _items(self) -> List[Tuple[str, UserUsage]]:
+        return list(self._users.items())
+
+    def write_snapshot(self, items: List[Tuple[str, UserUsage]]):
+        """Serialize users to snapshot_path atomically (safe to run in a worker thread)"""
+        payload = {
+            "version": SNAPSHOT_VERSION,
+            "written_at": time.time(),
+            "users": {
+                user: [
+                    usage.last_seen,
+                    base64.b64encode(usage.minutes.tobytes()).decode("ascii"),
+                    base64.b64encode(usage.hours.tobytes()).decode("ascii"),
+                ]
+                for user, usage in items
+            },
+        }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load_snapshot(self) -> int:
+        """Warm the store from snapshot_path. Returns the number of users restored."""
+        if not self.snapshot_path or self.backend is not None or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path) as f:
+                payload = json.load(f)
+            if payload.get("version") != SNAPSHOT_VERSION:
+                logger.warning(f"Ignoring usage snapshot with version {payload.get('version')}")
+                return 0
+
+            # Restore oldest first so LRU order is preserved
+            entries = sorted(payload.get("users", {}).items(), key=lambda item: item[1][0])
+            for user, (last_seen, minutes, hours) in entries[-self.max_users:]:
+                usage = UserUsage()
+                usage.last_seen = last_seen
+                usage.minutes = array("I", base64.b64decode(minutes))
+                usage.hours = array("I", base64.b64decode(hours))
+                self._users[user] = usage
+            logger.info(f"Restored usage for {len(self._users)} users from {self.snapshot_path}")
+            return len(self._users)
+        except Exception as e:
+            logger.warning(f"Failed to load usage snapshot: {e}")
+            return 0
+
+    async def run_snapshots(self):
+        """Background task: evict idle users and snapshot on an interval"""
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.snapshot()
+
+    async def snapshot(self):
+        """Evict idle users, then write a snapshot off the event loop"""
+        self.evict_idle()
+        if not self.snapshot_path or self.backend is not None:
+            return
+        try:
+            await asyncio.to_thread(self.write_snapshot, self._items())
+            self.stats["snapshots"] += 1
+        except Exception as e:
+            self.stats["snapshot_errors"] += 1
+            logger.warning(f"Failed to write usage snapshot: {e}")
@@ -5,23 +5,51 @@ Isolates the LiteLLM master key from workspace containers.
 Workspaces authenticate with PROVISIONER_SECRET and receive
 scoped virtual keys with budget/rate-limit constraints.
 
+Existing keys are looked up in a local alias -> key index (warmed from
+LiteLLM /key/list, updated as keys are generated, reconciled in the
+background), so a restarting workspace is answered without a LiteLLM call.
+Entries not confirmed within KEY_INDEX_TTL are re-checked with /key/info,
+and reconciliation replaces or drops entries LiteLLM no longer lists, so a
+revoked or rotated key stops being handed out.
+Generation is single-flight per alias: concurrent requests for the same
+workspace share one /key/generate, within a worker and, through a SQLite
+claim table, across the workers of a host. Scopes with a pool_size keep
+that many unassigned keys ready: a new workspace claims one and only has to
+re-alias it (/key/update) instead of waiting for /key/generate.
+
+Runs under gunicorn (gunicorn.conf.py): several worker processes with a
+thread per in-flight request. Calls to LiteLLM and Coder go through pooled
+keep-alive sessions; LiteLLM calls are bounded per worker so a start storm
+queues here instead of overloading LiteLLM.
+
 Endpoints:
   POST /api/v1/keys/workspace     - Auto-provision workspace key (idempotent)
+  POST /api/v1/keys/workspace/bulk - Provision many workspace keys (NDJSON results)
   POST /api/v1/keys/self-service  - Generate personal key (Coder token auth)
   GET  /api/v1/keys/info          - Get key usage/budget info
   POST /api/v1/keys/reset-user    - Reset user spend (admin, provisioner-secret auth)
   GET  /api/v1/keys/list          - List all keys with limits (admin, provisioner-secret auth)
   GET  /health                    - Health check
+  GET  /metrics                   - Key pool metrics (Prometheus text format)
 """
 
+import hashlib
 import json
 import logging
 import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
 from datetime import datetime, timezone
 from functools import wraps
 
 import requests
-from flask import Flask, jsonify, request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, jsonify, request, stream_with_context
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -36,6 +64,40 @@ LITELLM_MASTER_KEY = os.environ.get("LITELLM_MASTER_KEY", "")
 PROVISIONER_SECRET = os.environ.get("PROVISIONER_SECRET", "")
 CODER_URL = os.environ.get("CODER_URL", "http://coder-server:7080")
 
+# Upstream connections and timeouts (seconds)
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3"))
+LITELLM_TIMEOUT = float(os.environ.get("LITELLM_TIMEOUT", "15"))
+CODER_TIMEOUT = float(os.environ.get("CODER_TIMEOUT", "10"))
+POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "32"))  # Keep-alive connections per upstream
+# Concurrent LiteLLM calls per worker; callers beyond this wait up to LITELLM_QUEUE_TIMEOUT
+LITELLM_MAX_CONCURRENCY = int(os.environ.get("LITELLM_MAX_CONCURRENCY", "16"))
+LITELLM_QUEUE_TIMEOUT = float(os.environ.get("LITELLM_QUEUE_TIMEOUT", "10"))
+
+# Local alias -> key index; KEY_INDEX_PATH persists it across restarts (holds keys: keep it private)
+KEY_INDEX_ENABLED = os.environ.get("KEY_INDEX_ENABLED", "true").lower() == "true"
+KEY_INDEX_PATH = os.environ.get("KEY_INDEX_PATH", "")
+KEY_INDEX_RECONCILE_INTERVAL = float(os.environ.get("KEY_INDEX_RECONCILE_INTERVAL", "300"))
+# Entries not confirmed by reconciliation or /key/info for this long are looked up again
+KEY_INDEX_TTL = float(os.environ.get("KEY_INDEX_TTL", "300"))
+
+# Claim table and warm key pool shared by the workers of one host
+# ("" = single-worker dedup only, and no warm pool)
+_SHM = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+KEY_LOCK_DB = os.environ.get("KEY_LOCK_DB", os.path.join(_SHM, "key-provisioner-locks.db"))
+# Claims older than this without a result are presumed abandoned by a crashed worker
+GENERATION_TIMEOUT = float(os.environ.get("GENERATION_TIMEOUT", "30"))
+
+# Bulk provisioning: descriptors per request and keys generated concurrently
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", "1000"))
+BULK_PARALLELISM = int(os.environ.get("BULK_PARALLELISM", "8"))
+
+# Warm key pool (sizes per scope in SCOPE_DEFAULTS)
+KEY_POOL_REFILL_INTERVAL = float(os.environ.get("KEY_POOL_REFILL_INTERVAL", "5"))
+KEY_POOL_PARALLELISM = int(os.environ.get("KEY_POOL_PARALLELISM", "4"))
+# Names this host's pool in LiteLLM: one per KEY_LOCK_DB, and stable across
+# container recreation so keys of a lost pool file are still recognised as ours
+KEY_POOL_OWNER = os.environ.get("KEY_POOL_OWNER") or socket.gethostname()
+
 # Scope defaults — configurable via environment variables
 SCOPE_DEFAULTS = {
     "workspace": {
@@ -45,6 +107,7 @@ SCOPE_DEFAULTS = {
         "budget_duration": os.environ.get("WORKSPACE_BUDGET_DURATION", "1d"),
         "max_parallel_requests": int(os.environ.get("WORKSPACE_MAX_PARALLEL", "5")),
         "duration_days": 30,
+        "pool_size": int(os.environ.get("WORKSPACE_POOL_SIZE", "10")),
     },
     "user": {
         "budget": float(os.environ.get("USER_BUDGET", "20.0")),
@@ -53,6 +116,7 @@ SCOPE_DEFAULTS = {
         "budget_duration": os.environ.get("USER_BUDGET_DURATION", "1d"),
         "max_parallel_requests": int(os.environ.get("USER_MAX_PARALLEL", "10")),
         "duration_days": 90,
+        "pool_size": int(os.environ.get("USER_POOL_SIZE", "0")),
     },
     "ci": {
         "budget": float(os.environ.get("CI_BUDGET", "5.0")),
@@ -61,16 +125,17 @@ SCOPE_DEFAULTS = {
         "budget_duration": os.environ.get("CI_BUDGET_DURATION", "1d"),
         "max_parallel_requests": int(os.environ.get("CI_MAX_PARALLEL", "3")),
         "duration_days": 365,
+        "pool_size": int(os.environ.get("CI_POOL_SIZE", "0")),
     },
     "agent:review": {
         "budget": 15.0, "rpm": 40, "tpm": 100000,
         "budget_duration": "1d", "max_parallel_requests": 5,
-        "duration_days": 365,
+        "duration_days": 365, "pool_size": 0,
     },
     "agent:write": {
         "budget": 30.0, "rpm": 60, "tpm": 200000,
         "budget_duration": "1d", "max_parallel_requests": 10,
-        "duration_days": 365,
+        "duration_days": 365, "pool_size": 0,
     },
 }
 
@@ -103,6 +168,61 @@ def require_litellm_key(f):
     return decorated
 
 
+# ---------------------------------------------------------------------------
+# Upstream sessions
+# ---------------------------------------------------------------------------
+
+
+def _session(pool_size):
+    """Keep-alive session with a bounded connection pool (shared by all threads)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+litellm_session = _session(POOL_SIZE)
+coder_session = _session(POOL_SIZE)
+coder_session.verify = False
+
+_litellm_slots = threading.BoundedSemaphore(LITELLM_MAX_CONCURRENCY)
+
+
+class LiteLLMBusy(Exception):
+    """No LiteLLM call slot became free within LITELLM_QUEUE_TIMEOUT."""
+
+
+@app.errorhandler(LiteLLMBusy)
+def litellm_busy(e):
+    return jsonify({"error": "key provisioner is busy, retry shortly"}), 503, {"Retry-After": "2"}
+
+
+class KeyLookupFailed(Exception):
+    """LiteLLM could not say whether a key alias exists (error or unexpected answer)."""
+
+
+@app.errorhandler(KeyLookupFailed)
+def key_lookup_failed(e):
+    return jsonify({"error": f"could not check for an existing key: {e}"}), 502
+
+
+def _litellm(method, path, headers=None, timeout=None, **kwargs):
+    """Call LiteLLM through the pooled session, bounded by LITELLM_MAX_CONCURRENCY."""
+    if not _litellm_slots.acquire(timeout=LITELLM_QUEUE_TIMEOUT):
+        raise LiteLLMBusy()
+    try:
+        return litellm_session.request(
+            method,
+            f"{LITELLM_URL}{path}",
+            headers=headers or _litellm_headers(),
+            timeout=(CONNECT_TIMEOUT, timeout or LITELLM_TIMEOUT),
+            **kwargs,
+        )
+    finally:
+        _litellm_slots.release()
+
+
 # ---------------------------------------------------------------------------
 # LiteLLM helpers
 # ---------------------------------------------------------------------------
@@ -116,21 +236,31 @@ def _litellm_headers():
 
 
 def _find_existing_key(alias):
-    """Check if a key with the given alias already exists. Return key token or None."""
+    """
+    Check if a key with the given alias already exists. Return key token, or
+    None only when LiteLLM confirms there is none (404 or an empty answer);
+    raise KeyLookupFailed when it could not tell, so callers do not generate
+    a duplicate.
+    """
+    existing = key_index.get(alias)
+    if existing:
+        return existing
     try:
-        resp = requests.post(
-            f"{LITELLM_URL}/key/info",
-            headers=_litellm_headers(),
-            json={"key_alias": alias},
-            timeout=10,
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            info = data.get("info", data.get("key_info", {}))
-            if isinstance(info, dict) and info.get("token"):
-                return info["token"]
+        resp = _litellm("POST", "/key/info", json={"key_alias": alias}, timeout=10)
+        data = resp.json() if resp.status_code == 200 else {}
+    except LiteLLMBusy:
+        raise
     except Exception as e:
         log.warning("Error checking existing key alias=%s: %s", alias, e)
+        raise KeyLookupFailed(str(e)) from e
+    if resp.status_code not in (200, 404):
+        log.warning("LiteLLM /key/info failed alias=%s: %s %s", alias, resp.status_code, resp.text)
+        raise KeyLookupFailed(f"LiteLLM /key/info returned {resp.status_code}")
+    info = data.get("info", data.get("key_info", {})) if isinstance(data, dict) else None
+    if isinstance(info, dict) and info.get("token"):
+        key_index.put(alias, info["token"])
+        return info["token"]
+    key_index.invalidate(alias)
     return None
 
 
@@ -150,19 +280,666 @@ def _generate_key(alias, user_id, budget, rpm, metadata, models=None,
     if models:
         payload["models"] = models
 
-    resp = requests.post(
-        f"{LITELLM_URL}/key/generate",
-        headers=_litellm_headers(),
-        json=payload,
-        timeout=15,
-    )
+    resp = _litellm("POST", "/key/generate", json=payload)
     if resp.status_code not in (200, 201):
         log.error("LiteLLM /key/generate failed: %s %s", resp.status_code, resp.text)
         return None, resp.text
     data = resp.json()
+    # Pool keys are indexed under their workspace alias once claimed
+    if data.get("key") and not alias.startswith("pool-"):
+        key_index.put(alias, data["key"])
     return data.get("key"), None
 
 
+def _list_keys(page_size=100):
+    """Every key in LiteLLM (full objects), following /key/list pagination."""
+    keys, page = [], 1
+    while True:
+        resp = _litellm("GET", "/key/list", params={"return_full_object": "true", "page": page, "size": page_size})
+        resp.raise_for_status()
+        data = resp.json()
+        batch = data.get("keys", [])
+        keys.extend(k for k in batch if isinstance(k, dict))
+        if not batch or page >= int(data.get("total_pages") or 1):
+            return keys
+        page += 1
+
+
+# ---------------------------------------------------------------------------
+# Key index
+# ---------------------------------------------------------------------------
+
+
+class KeyIndex:
+    """
+    In-memory alias -> key map in front of LiteLLM /key/info.
+
+    Entries come from keys this worker generates or looks up and from
+    periodic /key/list reconciliation, which also replaces keys rotated and
+    drops aliases deleted elsewhere (e.g. revoked from Platform Admin).
+    Entries not confirmed for `ttl` seconds are misses, so callers check
+    them again with /key/info.
+    """
+
+    def __init__(self, enabled=True, path="", ttl=300.0):
+        self.enabled = enabled
+        self.path = path
+        self.ttl = ttl
+        self._entries = {}  # alias -> (key, confirmed_at)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.warm = False
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "invalidated": 0, "replaced": 0,
+                      "reconciles": 0, "reconcile_errors": 0}
+
+    def get(self, alias):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(alias)
+            if entry and time.time() - entry[1] >= self.ttl:
+                self.stats["stale"] += 1
+                return None
+            self.stats["hits" if entry else "misses"] += 1
+        return entry[0] if entry else None
+
+    def put(self, alias, key):
+        if not self.enabled or not alias or not key:
+            return
+        with self._lock:
+            self._entries[alias] = (key, time.time())
+            self._dirty = True
+
+    def invalidate(self, alias):
+        """Forget an alias LiteLLM reported missing."""
+        with self._lock:
+            if self._entries.pop(alias, None) is not None:
+                self.stats["invalidated"] += 1
+                self._dirty = True
+
+    @staticmethod
+    def _same_key(key, token):
+        # /key/list may return the stored token (sha256 of the key) rather than the key
+        return key == token or hashlib.sha256(key.encode()).hexdigest() == token
+
+    def reconcile(self, listed, started):
+        """
+        Align with a full /key/list taken at `started`. Entries matching the
+        listed token keep their value (a key already handed out is returned
+        unchanged) and count as confirmed; others are replaced by the listed
+        token, and aliases LiteLLM no longer has are dropped. Entries added
+        since `started` are kept as they are.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            merged = {}
+            for alias, token in listed.items():
+                entry = self._entries.get(alias)
+                if entry and entry[1] >= started:
+                    merged[alias] = entry
+                elif entry and self._same_key(entry[0], token):
+                    merged[alias] = (entry[0], started)
+                else:
+                    if entry:
+                        self.stats["replaced"] += 1
+                    merged[alias] = (token, started)
+            for alias, entry in self._entries.items():
+                if alias not in merged and entry[1] >= started:
+                    merged[alias] = entry
+            self._entries = merged
+            self._dirty = True
+            self.warm = True
+            self.stats["reconciles"] += 1
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable key index %s: %s", self.path, e)
+            return
+        with self._lock:
+            for alias, key in stored.items():
+                self._entries.setdefault(alias, (key, 0.0))
+        log.info("Loaded %d keys from %s", len(stored), self.path)
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            snapshot = {alias: entry[0] for alias, entry in self._entries.items()}
+            self._dirty = False
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("Could not persist key index to %s: %s", self.path, e)
+            self._dirty = True
+
+    def status(self):
+        with self._lock:
+            return {"enabled": self.enabled, "warm": self.warm, "aliases": len(self._entries), **self.stats}
+
+
+key_index = KeyIndex(enabled=KEY_INDEX_ENABLED, path=KEY_INDEX_PATH, ttl=KEY_INDEX_TTL)
+
+
+# ---------------------------------------------------------------------------
+# Single-flight generation
+# ---------------------------------------------------------------------------
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution (threads of one worker)."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        """Run fn once per key at a time. Returns (result, leader)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            self.stats["leaders" if leader else "coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = fn()
+            return flight.result, True
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+class HostDB:
+    """Per-thread connections to the SQLite file shared by the workers of this host."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS claims (alias TEXT PRIMARY KEY, owner INTEGER, started_at REAL, done_at REAL);
+        CREATE TABLE IF NOT EXISTS pool (alias TEXT PRIMARY KEY, scope TEXT, key TEXT, created_at REAL);
+        CREATE INDEX IF NOT EXISTS pool_scope ON pool (scope, created_at);
+        CREATE TABLE IF NOT EXISTS pool_taken (alias TEXT PRIMARY KEY, taken_at REAL);
+        CREATE TABLE IF NOT EXISTS pool_refill (scope TEXT PRIMARY KEY, owner INTEGER, until REAL);
+        CREATE TABLE IF NOT EXISTS pool_stats (scope TEXT, name TEXT, value REAL, PRIMARY KEY (scope, name));
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path):
+        # Without a shared file each worker process keeps its own (holds pool keys: private)
+        self.path = path or os.path.join(tempfile.gettempdir(), f"key-provisioner-{os.getpid()}.db")
+        self._local = threading.local()
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def meta(self, name, default):
+        """A value fixed when first asked for (by any worker) for the life of this file."""
+        conn = self.conn()
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)", (name, default))
+        return conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
+
+
+class GenerationClaims:
+    """
+    Lock table across worker processes: a row per alias being (or recently)
+    generated. The worker whose INSERT succeeds generates; the others poll
+    until the row is marked done (then look the key up) or deleted (the
+    generation failed and they may claim it themselves).
+    """
+
+    KEEP_DONE = 600  # Seconds finished claims are kept before housekeeping
+
+    def __init__(self, db, enabled=True, timeout=30.0):
+        self.db = db
+        self.enabled = enabled
+        self.timeout = timeout
+        self._last_cleanup = 0.0
+        self.stats = {"claimed": 0, "waited": 0, "taken_over": 0}
+
+    def claim(self, alias, checked_at):
+        """
+        True if this worker should generate. An existing row is taken over when
+        its owner presumably crashed, or when it finished before checked_at (the
+        caller has since had LiteLLM confirm the key is missing, so it was
+        deleted; a failed lookup raises instead of reaching here).
+        """
+        if not self.enabled:
+            return True
+        now = time.time()
+        conn = self.db.conn()
+        try:
+            conn.execute("INSERT INTO claims (alias, owner, started_at) VALUES (?, ?, ?)", (alias, os.getpid(), now))
+            self.stats["claimed"] += 1
+            return True
+        except sqlite3.IntegrityError:
+            cur = conn.execute(
+                "UPDATE claims SET owner = ?, started_at = ?, done_at = NULL WHERE alias = ? AND "
+                "((done_at IS NULL AND started_at < ?) OR done_at < ?)",
+                (os.getpid(), now, alias, now - self.timeout, checked_at),
+            )
+            if cur.rowcount == 1:
+                self.stats["taken_over"] += 1
+                return True
+            return False
+
+    def finish(self, alias, ok):
+        if not self.enabled:
+            return
+        conn = self.db.conn()
+        now = time.time()
+        if ok:
+            conn.execute("UPDATE claims SET done_at = ? WHERE alias = ?", (now, alias))
+        else:
+            conn.execute("DELETE FROM claims WHERE alias = ?", (alias,))
+        if now - self._last_cleanup > 60:
+            self._last_cleanup = now
+            conn.execute("DELETE FROM claims WHERE done_at < ?", (now - self.KEEP_DONE,))
+
+    def wait(self, alias):
+        """Poll another worker's claim: "done", "released" or "timeout"."""
+        self.stats["waited"] += 1
+        deadline = time.monotonic() + self.timeout
+        conn = self.db.conn()
+        while time.monotonic() < deadline:
+            row = conn.execute("SELECT done_at FROM claims WHERE alias = ?", (alias,)).fetchone()
+            if row is None:
+                return "released"
+            if row[0] is not None:
+                return "done"
+            time.sleep(0.05)
+        return "timeout"
+
+
+host_db = HostDB(KEY_LOCK_DB)
+generation_flights = SingleFlight()
+generation_claims = GenerationClaims(host_db, enabled=bool(KEY_LOCK_DB), timeout=GENERATION_TIMEOUT)
+
+
+def _claim_and_generate(alias, generate, checked_at):
+    """Generate under the cross-worker claim, or pick up another worker's result."""
+    for _ in range(3):
+        if generation_claims.claim(alias, checked_at):
+            key, err = None, "key generation failed"
+            try:
+                key, err = generate()
+            finally:
+                generation_claims.finish(alias, ok=bool(key))
+            return key, err, False
+        outcome = generation_claims.wait(alias)
+        if outcome == "timeout":
+            break
+        checked_at = time.time()
+        if outcome == "done":
+            # Raises KeyLookupFailed unless LiteLLM answers, so a lookup error never leads to a takeover
+            existing = _find_existing_key(alias)
+            if existing:
+                return existing, None, True
+    return None, "timed out waiting for another worker to generate the key", False
+
+
+def _get_or_generate(alias, generate):
+    """
+    Existing key for alias, else generate() it once however many callers ask
+    at the same moment. Returns (key, error, reused).
+    """
+    checked_at = time.time()
+    existing = _find_existing_key(alias)
+    if existing:
+        return existing, None, True
+    (key, err, reused), leader = generation_flights.do(
+        alias, lambda: _claim_and_generate(alias, generate, checked_at))
+    return key, err, reused or not leader
+
+
+def _alias_keys():
+    """alias -> key for every aliased key in LiteLLM."""
+    return {k["key_alias"]: k["token"] for k in _list_keys() if k.get("key_alias") and k.get("token")}
+
+
+def _reconcile_key_index():
+    started = time.time()
+    try:
+        listed = _alias_keys()
+    except Exception as e:
+        key_index.stats["reconcile_errors"] += 1
+        log.warning("Key index reconciliation failed: %s", e)
+        return
+    key_index.reconcile(listed, started)
+    key_index.save()
+
+
+def _key_index_loop():
+    """Warm the index at startup, then reconcile it with LiteLLM periodically."""
+    key_index.load()
+    while True:
+        _reconcile_key_index()
+        time.sleep(KEY_INDEX_RECONCILE_INTERVAL if key_index.warm else min(30, KEY_INDEX_RECONCILE_INTERVAL))
+
+
+# ---------------------------------------------------------------------------
+# Warm key pool
+# ---------------------------------------------------------------------------
+
+# Upper bounds (seconds) of the key assignment latency histogram
+ASSIGN_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class KeyPool:
+    """
+    Pre-generated, unassigned keys per scope, shared by the workers of this
+    host through HostDB. Keys carry the scope's limits and a pool-* alias
+    until a workspace or user claims one. The refill loop keeps each scope
+    at its pool_size, one worker at a time (a lease in pool_refill). Counters
+    live in the same database so every worker reports host-wide figures.
+
+    Pool keys record their owner (KEY_POOL_OWNER) and the instance id of the
+    pool file that created them, so orphan collection only deletes keys this
+    file lost track of, or keys of this owner from an earlier file.
+    """
+
+    ORPHAN_AGE = 600  # Seconds before an unlisted pool key of this file is deleted
+
+    def __init__(self, db, sizes, owner):
+        self.db = db
+        self.sizes = {scope: size for scope, size in sizes.items() if size > 0}
+        self.owner = owner
+        self.prefix = f"pool-{owner}-"
+        self.wanted = threading.Event()
+
+    def instance(self):
+        """(id, created_at) of the pool file; a lost file comes back with a new id."""
+        return self.db.meta("pool_instance", uuid.uuid4().hex), float(self.db.meta("pool_since", repr(time.time())))
+
+    def depth(self):
+        rows = self.db.conn().execute("SELECT scope, COUNT(*) FROM pool GROUP BY scope").fetchall()
+        counts = dict(rows)
+        return {scope: counts.get(scope, 0) for scope in self.sizes}
+
+    def take(self, scope):
+        """Claim the oldest pooled key of a scope: (alias, key), or None when the pool is empty."""
+        if scope not in self.sizes:
+            return None
+        conn = self.db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT alias, key FROM pool WHERE scope = ? ORDER BY created_at LIMIT 1",
+                               (scope,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM pool WHERE alias = ?", (row[0],))
+                # Its /key/update is in flight: not an orphan yet (collect_orphans)
+                conn.execute("INSERT OR REPLACE INTO pool_taken (alias, taken_at) VALUES (?, ?)",
+                             (row[0], time.time()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.wanted.set()
+        return tuple(row) if row else None
+
+    def add(self, scope, alias, key):
+        """Pool a key (new, or handed back unchanged after a failed assignment)."""
+        self.db.conn().execute("INSERT INTO pool (alias, scope, key, created_at) VALUES (?, ?, ?, ?)",
+                               (alias, scope, key, time.time()))
+
+    def bump(self, scope, counts):
+        self.db.conn().executemany(
+            "INSERT INTO pool_stats (scope, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (scope, name) DO UPDATE SET value = value + excluded.value",
+            [(scope, name, value) for name, value in counts.items()],
+        )
+
+    def observe(self, scope, source, seconds):
+        """Record one key assignment: source is pool, generated, pool_fallback or error."""
+        counts = {f"claims:{source}": 1, f"seconds_sum:{source}": seconds, f"seconds_count:{source}": 1}
+        for le in ASSIGN_BUCKETS:
+            if seconds <= le:
+                counts[f"seconds_bucket:{source}:{le}"] = 1
+        self.bump(scope, counts)
+
+    def stats(self):
+        return self.db.conn().execute("SELECT scope, name, value FROM pool_stats").fetchall()
+
+    def _lease(self, name, seconds):
+        """Exclusive right to refill (or collect) for a while, across workers."""
+        now = time.time()
+        conn = self.db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, until FROM pool_refill WHERE scope = ?", (name,)).fetchone()
+            held = row is not None and row[1] > now and row[0] != os.getpid()
+            if not held:
+                conn.execute("INSERT OR REPLACE INTO pool_refill (scope, owner, until) VALUES (?, ?, ?)",
+                             (name, os.getpid(), now + seconds))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return not held
+
+    def _new_key(self, scope):
+        defaults = SCOPE_DEFAULTS[scope]
+        alias = f"{self.prefix}{scope.replace(':', '-')}-{uuid.uuid4().hex[:12]}"
+        key, err = _generate_key(
+            alias=alias,
+            user_id=None,
+            budget=defaults["budget"],
+            rpm=defaults["rpm"],
+            metadata={
+                "key_type": "pool",
+                "pool_scope": scope,
+                "pool_owner": self.owner,
+                "pool_instance": self.instance()[0],
+                "created_by": "key-provisioner",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            },
+            tpm=defaults.get("tpm"),
+            budget_duration=defaults.get("budget_duration"),
+            max_parallel_requests=defaults.get("max_parallel_requests"),
+        )
+        if not key:
+            raise RuntimeError(err)
+        self.add(scope, alias, key)
+
+    def refill(self):
+        """Top every scope up to its pool_size (if no other worker is doing so)."""
+        for scope, size in self.sizes.items():
+            missing = size - self.depth()[scope]
+            if missing <= 0 or not self._lease(f"refill:{scope}", GENERATION_TIMEOUT * 2):
+                continue
+            created = errors = 0
+            try:
+                with ThreadPoolExecutor(max_workers=KEY_POOL_PARALLELISM) as pool:
+                    for future in [pool.submit(self._new_key, scope) for _ in range(missing)]:
+                        try:
+                            future.result()
+                            created += 1
+                        except Exception as e:
+                            errors += 1
+                            log.warning("Could not create pool key for scope=%s: %s", scope, e)
+            finally:
+                self.bump(scope, {"refilled": created, "refill_errors": errors})
+                self.db.conn().execute("DELETE FROM pool_refill WHERE scope = ? AND owner = ?",
+                                       (f"refill:{scope}", os.getpid()))
+            log.info("Refilled key pool scope=%s: %d created, %d failed", scope, created, errors)
+
+    def collect_orphans(self):
+        """
+        Reconcile the pool with LiteLLM /key/list, both ways.
+
+        Pool rows whose key LiteLLM no longer lists (revoked, LiteLLM reset)
+        are dropped so refill() replaces them. Unassigned pool keys of this
+        owner that the pool does not list are deleted: ones this file lost
+        track of (an assignment whose update timed out unapplied) once
+        ORPHAN_AGE old, and ones created before this file existed (their file
+        was lost with the host or container). Keys taken in the last
+        GENERATION_TIMEOUT seconds may still be mid-assignment and are left
+        alone; keys of other owners are never touched.
+        """
+        if not self._lease("collect", KEY_INDEX_RECONCILE_INTERVAL):
+            return
+        instance, since = self.instance()
+        started = time.time()
+        keys = _list_keys()
+        listed = {k.get("key_alias") or "" for k in keys}
+        # Read after the listing: a key taken during it is in pool_taken, not pooled
+        conn = self.db.conn()
+        conn.execute("DELETE FROM pool_taken WHERE taken_at < ?", (time.time() - GENERATION_TIMEOUT,))
+        taken = {row[0] for row in conn.execute("SELECT alias FROM pool_taken")}
+        pooled = dict(conn.execute("SELECT alias, created_at FROM pool").fetchall())
+        dead = [alias for alias, created in pooled.items() if alias not in listed and created < started]
+        if dead:
+            conn.executemany("DELETE FROM pool WHERE alias = ?", [(alias,) for alias in dead])
+            self.wanted.set()
+            log.warning("Dropped %d pooled keys LiteLLM no longer lists", len(dead))
+        cutoff = time.time() - self.ORPHAN_AGE
+        orphans, foreign = [], 0
+        for k in keys:
+            alias = k.get("key_alias") or ""
+            metadata = k.get("metadata") if isinstance(k.get("metadata"), dict) else {}
+            # Assigned keys have their own alias and metadata by now
+            if (not alias.startswith("pool-") or metadata.get("pool_owner") != self.owner
+                    or alias in pooled or alias in taken):
+                continue
+            try:
+                created = datetime.fromisoformat(metadata.get("created_at", "")).timestamp()
+            except ValueError:
+                continue
+            if metadata.get("pool_instance") == instance:
+                if created < cutoff:
+                    orphans.append(alias)
+            elif created < since:
+                orphans.append(alias)
+            else:
+                foreign += 1
+        if foreign:
+            log.warning("%d pool keys of owner %s come from another live pool file; "
+                        "give each KEY_LOCK_DB its own KEY_POOL_OWNER", foreign, self.owner)
+        if orphans:
+            resp = _litellm("POST", "/key/delete", json={"key_aliases": orphans})
+            log.info("Deleted %d orphaned pool keys: %s", len(orphans), resp.status_code)
+
+POOL_SIZES = {scope: d.get("pool_size", 0) for scope, d in SCOPE_DEFAULTS.items()}
+# Without a shared KEY_LOCK_DB each worker would keep (and collect) a pool of its own
+key_pool = KeyPool(host_db, POOL_SIZES if KEY_LOCK_DB else {}, KEY_POOL_OWNER)
+
+
+def _key_pool_loop():
+    """Refill pools when a key is claimed (or every KEY_POOL_REFILL_INTERVAL)."""
+    last_collect = 0.0
+    while True:
+        try:
+            if time.time() - last_collect > KEY_INDEX_RECONCILE_INTERVAL:
+                last_collect = time.time()
+                key_pool.collect_orphans()
+            key_pool.refill()
+        except Exception as e:
+            log.warning("Key pool maintenance failed: %s", e)
+        key_pool.wanted.wait(KEY_POOL_REFILL_INTERVAL)
+        key_pool.wanted.clear()
+
+
+def _assign_pooled(scope, alias, user_id, metadata, claimed):
+    """
+    Give a claimed pool key the alias, owner and metadata (one /key/update).
+    Returns the key now under alias, or None when the caller should generate.
+
+    A pooled key whose update failed on LiteLLM's side (5xx, or no LiteLLM
+    slot) is unchanged and goes back to the pool. A 4xx means the key itself
+    was refused (revoked, deleted, LiteLLM reset): it is dropped, and if it
+    still exists it is collected as an orphan. After an update that
+    errored or timed out, /key/info decides: the update may have been
+    applied, and generating would then leave the alias with two keys.
+    """
+    pool_alias, pooled = claimed
+    try:
+        resp = _litellm("POST", "/key/update", json={
+            "key": pooled, "key_alias": alias, "user_id": user_id, "metadata": metadata,
+        })
+    except LiteLLMBusy:
+        key_pool.add(scope, pool_alias, pooled)
+        raise
+    except Exception as e:
+        log.error("Could not assign pooled key to alias=%s: %s", alias, e)
+        resp = None
+    if resp is not None and resp.status_code in (200, 201):
+        key_index.put(alias, pooled)
+        return pooled
+    if resp is not None:
+        log.error("LiteLLM /key/update failed for pooled key: %s %s", resp.status_code, resp.text)
+        if resp.status_code >= 500:
+            key_pool.add(scope, pool_alias, pooled)
+        return None
+    # Raises KeyLookupFailed if LiteLLM cannot tell either; the caller retries later
+    existing = _find_existing_key(alias)
+    if existing and KeyIndex._same_key(pooled, existing):
+        key_index.put(alias, pooled)
+        return pooled
+    # Not applied: the key keeps its pool alias and is collected as an orphan
+    return existing
+
+
+def _assign_key(scope, alias, user_id, metadata, generate):
+    """
+    generate() for _get_or_generate with the warm pool in front: a pooled key
+    when one can be assigned, else a new one. Records exactly one outcome per
+    call: pool, generated, pool_fallback (a pooled key was claimed but could
+    not be assigned) or error.
+    """
+    started = time.monotonic()
+    source = "error"
+    try:
+        claimed = key_pool.take(scope)
+        if claimed:
+            key = _assign_pooled(scope, alias, user_id, metadata, claimed)
+            if key:
+                source = "pool" if key == claimed[1] else "pool_fallback"
+                return key, None
+        key, err = generate()
+        if key:
+            source = "pool_fallback" if claimed else "generated"
+        return key, err
+    finally:
+        key_pool.observe(scope, source, time.monotonic() - started)
+
+
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
@@ -171,14 +948,19 @@ def _generate_key(alias, user_id, budget, rpm, metadata, models=None,
 @app.route("/health", methods=["GET"])
 def health():
     """Liveness check — confirms the Flask app is running."""
-    return jsonify({"status": "ok"}), 200
+    return jsonify({
+        "status": "ok",
+        "key_index": key_index.status(),
+        "generation": {**generation_flights.stats, **generation_claims.stats},
+    }), 200
 
 
 @app.route("/health/ready", methods=["GET"])
 def health_ready():
     """Readiness check — also verifies LiteLLM connectivity."""
     try:
-        resp = requests.get(f"{LITELLM_URL}/health/readiness", timeout=5)
+        # Outside the concurrency bound: a busy provisioner is still ready
+        resp = litellm_session.get(f"{LITELLM_URL}/health/readiness", timeout=(CONNECT_TIMEOUT, 5))
         litellm_ok = resp.status_code == 200
     except Exception:
         litellm_ok = False
@@ -188,71 +970,202 @@ def health_ready():
     return jsonify({"status": status, "litellm": litellm_ok}), code
 
 
-@app.route("/api/v1/keys/workspace", methods=["POST"])
-@require_provisioner_secret
-def create_workspace_key():
-    """
-    Auto-provision a workspace key. Idempotent — returns existing key on restart.
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Warm key pool metrics in Prometheus text format (host-wide, any worker)."""
+    lines = [
+        "# HELP key_provisioner_pool_depth Unassigned pre-generated keys",
+        "# TYPE key_provisioner_pool_depth gauge",
+    ]
+    lines += [f'key_provisioner_pool_depth{{scope="{scope}"}} {n}' for scope, n in key_pool.depth().items()]
+    lines += ["# HELP key_provisioner_pool_target Configured pool size",
+              "# TYPE key_provisioner_pool_target gauge"]
+    lines += [f'key_provisioner_pool_target{{scope="{scope}"}} {n}' for scope, n in key_pool.sizes.items()]
 
-    Body:
-      workspace_id (required): Coder workspace ID
-      username (required): Workspace owner username
-      workspace_name (optional): Human-readable workspace name
-    """
-    body = request.get_json(silent=True) or {}
-    workspace_id = body.get("workspace_id", "").strip()
-    username = body.get("username", "").strip()
-    workspace_name = body.get("workspace_name", "")
-    enforcement_level = body.get("enforcement_level", "standard").strip()
+    assignments, histogram, refills = [], [], []
+    for scope, name, value in sorted(key_pool.stats()):
+        kind, _, source = name.partition(":")
+        labels = f'scope="{scope}",source="{source}"'
+        if kind == "claims":
+            assignments.append(f"key_provisioner_key_assignments_total{{{labels}}} {value:g}")
+        elif kind == "seconds_bucket":
+            source, _, le = source.partition(":")
+            histogram.append(f'key_provisioner_key_assign_seconds_bucket{{scope="{scope}",source="{source}",le="{le}"}} {value:g}')
+        elif kind == "seconds_sum":
+            histogram.append(f"key_provisioner_key_assign_seconds_sum{{{labels}}} {value:g}")
+        elif kind == "seconds_count":
+            histogram.append(f'key_provisioner_key_assign_seconds_bucket{{{labels},le="+Inf"}} {value:g}')
+            histogram.append(f"key_provisioner_key_assign_seconds_count{{{labels}}} {value:g}")
+        elif kind in ("refilled", "refill_errors"):
+            refills.append((kind, f'key_provisioner_pool_{kind}_total{{scope="{scope}"}} {value:g}'))
+    lines += ["# HELP key_provisioner_key_assignments_total Key assignments, by source (pool, generated, pool_fallback, error)",
+              "# TYPE key_provisioner_key_assignments_total counter"] + assignments
+    lines += ["# HELP key_provisioner_key_assign_seconds Time to hand out a new key",
+              "# TYPE key_provisioner_key_assign_seconds histogram"] + histogram
+    for kind, help_text in (("refilled", "Pool keys created by refills"),
+                            ("refill_errors", "Pool keys that refills failed to create")):
+        lines += [f"# HELP key_provisioner_pool_{kind}_total {help_text}",
+                  f"# TYPE key_provisioner_pool_{kind}_total counter"]
+        lines += [line for k, line in refills if k == kind]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def _workspace_request(body):
+    """Validated workspace descriptor from a request body, or (None, error)."""
+    workspace_id = str(body.get("workspace_id") or "").strip()
+    username = str(body.get("username") or "").strip()
+    if not workspace_id or not username:
+        return None, "workspace_id and username are required"
+    enforcement_level = str(body.get("enforcement_level") or "standard").strip()
     if enforcement_level not in ("unrestricted", "standard", "design-first"):
         enforcement_level = "standard"
-    guardrail_action = body.get("guardrail_action", "block").strip()
+    guardrail_action = str(body.get("guardrail_action") or "block").strip()
     if guardrail_action not in ("block", "mask"):
         guardrail_action = "block"
+    return {
+        "workspace_id": workspace_id,
+        "username": username,
+        "workspace_name": body.get("workspace_name", ""),
+        "enforcement_level": enforcement_level,
+        "guardrail_action": guardrail_action,
+    }, None
 
-    if not workspace_id or not username:
-        return jsonify({"error": "workspace_id and username are required"}), 400
 
-    alias = f"workspace-{workspace_id}"
+def _workspace_key_generator(workspace):
+    """generate() for _get_or_generate: a workspace-scoped key for the descriptor."""
     defaults = SCOPE_DEFAULTS["workspace"]
-
-    # Idempotent: check if key already exists
-    existing = _find_existing_key(alias)
-    if existing:
-        log.info("Reusing existing key for workspace=%s user=%s", workspace_id, username)
-        return jsonify({"key": existing, "reused": True})
-
     metadata = {
-        "scope": f"workspace:{workspace_id}",
+        "scope": f"workspace:{workspace['workspace_id']}",
         "key_type": "workspace",
         "created_by": "key-provisioner",
         "created_at": datetime.now(timezone.utc).isoformat(),
-        "workspace_id": workspace_id,
-        "workspace_owner": username,
-        "workspace_name": workspace_name,
+        "workspace_id": workspace["workspace_id"],
+        "workspace_owner": workspace["username"],
+        "workspace_name": workspace["workspace_name"],
         "purpose": "auto-provisioned workspace key",
-        "enforcement_level": enforcement_level,
-        "guardrail_action": guardrail_action,
+        "enforcement_level": workspace["enforcement_level"],
+        "guardrail_action": workspace["guardrail_action"],
     }
-
-    key, err = _generate_key(
+    alias = f"workspace-{workspace['workspace_id']}"
+    return lambda: _assign_key("workspace", alias, workspace["username"], metadata, lambda: _generate_key(
         alias=alias,
-        user_id=username,
+        user_id=workspace["username"],
         budget=defaults["budget"],
         rpm=defaults["rpm"],
         metadata=metadata,
         tpm=defaults.get("tpm"),
         budget_duration=defaults.get("budget_duration"),
         max_parallel_requests=defaults.get("max_parallel_requests"),
-    )
+    ))
+
+
+@app.route("/api/v1/keys/workspace", methods=["POST"])
+@require_provisioner_secret
+def create_workspace_key():
+    """
+    Auto-provision a workspace key. Idempotent — returns existing key on restart.
+
+    Body:
+      workspace_id (required): Coder workspace ID
+      username (required): Workspace owner username
+      workspace_name (optional): Human-readable workspace name
+    """
+    workspace, error = _workspace_request(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"error": error}), 400
+    workspace_id, username = workspace["workspace_id"], workspace["username"]
+
+    # Idempotent: reuses the existing key; concurrent starts share one generation
+    key, err, reused = _get_or_generate(f"workspace-{workspace_id}", _workspace_key_generator(workspace))
     if not key:
         return jsonify({"error": f"Failed to generate key: {err}"}), 502
+    if reused:
+        log.info("Reusing existing key for workspace=%s user=%s", workspace_id, username)
+        return jsonify({"key": key, "reused": True})
 
     log.info("Generated workspace key for workspace=%s user=%s enforcement=%s guardrail_action=%s",
-             workspace_id, username, enforcement_level, guardrail_action)
+             workspace_id, username, workspace["enforcement_level"], workspace["guardrail_action"])
     return jsonify({"key": key, "reused": False}), 201
 
 
+@app.route("/api/v1/keys/workspace/bulk", methods=["POST"])
+@require_provisioner_secret
+def create_workspace_keys_bulk():
+    """
+    Provision keys for many workspaces at once (team onboarding, bootstrap).
+
+    Body: a JSON array of workspace descriptors (as for /api/v1/keys/workspace),
+    {"workspaces": [...]}, or NDJSON with one descriptor per line.
+
+    Existing aliases are resolved with one /key/list pass, missing keys are
+    generated BULK_PARALLELISM at a time, and results stream back as NDJSON
+    in completion order:
+      {"index": 0, "workspace_id": "...", "status": "created" | "reused" | "error", "key": "..."}
+    followed by a {"summary": {...}} line.
+    """
+    if request.mimetype == "application/x-ndjson":
+        try:
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError as e:
+            return jsonify({"error": f"invalid NDJSON: {e}"}), 400
+    else:
+        body = request.get_json(silent=True)
+        items = body.get("workspaces") if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        return jsonify({"error": "expected a list of workspace descriptors"}), 400
+    if len(items) > BULK_MAX_ITEMS:
+        return jsonify({"error": f"at most {BULK_MAX_ITEMS} workspaces per request"}), 413
+
+    # One listing answers "does this alias exist" for the whole batch
+    checked_at = time.time()
+    try:
+        existing = _alias_keys()
+        key_index.reconcile(existing, checked_at)
+    except Exception as e:
+        log.warning("Bulk provisioning falling back to per-alias lookups: %s", e)
+        existing = None
+
+    def provision(index, item):
+        workspace, error = _workspace_request(item if isinstance(item, dict) else {})
+        result = {"index": index, "workspace_id": workspace["workspace_id"] if workspace else None}
+        if error:
+            return {**result, "status": "error", "error": error}
+        alias = f"workspace-{workspace['workspace_id']}"
+        generate = _workspace_key_generator(workspace)
+        try:
+            # Without the claim table a key generated after the listing is only found by a lookup
+            if existing is None or not generation_claims.enabled:
+                key, err, reused = _get_or_generate(alias, generate)
+            elif alias in existing:
+                # The index keeps the value this alias was first handed out with
+                key, err, reused = key_index.get(alias) or existing[alias], None, True
+            else:
+                (key, err, reused), leader = generation_flights.do(
+                    alias, lambda: _claim_and_generate(alias, generate, checked_at))
+                reused = reused or not leader
+        except LiteLLMBusy:
+            key, err, reused = None, "key provisioner is busy", False
+        except Exception as e:
+            key, err, reused = None, str(e), False
+        if not key:
+            return {**result, "status": "error", "error": f"Failed to generate key: {err}"}
+        return {**result, "status": "reused" if reused else "created", "key": key}
+
+    def results():
+        counts = {"created": 0, "reused": 0, "error": 0}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=BULK_PARALLELISM) as pool:
+            futures = [pool.submit(provision, i, item) for i, item in enumerate(items)]
+            for future in as_completed(futures):
+                result = future.result()
+                counts[result["status"]] += 1
+                yield json.dumps(result) + "\n"
+        log.info("Bulk provisioned %d workspaces: %s", len(items), counts)
+        yield json.dumps({"summary": {**counts, "seconds": round(time.monotonic() - started, 3)}}) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+
 @app.route("/api/v1/keys/self-service", methods=["POST"])
 def create_self_service_key():
     """
@@ -270,11 +1183,10 @@ def create_self_service_key():
 
     # Validate Coder session token and get username
     try:
-        resp = requests.get(
+        resp = coder_session.get(
             f"{CODER_URL}/api/v2/users/me",
             headers={"Coder-Session-Token": coder_token},
-            timeout=10,
-            verify=False,
+            timeout=(CONNECT_TIMEOUT, CODER_TIMEOUT),
         )
         if resp.status_code != 200:
             return jsonify({"error": "invalid Coder session token"}), 401
@@ -291,12 +1203,6 @@ def create_self_service_key():
     alias = f"user-{username}"
     defaults = SCOPE_DEFAULTS["user"]
 
-    # Idempotent
-    existing = _find_existing_key(alias)
-    if existing:
-        log.info("Reusing existing self-service key for user=%s", username)
-        return jsonify({"key": existing, "reused": True})
-
     metadata = {
         "scope": f"user:{username}",
         "key_type": "user",
@@ -306,7 +1212,8 @@ def create_self_service_key():
         "purpose": purpose,
     }
 
-    key, err = _generate_key(
+    # Idempotent
+    key, err, reused = _get_or_generate(alias, lambda: _assign_key("user", alias, username, metadata, lambda: _generate_key(
         alias=alias,
         user_id=username,
         budget=defaults["budget"],
@@ -315,9 +1222,12 @@ def create_self_service_key():
         tpm=defaults.get("tpm"),
         budget_duration=defaults.get("budget_duration"),
         max_parallel_requests=defaults.get("max_parallel_requests"),
-    )
+    )))
     if not key:
         return jsonify({"error": f"Failed to generate key: {err}"}), 502
+    if reused:
+        log.info("Reusing existing self-service key for user=%s", username)
+        return jsonify({"key": key, "reused": True})
 
     log.info("Generated self-service key for user=%s", username)
     return jsonify({"key": key, "reused": False}), 201
@@ -330,14 +1240,16 @@ def get_key_info():
     Get key usage/budget info. Authenticated via any valid LiteLLM key.
     """
     try:
-        resp = requests.get(
-            f"{LITELLM_URL}/user/info",
+        resp = _litellm(
+            "GET", "/user/info",
             headers={"Authorization": f"Bearer {request.litellm_key}"},
             timeout=10,
         )
         if resp.status_code != 200:
             return jsonify({"error": "failed to get key info"}), resp.status_code
         return jsonify(resp.json())
+    except LiteLLMBusy:
+        raise
     except Exception as e:
         log.error("Failed to get key info: %s", e)
         return jsonify({"error": "failed to contact LiteLLM"}), 502
@@ -358,12 +1270,7 @@ def reset_user_spend():
         return jsonify({"error": "user_id required"}), 400
 
     # Call LiteLLM /user/update to reset spend to 0
-    resp = requests.post(
-        f"{LITELLM_URL}/user/update",
-        headers=_litellm_headers(),
-        json={"user_id": user_id, "spend": 0},
-        timeout=10,
-    )
+    resp = _litellm("POST", "/user/update", json={"user_id": user_id, "spend": 0}, timeout=10)
     if resp.status_code not in (200, 201):
         log.error("Failed to reset spend for user=%s: %s %s", user_id, resp.status_code, resp.text)
         return jsonify({"error": f"LiteLLM error: {resp.text}"}), resp.status_code
@@ -376,11 +1283,7 @@ def reset_user_spend():
 @require_provisioner_secret
 def list_keys():
     """List all virtual keys with budget/rate-limit status."""
-    resp = requests.get(
-        f"{LITELLM_URL}/key/list",
-        headers=_litellm_headers(),
-        timeout=15,
-    )
+    resp = _litellm("GET", "/key/list")
     if resp.status_code != 200:
         log.error("Failed to list keys: %s %s", resp.status_code, resp.text)
         return jsonify({"error": "failed to list keys"}), resp.status_code
@@ -395,7 +1298,17 @@ if not LITELLM_MASTER_KEY:
     log.warning("LITELLM_MASTER_KEY is not set — key generation will fail")
 if not PROVISIONER_SECRET:
     log.warning("PROVISIONER_SECRET is not set — workspace endpoint is unprotected")
+if not KEY_LOCK_DB and any(size > 0 for size in POOL_SIZES.values()):
+    log.warning("KEY_LOCK_DB is empty — warm key pool disabled (it needs a file shared by the workers)")
+
+# Each gunicorn worker imports the app and keeps its own index
+if KEY_INDEX_ENABLED:
+    threading.Thread(target=_key_index_loop, name="key-index", daemon=True).start()
+# Pools are shared per host; every worker runs the loop, the refill lease picks one
+if key_pool.sizes:
+    threading.Thread(target=_key_pool_loop, name="key-pool", daemon=True).start()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8100, debug=True)
+    # Local development only; containers run gunicorn -c gunicorn.conf.py
+    app.run(host="0.0.0.0", port=8100, debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
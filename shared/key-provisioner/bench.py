@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Key provisioning benchmark: workspace keys provisioned per second.
+
+Starts an in-memory mock of the LiteLLM key API (with configurable
+latency) and the provisioner under gunicorn (gunicorn.conf.py), then
+simulates a workspace start storm: --workspaces distinct workspaces call
+POST /api/v1/keys/workspace with --concurrency in flight. A second round
+repeats the same workspaces (the restart path, which reuses keys).
+With --pool-size the workspace key pool is filled before the storm, so
+new workspaces claim pre-generated keys.
+
+  python bench.py
+  python bench.py --workspaces 1000 --concurrency 128 --latency-ms 50
+  python bench.py --pool-size 500
+  python bench.py --url http://localhost:8100 --secret $PROVISIONER_SECRET   # existing provisioner
+
+With --url the mock is not started and keys are created in the real
+LiteLLM under workspace-bench-* aliases.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------------------------------------------
+# Mock LiteLLM
+# ---------------------------------------------------------------------------
+
+
+class MockLiteLLM:
+    """Just enough of LiteLLM's key management API, keys held in memory."""
+
+    def __init__(self, latency, generate_latency=None):
+        self.latency = latency
+        # /key/generate does more work in LiteLLM than a lookup or update
+        self.generate_latency = latency if generate_latency is None else generate_latency
+        self.keys = {}  # token -> key info
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.in_flight = 0
+        self.peak = 0
+
+    def handle(self, method, path, body):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            route, _, query = path.partition("?")
+            time.sleep(self.generate_latency if route == "/key/generate" else self.latency)
+            return self._route(method, route, body, dict(parse_qsl(query)))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _by_alias(self, alias):
+        return next((info for info in self.keys.values() if info["key_alias"] == alias), None)
+
+    def _route(self, method, path, body, query):
+        if path == "/health/readiness":
+            return 200, {"status": "healthy"}
+        if path == "/key/info":
+            info = self._by_alias(body.get("key_alias"))
+            return (200, {"info": info}) if info else (404, {"error": "key not found"})
+        if path == "/key/generate":
+            token = f"sk-{uuid.uuid4().hex}"
+            with self.lock:
+                self.keys[token] = {**body, "token": token}
+            return 200, {"key": token, "key_alias": body.get("key_alias")}
+        if path == "/key/update":
+            with self.lock:
+                info = self.keys.get(body.get("key"))
+                if info is None:
+                    return 404, {"error": "key not found"}
+                info.update({k: v for k, v in body.items() if k != "key"})
+            return 200, {**info, "key": body["key"]}
+        if path == "/key/delete":
+            with self.lock:
+                doomed = [t for t, info in self.keys.items()
+                          if t in body.get("keys", []) or info["key_alias"] in body.get("key_aliases", [])]
+                for token in doomed:
+                    del self.keys[token]
+            return 200, {"deleted_keys": doomed}
+        if path == "/key/list":
+            page, size = int(query.get("page", 1)), int(query.get("size", 100))
+            keys = list(self.keys.values())
+            return 200, {"keys": keys[(page - 1) * size:page * size], "total_count": len(keys),
+                         "current_page": page, "total_pages": max(1, -(-len(keys) // size))}
+        return 404, {"error": f"{method} {path} not mocked"}
+
+
+def serve_mock(mock, port):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+            status, payload = mock.handle(method, self.path, body)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply("GET")
+
+        def do_POST(self):
+            self._reply("POST")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Load
+# ---------------------------------------------------------------------------
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def storm(url, secret, workspace_ids, concurrency):
+    """Provision every workspace once; returns per-round figures."""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    headers = {"Authorization": f"Bearer {secret}"}
+    latencies, statuses, reused = [], {}, [0]
+    lock = threading.Lock()
+
+    def provision(workspace_id):
+        start = time.perf_counter()
+        try:
+            resp = session.post(f"{url}/api/v1/keys/workspace", headers=headers, timeout=60,
+                                json={"workspace_id": workspace_id, "username": "bench"})
+            status = resp.status_code
+            was_reused = status == 200 and resp.json().get("reused")
+        except requests.RequestException:
+            status, was_reused = "error", False
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            reused[0] += bool(was_reused)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(provision, workspace_ids))
+    elapsed = time.perf_counter() - start
+    ok = statuses.get("200", 0) + statuses.get("201", 0)
+    return {
+        "requests": len(workspace_ids),
+        "seconds": round(elapsed, 3),
+        "keys_per_second": round(ok / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "reused": reused[0],
+        "status": statuses,
+    }
+
+
+def wait_healthy(url):
+    for _ in range(100):
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    sys.exit(f"Timed out waiting for {url}")
+
+
+def wait_pool(url, scope, size):
+    """Wait until the provisioner's /metrics reports the pool full."""
+    deadline = time.monotonic() + 300
+    line = f'key_provisioner_pool_depth{{scope="{scope}"}}'
+    while time.monotonic() < deadline:
+        for row in requests.get(f"{url}/metrics", timeout=5).text.splitlines():
+            if row.startswith(line) and float(row.split()[-1]) >= size:
+                return
+        time.sleep(0.5)
+    sys.exit(f"Timed out waiting for a {scope} pool of {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Key provisioner start-storm benchmark")
+    parser.add_argument("--workspaces", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Mock LiteLLM latency per call")
+    parser.add_argument("--generate-latency-ms", type=float, help="Mock /key/generate latency (default: --latency-ms)")
+    parser.add_argument("--workers", default=os.environ.get("GUNICORN_WORKERS", "2"))
+    parser.add_argument("--threads", default=os.environ.get("GUNICORN_THREADS", "16"))
+    parser.add_argument("--pool-size", type=int, default=0, help="Workspace key pool to fill before the storm")
+    parser.add_argument("--mock-port", type=int, default=9400)
+    parser.add_argument("--port", type=int, default=8105)
+    parser.add_argument("--url", help="Benchmark a running provisioner instead")
+    parser.add_argument("--secret", default=os.environ.get("PROVISIONER_SECRET", "bench-secret"))
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    mock, provisioner = None, None
+    url = args.url
+    if url is None:
+        generate_ms = args.latency_ms if args.generate_latency_ms is None else args.generate_latency_ms
+        mock = MockLiteLLM(args.latency_ms / 1000, generate_ms / 1000)
+        serve_mock(mock, args.mock_port)
+        env = {
+            **os.environ,
+            "LITELLM_URL": f"http://127.0.0.1:{args.mock_port}",
+            "LITELLM_MASTER_KEY": "sk-bench",
+            "PROVISIONER_SECRET": args.secret,
+            "PORT": str(args.port),
+            "GUNICORN_WORKERS": str(args.workers),
+            "GUNICORN_THREADS": str(args.threads),
+            "WORKSPACE_POOL_SIZE": str(args.pool_size),
+            # A private claim table / pool, not one left behind by an earlier run
+            "KEY_LOCK_DB": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        }
+        provisioner = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+            cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_healthy(url)
+        if args.pool_size:
+            wait_pool(url, "workspace", args.pool_size)
+        run_id = uuid.uuid4().hex[:8]
+        workspace_ids = [f"bench-{run_id}-{i}" for i in range(args.workspaces)]
+        results = {"cold": storm(url, args.secret, workspace_ids, args.concurrency),
+                   "restart": storm(url, args.secret, workspace_ids, args.concurrency)}
+    finally:
+        if provisioner is not None:
+            provisioner.send_signal(signal.SIGTERM)
+            provisioner.wait(timeout=15)
+
+    print(f"{'round':<8} {'reqs':>6} {'keys/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'reused':>7}  status")
+    for name, row in results.items():
+        print(f"{name:<8} {row['requests']:>6} {row['keys_per_second']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['reused']:>7}  {row['status']}")
+    if mock is not None:
+        results["litellm"] = {"calls": mock.calls, "peak_concurrency": mock.peak, "keys": len(mock.keys)}
+        print(f"mock LiteLLM: {mock.calls}, peak concurrency {mock.peak}, {len(mock.keys)} keys")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
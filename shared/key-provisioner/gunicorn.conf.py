@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for the key provisioner.
+
+Threaded workers (gthread): each worker process keeps its own pooled
+sessions to LiteLLM and Coder, and each thread serves one request, so a
+workspace start storm is handled WORKERS x THREADS requests at a time.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8100')}"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# Longest LiteLLM call plus queueing for a LiteLLM slot
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 10
+keepalive = 5
+loglevel = os.environ.get("LOG_LEVEL", "info")
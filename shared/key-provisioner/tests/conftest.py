@@ -0,0 +1,17 @@
+"""
+Unit tests for the key provisioner.
+Run with: pytest shared/key-provisioner/tests -q
+"""
+
+import os
+import sys
+import tempfile
+
+# Importing app starts no background work and reaches no real LiteLLM
+os.environ.setdefault("LITELLM_URL", "http://127.0.0.1:9")
+os.environ.setdefault("KEY_INDEX_ENABLED", "false")
+os.environ.setdefault("WORKSPACE_POOL_SIZE", "0")
+os.environ.setdefault("KEY_LOCK_DB", os.path.join(tempfile.mkdtemp(prefix="key-provisioner-tests-"), "locks.db"))
+os.environ.setdefault("PROVISIONER_SECRET", "test-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
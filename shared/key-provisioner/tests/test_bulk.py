@@ -0,0 +1,97 @@
+"""POST /api/v1/keys/workspace/bulk: body formats, limits and per-item results."""
+
+import json
+
+import pytest
+
+import app as provisioner
+
+AUTH = {"Authorization": "Bearer test-secret"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    generated = []
+
+    def claim_and_generate(alias, generate, checked_at):
+        generated.append(alias)
+        return f"sk-new-{alias}", None, False
+
+    monkeypatch.setattr(provisioner, "_alias_keys", lambda: {"workspace-ws-old": "sk-old"})
+    monkeypatch.setattr(provisioner, "_claim_and_generate", claim_and_generate)
+    client = provisioner.app.test_client()
+    client.generated = generated
+    return client
+
+
+def results(resp):
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    return sorted(lines[:-1], key=lambda r: r["index"]), lines[-1]["summary"]
+
+
+class TestBulkProvisioning:
+    def test_json_array(self, client):
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH, json=[
+            {"workspace_id": "ws-old", "username": "alice"},
+            {"workspace_id": "ws-new", "username": "bob"},
+        ])
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/x-ndjson"
+        items, summary = results(resp)
+        assert [(r["status"], r["key"]) for r in items] == [("reused", "sk-old"), ("created", "sk-new-workspace-ws-new")]
+        assert summary["created"] == 1 and summary["reused"] == 1 and summary["error"] == 0
+        assert client.generated == ["workspace-ws-new"]
+
+    def test_workspaces_object(self, client):
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH,
+                           json={"workspaces": [{"workspace_id": "ws-new", "username": "bob"}]})
+        items, _ = results(resp)
+        assert items[0]["status"] == "created"
+
+    def test_ndjson(self, client):
+        body = '{"workspace_id": "ws-a", "username": "a"}\n\n{"workspace_id": "ws-b", "username": "b"}\n'
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH, data=body,
+                           content_type="application/x-ndjson")
+        items, summary = results(resp)
+        assert [r["workspace_id"] for r in items] == ["ws-a", "ws-b"]
+        assert summary["created"] == 2
+
+    def test_invalid_items_are_reported_not_fatal(self, client):
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH,
+                           json=[{"workspace_id": "ws-a"}, "nonsense", {"workspace_id": "ws-b", "username": "b"}])
+        items, summary = results(resp)
+        assert [r["status"] for r in items] == ["error", "error", "created"]
+        assert summary["error"] == 2
+
+    def test_invalid_ndjson_is_rejected(self, client):
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH, data="{not json\n",
+                           content_type="application/x-ndjson")
+        assert resp.status_code == 400
+
+    def test_non_list_body_is_rejected(self, client):
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH, json={"workspace_id": "ws-a"})
+        assert resp.status_code == 400
+
+    def test_too_many_items(self, client, monkeypatch):
+        monkeypatch.setattr(provisioner, "BULK_MAX_ITEMS", 2)
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH,
+                           json=[{"workspace_id": f"ws-{i}", "username": "u"} for i in range(3)])
+        assert resp.status_code == 413
+
+    def test_requires_provisioner_secret(self, client):
+        resp = client.post("/api/v1/keys/workspace/bulk", json=[])
+        assert resp.status_code == 401
+
+    def test_without_claims_missing_aliases_are_looked_up_first(self, client, monkeypatch):
+        monkeypatch.setattr(provisioner.generation_claims, "enabled", False)
+        # Generated by another worker after the listing
+        monkeypatch.setattr(provisioner, "_find_existing_key",
+                            lambda alias: "sk-theirs" if alias == "workspace-ws-late" else None)
+        resp = client.post("/api/v1/keys/workspace/bulk", headers=AUTH, json=[
+            {"workspace_id": "ws-late", "username": "alice"},
+            {"workspace_id": "ws-new", "username": "bob"},
+        ])
+        items, _ = results(resp)
+        assert [(r["status"], r["key"]) for r in items] == [("reused", "sk-theirs"),
+                                                            ("created", "sk-new-workspace-ws-new")]
+        assert client.generated == ["workspace-ws-new"]
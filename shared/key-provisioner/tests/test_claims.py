@@ -0,0 +1,143 @@
+"""Cross-worker generation claims and existing-key lookups (GenerationClaims, _claim_and_generate)."""
+
+import time
+
+import pytest
+import requests
+
+import app as provisioner
+from app import GenerationClaims, HostDB, KeyLookupFailed
+
+AUTH = {"Authorization": "Bearer test-secret"}
+OTHER_WORKER = 1
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = str(self.body)
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def claims(tmp_path, monkeypatch):
+    claims = GenerationClaims(HostDB(str(tmp_path / "locks.db")), timeout=1.0)
+    monkeypatch.setattr(provisioner, "generation_claims", claims)
+    return claims
+
+
+def other_worker_claim(claims, alias, started_at, done_at=None):
+    claims.db.conn().execute("INSERT INTO claims (alias, owner, started_at, done_at) VALUES (?, ?, ?, ?)",
+                             (alias, OTHER_WORKER, started_at, done_at))
+
+
+def key_info(monkeypatch, *answers):
+    """Serve /key/info answers in order (a FakeResponse, or an exception to raise)."""
+    answers = list(answers)
+
+    def litellm(method, path, **kwargs):
+        assert path == "/key/info"
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(provisioner, "_litellm", litellm)
+    return answers
+
+
+class Generator:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"sk-generated-{self.calls}", None
+
+
+class TestClaim:
+    def test_one_worker_wins_a_new_alias(self, claims):
+        assert claims.claim("workspace-a", time.time())
+        assert not claims.claim("workspace-a", time.time())
+
+    def test_abandoned_claim_expires(self, claims):
+        other_worker_claim(claims, "workspace-a", time.time() - 2)
+        assert claims.claim("workspace-a", time.time())
+        assert claims.stats["taken_over"] == 1
+
+    def test_claim_in_progress_is_not_taken_over(self, claims):
+        other_worker_claim(claims, "workspace-a", time.time() - 0.5)
+        assert not claims.claim("workspace-a", time.time())
+
+    def test_done_claim_is_taken_over_only_after_a_later_check(self, claims):
+        done_at = time.time()
+        other_worker_claim(claims, "workspace-a", done_at - 0.5, done_at)
+        assert not claims.claim("workspace-a", done_at - 1)
+        assert claims.claim("workspace-a", done_at + 0.001)
+
+    def test_failed_generation_releases_the_claim(self, claims):
+        assert claims.claim("workspace-a", time.time())
+        claims.finish("workspace-a", ok=False)
+        assert claims.wait("workspace-a") == "released"
+
+
+class TestFindExistingKey:
+    def test_found(self, monkeypatch):
+        key_info(monkeypatch, FakeResponse(200, {"info": {"token": "sk-a"}}))
+        assert provisioner._find_existing_key("workspace-a") == "sk-a"
+
+    @pytest.mark.parametrize("answer", [FakeResponse(404), FakeResponse(200, {"info": {}})],
+                             ids=["404", "empty"])
+    def test_confirmed_missing(self, monkeypatch, answer):
+        key_info(monkeypatch, answer)
+        assert provisioner._find_existing_key("workspace-a") is None
+
+    @pytest.mark.parametrize("answer", [FakeResponse(500), FakeResponse(401), requests.ReadTimeout("slow")],
+                             ids=["500", "401", "timeout"])
+    def test_lookup_failure_raises(self, monkeypatch, answer):
+        key_info(monkeypatch, answer)
+        with pytest.raises(KeyLookupFailed):
+            provisioner._find_existing_key("workspace-a")
+
+
+class TestClaimAndGenerate:
+    def test_done_claim_with_key_is_reused(self, claims, monkeypatch):
+        other_worker_claim(claims, "workspace-a", time.time(), time.time())
+        key_info(monkeypatch, FakeResponse(200, {"info": {"token": "sk-theirs"}}))
+        generate = Generator()
+        # This caller's own check came before the other worker finished
+        assert provisioner._claim_and_generate("workspace-a", generate, 0) == ("sk-theirs", None, True)
+        assert generate.calls == 0
+
+    def test_done_claim_is_taken_over_when_the_key_is_confirmed_missing(self, claims, monkeypatch):
+        other_worker_claim(claims, "workspace-a", time.time(), time.time())
+        key_info(monkeypatch, FakeResponse(404))
+        generate = Generator()
+        assert provisioner._claim_and_generate("workspace-a", generate, 0) == ("sk-generated-1", None, False)
+        assert claims.stats["taken_over"] == 1
+
+    @pytest.mark.parametrize("answer", [FakeResponse(503), requests.ConnectionError("refused")],
+                             ids=["503", "connection"])
+    def test_lookup_failure_does_not_take_over(self, claims, monkeypatch, answer):
+        other_worker_claim(claims, "workspace-a", time.time(), time.time())
+        key_info(monkeypatch, answer)
+        generate = Generator()
+        with pytest.raises(KeyLookupFailed):
+            provisioner._claim_and_generate("workspace-a", generate, 0)
+        assert generate.calls == 0
+        assert claims.stats["taken_over"] == 0
+
+
+class TestWorkspaceEndpoint:
+    def test_lookup_failure_is_a_502_without_generating(self, claims, monkeypatch):
+        key_info(monkeypatch, FakeResponse(500))
+        generated = []
+        monkeypatch.setattr(provisioner, "_claim_and_generate", lambda *a: generated.append(a))
+        resp = provisioner.app.test_client().post(
+            "/api/v1/keys/workspace", headers=AUTH, json={"workspace_id": "ws-a", "username": "alice"})
+        assert resp.status_code == 502
+        assert "could not check for an existing key" in resp.get_json()["error"]
+        assert generated == []
@@ -0,0 +1,50 @@
+"""Single-flight generation within a worker (SingleFlight)."""
+
+import threading
+
+import pytest
+
+from app import SingleFlight
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def generate():
+            calls.append(1)
+            release.wait(5)
+            return "sk-1"
+
+        def caller():
+            results.append(flights.do("workspace-a", generate))
+
+        threads = [threading.Thread(target=caller) for _ in range(5)]
+        for t in threads:
+            t.start()
+        while flights.stats["coalesced"] < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert len(calls) == 1
+        assert sorted(results) == [("sk-1", False)] * 4 + [("sk-1", True)]
+
+    def test_error_is_raised_and_not_remembered(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise RuntimeError("LiteLLM down")
+
+        with pytest.raises(RuntimeError):
+            flights.do("workspace-a", fail)
+        assert flights.do("workspace-a", lambda: "sk-2") == ("sk-2", True)
+
+    def test_different_keys_do_not_wait_on_each_other(self):
+        flights = SingleFlight()
+        assert flights.do("a", lambda: 1) == (1, True)
+        assert flights.do("b", lambda: 2) == (2, True)
+        assert flights.stats == {"leaders": 2, "coalesced": 0}
@@ -0,0 +1,92 @@
+"""Alias -> key index: reconciliation, expiry and invalidation (KeyIndex)."""
+
+import hashlib
+import time
+
+import pytest
+
+import app as provisioner
+from app import KeyIndex
+
+
+def sha256(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+@pytest.fixture
+def index():
+    return KeyIndex(enabled=True, ttl=60)
+
+
+class TestReconcile:
+    def test_listed_hash_confirms_the_key_handed_out(self, index):
+        index.put("workspace-a", "sk-a")
+        index._entries["workspace-a"] = ("sk-a", time.time() - 120)
+        started = time.time()
+        index.reconcile({"workspace-a": sha256("sk-a")}, started)
+        assert index._entries["workspace-a"] == ("sk-a", started)
+        assert index.get("workspace-a") == "sk-a"
+
+    def test_rotated_key_is_replaced(self, index):
+        index._entries["workspace-a"] = ("sk-revoked", time.time() - 10)
+        index.reconcile({"workspace-a": "sk-rotated"}, time.time())
+        assert index.get("workspace-a") == "sk-rotated"
+        assert index.stats["replaced"] == 1
+
+    def test_deleted_alias_is_dropped(self, index):
+        index._entries["workspace-a"] = ("sk-revoked", time.time() - 10)
+        index.reconcile({}, time.time())
+        assert index.get("workspace-a") is None
+
+    def test_keys_generated_during_the_listing_are_kept(self, index):
+        started = time.time()
+        index.put("workspace-new", "sk-new")
+        index.put("workspace-a", "sk-regenerated")
+        index.reconcile({"workspace-a": "sk-old"}, started)
+        assert index.get("workspace-new") == "sk-new"
+        assert index.get("workspace-a") == "sk-regenerated"
+
+
+class TestExpiry:
+    def test_unconfirmed_entry_is_a_miss(self, index):
+        index._entries["workspace-a"] = ("sk-a", time.time() - 61)
+        assert index.get("workspace-a") is None
+        assert index.stats["stale"] == 1
+
+    def test_entries_loaded_from_disk_wait_for_confirmation(self, tmp_path):
+        path = tmp_path / "index.json"
+        path.write_text('{"workspace-a": "sk-a"}')
+        index = KeyIndex(enabled=True, path=str(path), ttl=60)
+        index.load()
+        assert index.get("workspace-a") is None
+        index.reconcile({"workspace-a": sha256("sk-a")}, time.time())
+        assert index.get("workspace-a") == "sk-a"
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+
+    def json(self):
+        return self.body
+
+
+class TestLookup:
+    @pytest.fixture(autouse=True)
+    def live_index(self, monkeypatch, index):
+        monkeypatch.setattr(provisioner, "key_index", index)
+
+    def test_stale_entry_is_revalidated(self, monkeypatch, index):
+        index._entries["workspace-a"] = ("sk-a", time.time() - 61)
+        monkeypatch.setattr(provisioner, "_litellm",
+                            lambda *a, **kw: FakeResponse(200, {"info": {"token": "sk-a"}}))
+        assert provisioner._find_existing_key("workspace-a") == "sk-a"
+        assert index.get("workspace-a") == "sk-a"
+
+    def test_revoked_key_is_invalidated(self, monkeypatch, index):
+        index._entries["workspace-a"] = ("sk-revoked", time.time() - 61)
+        monkeypatch.setattr(provisioner, "_litellm", lambda *a, **kw: FakeResponse(404))
+        assert provisioner._find_existing_key("workspace-a") is None
+        assert "workspace-a" not in index._entries
+        assert index.stats["invalidated"] == 1
@@ -0,0 +1,242 @@
+"""Warm key pool: take, hand back, refill and assignment outcomes (KeyPool, _assign_key)."""
+
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pytest
+import requests
+
+import app as provisioner
+from app import HostDB, KeyPool, LiteLLMBusy
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = str(self.body)
+
+    def json(self):
+        return self.body
+
+
+class FakeLiteLLM:
+    """Routes _litellm calls to per-path handlers; records the calls."""
+
+    def __init__(self, monkeypatch):
+        self.routes = {"/key/generate": self.generate}
+        self.calls = []
+        self.generated = 0
+        monkeypatch.setattr(provisioner, "_litellm", self)
+
+    def __call__(self, method, path, headers=None, timeout=None, **kwargs):
+        self.calls.append((path, kwargs.get("json")))
+        return self.routes[path](kwargs.get("json"))
+
+    def generate(self, body):
+        self.generated += 1
+        return FakeResponse(200, {"key": f"sk-gen-{self.generated}", "key_alias": body["key_alias"]})
+
+
+@pytest.fixture
+def litellm(monkeypatch):
+    return FakeLiteLLM(monkeypatch)
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pool = KeyPool(HostDB(str(tmp_path / "locks.db")), {"workspace": 2, "user": 0}, "host-a")
+    monkeypatch.setattr(provisioner, "key_pool", pool)
+    return pool
+
+
+def pooled_keys(pool):
+    return [row[0] for row in pool.db.conn().execute("SELECT key FROM pool ORDER BY created_at")]
+
+
+def outcomes(pool):
+    """Recorded assignments by source."""
+    return {name.partition(":")[2]: value for scope, name, value in pool.stats() if name.startswith("claims:")}
+
+
+def assign(generated):
+    def generate():
+        generated.append(1)
+        return "sk-fallback", None
+    return provisioner._assign_key("workspace", "workspace-ws-1", "alice", {"scope": "workspace"}, generate)
+
+
+class TestTakeAndRefill:
+    def test_refill_tops_up_and_take_claims_the_oldest(self, pool, litellm):
+        pool.refill()
+        assert pool.depth() == {"workspace": 2}
+        first, second = pooled_keys(pool)
+        alias, key = pool.take("workspace")
+        assert key == first and alias.startswith(pool.prefix)
+        assert pool.wanted.is_set()
+        assert pooled_keys(pool) == [second]
+        pool.refill()
+        assert pool.depth() == {"workspace": 2}
+        assert litellm.generated == 3
+
+    def test_empty_or_unpooled_scope(self, pool):
+        assert pool.take("workspace") is None
+        assert pool.take("user") is None
+        assert pool.depth() == {"workspace": 0}
+
+    def test_handed_back_key_is_pooled_again(self, pool, litellm):
+        pool.refill()
+        alias, key = pool.take("workspace")
+        pool.add("workspace", alias, key)
+        assert sorted(pooled_keys(pool)) == ["sk-gen-1", "sk-gen-2"]
+
+
+class TestAssign:
+    @pytest.fixture(autouse=True)
+    def filled(self, pool, litellm):
+        pool.refill()
+
+    def test_pooled_key_is_assigned(self, pool, litellm):
+        litellm.routes["/key/update"] = lambda body: FakeResponse(200, body)
+        generated = []
+        assert assign(generated) == ("sk-gen-1", None)
+        assert generated == [] and pooled_keys(pool) == ["sk-gen-2"]
+        assert litellm.calls[-1] == ("/key/update", {"key": "sk-gen-1", "key_alias": "workspace-ws-1",
+                                                     "user_id": "alice", "metadata": {"scope": "workspace"}})
+        assert outcomes(pool) == {"pool": 1}
+
+    def test_refused_update_hands_the_key_back(self, pool, litellm):
+        litellm.routes["/key/update"] = lambda body: FakeResponse(500, {"error": "db down"})
+        generated = []
+        assert assign(generated) == ("sk-fallback", None)
+        assert generated == [1]
+        assert sorted(pooled_keys(pool)) == ["sk-gen-1", "sk-gen-2"]
+        assert outcomes(pool) == {"pool_fallback": 1}
+
+    @pytest.mark.parametrize("status", [400, 404])
+    def test_refused_update_for_a_deleted_key_drops_it(self, pool, litellm, status):
+        litellm.routes["/key/update"] = lambda body: FakeResponse(status, {"error": "key not found"})
+        generated = []
+        assert assign(generated) == ("sk-fallback", None)
+        assert generated == [1]
+        assert pooled_keys(pool) == ["sk-gen-2"]
+        assert outcomes(pool) == {"pool_fallback": 1}
+
+    def test_busy_hands_the_key_back(self, pool, litellm):
+        def busy(body):
+            raise LiteLLMBusy()
+        litellm.routes["/key/update"] = busy
+        with pytest.raises(LiteLLMBusy):
+            assign([])
+        assert sorted(pooled_keys(pool)) == ["sk-gen-1", "sk-gen-2"]
+        assert outcomes(pool) == {"error": 1}
+
+    def test_timed_out_update_that_was_applied_is_not_duplicated(self, pool, litellm):
+        def timed_out(body):
+            raise requests.ReadTimeout("no answer")
+        litellm.routes["/key/update"] = timed_out
+        litellm.routes["/key/info"] = lambda body: FakeResponse(200, {"info": {"token": "sk-gen-1"}})
+        generated = []
+        assert assign(generated) == ("sk-gen-1", None)
+        assert generated == []
+        assert pooled_keys(pool) == ["sk-gen-2"]
+        assert outcomes(pool) == {"pool": 1}
+
+    def test_timed_out_update_that_was_not_applied_falls_back(self, pool, litellm):
+        def timed_out(body):
+            raise requests.ReadTimeout("no answer")
+        litellm.routes["/key/update"] = timed_out
+        litellm.routes["/key/info"] = lambda body: FakeResponse(404)
+        generated = []
+        assert assign(generated) == ("sk-fallback", None)
+        assert generated == [1]
+        # Its state in LiteLLM is uncertain: left for orphan collection, not pooled again
+        assert pooled_keys(pool) == ["sk-gen-2"]
+        assert outcomes(pool) == {"pool_fallback": 1}
+
+    def test_empty_pool_generates(self, pool, litellm):
+        pool.db.conn().execute("DELETE FROM pool")
+        assert assign([]) == ("sk-fallback", None)
+        assert outcomes(pool) == {"generated": 1}
+
+    def test_failed_generation_is_one_error(self, pool, litellm):
+        litellm.routes["/key/update"] = lambda body: FakeResponse(500)
+        result = provisioner._assign_key("workspace", "workspace-ws-1", "alice", {}, lambda: (None, "quota"))
+        assert result == (None, "quota")
+        assert outcomes(pool) == {"error": 1}
+
+
+def pool_key(alias, owner, instance, created):
+    return {"key_alias": alias, "token": f"hash-{alias}", "metadata": {
+        "key_type": "pool", "pool_owner": owner, "pool_instance": instance,
+        "created_at": datetime.fromtimestamp(created, timezone.utc).isoformat(),
+    }}
+
+
+class TestCollectOrphans:
+    def test_only_keys_this_owner_lost_are_deleted(self, pool, litellm, monkeypatch):
+        pool.refill()
+        instance, since = pool.instance()
+        listed_alias = pool.take("workspace")[0]
+        pool.add("workspace", listed_alias, "sk-gen-1")
+        now = time.time()
+        keys = [
+            pool_key(listed_alias, "host-a", instance, now),
+            pool_key("pool-host-a-workspace-abandoned", "host-a", instance, now - 1200),
+            pool_key("pool-host-a-workspace-refilling", "host-a", instance, now - 60),
+            pool_key("pool-host-a-workspace-lost-file", "host-a", "old-instance", since - 3600),
+            pool_key("pool-host-a-workspace-other-file", "host-a", "other-instance", since + 1),
+            pool_key("pool-host-b-workspace-1", "host-b", "b-instance", since - 3600),
+            {"key_alias": "workspace-ws-1", "token": "hash-ws-1", "metadata": {"scope": "workspace"}},
+        ]
+        monkeypatch.setattr(provisioner, "_list_keys", lambda: keys)
+        deleted = []
+
+        def delete(body):
+            deleted.extend(body["key_aliases"])
+            return FakeResponse(200)
+
+        litellm.routes["/key/delete"] = delete
+        pool.collect_orphans()
+        assert sorted(deleted) == ["pool-host-a-workspace-abandoned", "pool-host-a-workspace-lost-file"]
+
+    def test_pooled_keys_litellm_no_longer_lists_are_dropped(self, pool, litellm, monkeypatch):
+        pool.refill()
+        live = pool.take("workspace")[0]
+        pool.add("workspace", live, "sk-gen-1")
+        instance, _ = pool.instance()
+        monkeypatch.setattr(provisioner, "_list_keys", lambda: [pool_key(live, "host-a", instance, time.time())])
+        pool.wanted.clear()
+        pool.collect_orphans()
+        assert pooled_keys(pool) == ["sk-gen-1"]
+        assert pool.wanted.is_set()
+
+    def test_key_mid_assignment_is_not_an_orphan(self, pool, litellm, monkeypatch):
+        pool.refill()
+        instance, _ = pool.instance()
+        old = time.time() - 1200
+        aliases = [row[0] for row in pool.db.conn().execute("SELECT alias FROM pool")]
+        # Claimed before the listing; its /key/update has not landed yet
+        pool.take("workspace")
+        monkeypatch.setattr(provisioner, "_list_keys",
+                            lambda: [pool_key(alias, "host-a", instance, old) for alias in aliases])
+        deleted = []
+        litellm.routes["/key/delete"] = lambda body: deleted.extend(body["key_aliases"]) or FakeResponse(200)
+        pool.collect_orphans()
+        assert deleted == []
+        assert pool.depth() == {"workspace": 1}
+
+    def test_pool_file_keeps_its_instance(self, pool):
+        assert pool.instance() == pool.instance()
+        assert KeyPool(pool.db, {}, "host-a").instance() == pool.instance()
+
+    def test_pool_is_disabled_without_a_shared_lock_db(self):
+        env = {**os.environ, "KEY_LOCK_DB": "", "WORKSPACE_POOL_SIZE": "10"}
+        out = subprocess.run([sys.executable, "-c", "import app; print(app.key_pool.sizes)"], env=env,
+                             cwd=os.path.dirname(os.path.abspath(provisioner.__file__)),
+                             capture_output=True, text=True, timeout=30)
+        assert out.stdout.strip() == "{}"
+        assert "warm key pool disabled" in out.stderr